@@ -0,0 +1,91 @@
+# bench_log_events.py
+"""
+日志行分类微基准：对比旧的逐行 re.sub + re.search 链与 LineClassifier
+
+用法: python bench_log_events.py [日志文件(.log/.log.gz) ...] [-n 总行数]
+不指定日志文件时使用 bench_corpus/ 下录制的 Paper 控制台样本。
+"""
+
+import os
+import re
+import sys
+import gzip
+import time
+import argparse
+
+from mc_log_events import LineClassifier
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_corpus")
+
+
+def load_corpus(paths):
+    lines = []
+    for p in paths:
+        opener = gzip.open if p.endswith(".gz") else open
+        with opener(p, 'rt', encoding='utf-8', errors='replace') as f:
+            lines.extend(l.rstrip() for l in f)
+    return [l for l in lines if l]
+
+
+def legacy_classify(line, state):
+    """基线：原 poll_stdout_queue / _parse_log_line_for_players 的逐行未编译正则"""
+    if re.search(r"\bDone\s*\(", line):
+        state["done"] += 1
+    clean_line = re.sub(r'\x1b\[[0-9;]*m', '', line)
+    if re.search(r"\b(\w+)\s+joined the game", clean_line):
+        state["join"] += 1
+        return
+    if re.search(r"\b(\w+)\s+left the game", clean_line):
+        state["leave"] += 1
+        return
+    if "players online:" in clean_line:
+        if re.search(r"players online:\s+(.*)", clean_line):
+            state["list"] += 1
+
+
+def bench(name, fn, lines, rounds):
+    best = None
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        fn(lines)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    print(f"{name:<24} {best * 1000:9.1f} ms   {len(lines) / best / 1e6:6.2f} M 行/秒")
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日志行分类微基准")
+    parser.add_argument("logs", nargs="*", help="录制的控制台日志，默认使用 bench_corpus/*.log")
+    parser.add_argument("-n", "--lines", type=int, default=500000, help="基准总行数 (语料会循环复制)")
+    parser.add_argument("-r", "--rounds", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    paths = args.logs or sorted(os.path.join(CORPUS_DIR, f) for f in os.listdir(CORPUS_DIR)
+                                if f.endswith(".log") or f.endswith(".log.gz"))
+    corpus = load_corpus(paths)
+    if not corpus:
+        print("语料为空", file=sys.stderr)
+        return 1
+    lines = (corpus * (args.lines // len(corpus) + 1))[:args.lines]
+    print(f"语料: {len(corpus)} 行 x 循环 -> {len(lines)} 行")
+
+    def run_legacy(ls):
+        state = {"done": 0, "join": 0, "leave": 0, "list": 0}
+        for l in ls: legacy_classify(l, state)
+
+    classifier = LineClassifier()
+    t_old = bench("旧: 逐行 re.search 链", run_legacy, lines, args.rounds)
+    t_new = bench("新: LineClassifier", classifier.feed, lines, args.rounds)
+    print(f"加速比: {t_old / t_new:.2f}x")
+
+    counts = {}
+    for l in corpus:
+        ev = classifier.classify(l)
+        if ev: counts[ev.kind] = counts.get(ev.kind, 0) + 1
+    print("语料事件分布:", ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2023 @@
+# mc_backup.py
+"""
+世界备份引擎 (不依赖 GUI)
+
+备份目录结构: <备份根目录>/<服务器名>/backup-YYYYMMDD-HHMMSS_<类型>/<世界文件夹>/...
+增量模式下，与上一个快照相比大小和修改时间都未变化的文件直接硬链接到上一个快照，
+每个快照目录仍然是完整的世界，可以直接复制还原。
+去重模式下，文件被切成固定大小的数据块存入 <服务器名>/.repo/，快照只是一个清单文件。
+归档模式下，每个快照是一个流式写出的压缩 tar 文件 (gzip，安装 zstandard 后可选 zstd)。
+区域差量模式下，快照仍是目录，但 .mca 被替换为只含变化区块的 .mca.delta，还原时沿基准链重建。
+服务器运行时可先对世界做写时复制快照 (btrfs 子卷快照 / reflink)，立即恢复自动保存，再从快照慢慢备份。
+保留策略为祖父-父-子 (GFS) 分层：最近 N 个 + 每小时/每天/每周/每月各保留最新的一个。
+每个服务器的备份目录下有一份 .catalog.jsonl，记录写入时的大小、文件数、世界列表与校验状态，列表页无需遍历快照。
+选择性还原只写回选中的维度 / 区域范围 / 玩家数据文件，其它数据保持不动。
+整体还原先把备份暂存到服务器目录下，再用重命名换入；被换下的世界保留为 "撤销还原" 点。
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import gzip
+import zlib
+import queue
+import tarfile
+import stat
+import time
+import errno
+import shutil
+import struct
+import fnmatch
+import hashlib
+import ctypes
+import platform
+import threading
+import datetime
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:  # zstd 为可选依赖: pip install zstandard
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 reflink
+    fcntl = None
+
+BACKUP_NAME_RE = re.compile(r"backup-(\d{8})-(\d{6})_(\w+)")
+
+# 备份模式
+MODE_FULL = "full"
+MODE_INCREMENTAL = "incremental"
+
+BACKUP_MODES = {
+    MODE_INCREMENTAL: "增量 (硬链接未变化文件)",
+    MODE_FULL: "完整复制",
+}
+DEFAULT_BACKUP_MODE = MODE_INCREMENTAL
+
+# 复制线程数：NVMe / RAID 上单线程远远跑不满带宽，大量小 .dat 文件也需要并发摊薄单文件延迟
+COPY_WORKERS = min(32, (os.cpu_count() or 4) * 2)
+
+
+class CopyStats:
+    """一次复制的统计：复制/硬链接的文件数与字节数、耗时与吞吐量 (可被多个复制线程同时更新)"""
+
+    def __init__(self, reuse_label="硬链接", throttle=None):
+        self.reuse_label = reuse_label
+        self.throttle = throttle
+        self.copied_files = 0
+        self.copied_bytes = 0
+        self.linked_files = 0
+        self.linked_bytes = 0
+        self.started = time.monotonic()
+        self._paused0 = throttle.paused_total if throttle else 0.0
+        self._lock = threading.Lock()
+
+    def io(self, size):
+        """即将读写 size 字节：有节流器时按限速/卡顿暂停等待"""
+        if self.throttle is not None:
+            self.throttle.consume(size)
+
+    def worker_init(self):
+        """复制线程的初始化函数：要求低优先级时降低线程的 CPU / I/O 优先级"""
+        return lower_thread_priority if self.throttle and self.throttle.idle else None
+
+    def add_copied(self, size, files=1):
+        with self._lock:
+            self.copied_files += files
+            self.copied_bytes += size
+
+    def add_linked(self, size, files=1):
+        with self._lock:
+            self.linked_files += files
+            self.linked_bytes += size
+
+    def summary(self):
+        mb = lambda n: n / 1024 / 1024
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        text = f"复制 {self.copied_files} 个文件 ({mb(self.copied_bytes):.1f} MB)"
+        if self.linked_files:
+            text += f"，{self.reuse_label} {self.linked_files} 个未变化文件"
+        if self.linked_bytes:
+            text += f" (节省 {mb(self.linked_bytes):.1f} MB)"
+        text += f"，耗时 {elapsed:.1f} 秒 ({mb(self.copied_bytes) / elapsed:.1f} MB/s)"
+        if self.throttle and self.throttle.rate:
+            text += f"，限速 {self.throttle.rate / 1024 / 1024:g} MB/s"
+        paused = min(elapsed, self.throttle.paused_total - self._paused0) if self.throttle else 0
+        if paused >= 0.1:
+            text += f"，因服务器卡顿暂停 {paused:.1f} 秒"
+        return text
+
+
+class Throttle:
+    """备份 I/O 节流：令牌桶限速 (mb_per_s=0 表示不限速) + 服务器卡顿时暂停 (hold)。
+    同一个节流器可以被多个复制线程共享，限速针对它们的总和。"""
+
+    BURST_SECONDS = 0.5
+
+    def __init__(self, mb_per_s=0, idle=True):
+        self._lock = threading.Lock()
+        self._hold_until = 0.0
+        self.paused_total = 0.0  # 暂停窗口累计的墙钟时长
+        self.configure(mb_per_s, idle)
+
+    def configure(self, mb_per_s, idle):
+        with self._lock:
+            self.rate = max(0.0, float(mb_per_s or 0)) * 1024 * 1024
+            self.idle = idle
+            self._tokens = self.rate * self.BURST_SECONDS
+            self._last = time.monotonic()
+
+    def hold(self, seconds):
+        """暂停所有使用该节流器的读写 seconds 秒 (可重复调用延长)"""
+        with self._lock:
+            now = time.monotonic()
+            until = now + seconds
+            if until > self._hold_until:
+                self.paused_total += until - max(self._hold_until, now)
+                self._hold_until = until
+
+    @property
+    def holding(self):
+        return time.monotonic() < self._hold_until
+
+    def consume(self, size):
+        while True:
+            left = self._hold_until - time.monotonic()
+            if left <= 0: break
+            time.sleep(min(left, 0.5))
+        if not self.rate: return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate * self.BURST_SECONDS, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= size
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+
+
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_WHO_PROCESS = 1
+_SYS_IOPRIO_SET = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289, "aarch64": 30, "arm64": 30,
+                   "armv7l": 314, "ppc64le": 273, "riscv64": 30}
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+
+
+def lower_thread_priority():
+    """把当前线程降为 idle I/O 调度类 + 最低 CPU 优先级 (Linux)，或后台模式 (Windows)；失败时静默忽略"""
+    try:
+        if sys.platform.startswith("linux"):
+            tid = threading.get_native_id()
+            nr = _SYS_IOPRIO_SET.get(platform.machine().lower())
+            if nr is not None:
+                libc = ctypes.CDLL(None, use_errno=True)
+                libc.syscall(nr, IOPRIO_WHO_PROCESS, tid, IOPRIO_CLASS_IDLE << 13)
+            os.setpriority(os.PRIO_PROCESS, tid, 19)  # Linux 上 PRIO_PROCESS + 线程 id 只影响该线程
+        elif os.name == "nt":
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetThreadPriority(kernel32.GetCurrentThread(), THREAD_MODE_BACKGROUND_BEGIN)
+    except (OSError, AttributeError):
+        pass
+
+
+class SaveBarrier:
+    """存档确认屏障：控制台出现 "Saved the game" 时调用 notify()；
+    arm() 记下当前序号，wait() 等到其后出现新的确认、超时或 alive() 返回 False。"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+
+    def notify(self, event=None):
+        with self._cond:
+            self._seq += 1
+            self._cond.notify_all()
+
+    def arm(self):
+        with self._cond:
+            return self._seq
+
+    def wait(self, token, timeout, alive=None):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._seq <= token:
+                left = deadline - time.monotonic()
+                if left <= 0 or (alive and not alive()):
+                    return False
+                self._cond.wait(min(left, 0.5))
+            return True
+
+
+def _ignored(name, patterns):
+    for p in patterns:
+        if fnmatch.fnmatch(name, p): return True
+    return False
+
+
+def find_previous_snapshot(dest_dir, exclude=None):
+    """返回 dest_dir 中最新的目录型快照路径 (按名称中的时间戳)，没有则返回 None"""
+    try:
+        names = [n for n in os.listdir(dest_dir)
+                 if n != exclude and BACKUP_NAME_RE.match(n) and os.path.isdir(os.path.join(dest_dir, n))]
+    except OSError:
+        return None
+    if not names: return None
+    return os.path.join(dest_dir, max(names, key=lambda n: BACKUP_NAME_RE.match(n).group(1, 2)))
+
+
+def _unchanged(st, prev_path):
+    try:
+        pst = os.stat(prev_path)
+    except OSError:
+        return False
+    return pst.st_size == st.st_size and pst.st_mtime_ns == st.st_mtime_ns
+
+
+def pool_map(fn, items, workers=None, initializer=None):
+    """用线程池按顺序返回 fn(item) 的结果；任一任务出错时抛出该异常"""
+    workers = min(workers or COPY_WORKERS, len(items))
+    if workers <= 1 and initializer is None:
+        return [fn(i) for i in items]
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="mc-copy",
+                            initializer=initializer) as ex:
+        return list(ex.map(fn, items))
+
+
+IO_SLICE = 4 * 1024 * 1024  # 有节流器时每次最多搬运的字节数
+
+
+# 文件到文件的 sendfile 只有 Linux 支持 (macOS/BSD 要求目标是套接字)
+_ZERO_COPY_FUNCS = ("copy_file_range", "sendfile") if sys.platform.startswith("linux") else ("copy_file_range",)
+
+
+def _zero_copy(fsrc, fdst, size, stats=None):
+    """用 copy_file_range / sendfile 在内核内复制；平台或文件系统不支持时返回 False (文件位置已复位)"""
+    step = IO_SLICE if stats and stats.throttle else 1 << 30
+    for name in _ZERO_COPY_FUNCS:
+        func = getattr(os, name, None)
+        if func is None: continue
+        done = 0
+        try:
+            while done < size:
+                if stats: stats.io(min(size - done, step))
+                if name == "sendfile":
+                    n = func(fdst, fsrc, done, min(size - done, step))
+                else:
+                    n = func(fsrc, fdst, min(size - done, step))
+                if n == 0: break
+                done += n
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                               errno.ENOTSUP, errno.EBADF, errno.ETXTBSY, errno.ENOTSOCK):
+                raise
+            os.lseek(fsrc, 0, os.SEEK_SET)
+            os.lseek(fdst, 0, os.SEEK_SET)
+            os.ftruncate(fdst, 0)
+    return False
+
+
+def copy_file(src, dst, size=None, stats=None, digest=None):
+    """复制单个文件的内容与元数据，优先零拷贝。
+
+    传入 digest (hashlib 对象) 时在用户态逐块读写，复制的同时计算哈希，写完后不必再读一遍"""
+    if size is None: size = os.stat(src).st_size
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if size and (digest is not None or not _zero_copy(fsrc.fileno(), fdst.fileno(), size, stats)):
+            for block in iter(lambda: fsrc.read(1024 * 1024), b""):
+                if stats: stats.io(len(block))
+                if digest is not None: digest.update(block)
+                fdst.write(block)
+    shutil.copystat(src, dst)
+
+
+def _plan_copy(src, dst, ignore_patterns, prev):
+    """遍历一次源目录：创建目标目录，返回 (目录对列表, 文件任务列表)"""
+    dirs, files = [], []
+    stack = [(src, dst, prev)]
+    while stack:
+        s, d, p = stack.pop()
+        os.makedirs(d, exist_ok=True)
+        dirs.append((s, d))
+        with os.scandir(s) as it:
+            entries = list(it)
+        for entry in entries:
+            if _ignored(entry.name, ignore_patterns): continue
+            sd = os.path.join(d, entry.name)
+            pp = os.path.join(p, entry.name) if p else None
+            if entry.is_dir(follow_symlinks=False):
+                stack.append((entry.path, sd, pp if pp and os.path.isdir(pp) else None))
+            else:
+                files.append((entry.path, sd, pp, entry.stat(follow_symlinks=False)))
+    return dirs, files
+
+
+def _copy_task(task, stats, delta=None, sums=None):
+    s, d, p, st = task
+    if os.path.lexists(d):
+        os.remove(d)  # 目标可能是指向旧快照的硬链接，不能原地截断
+    if delta and p and s.endswith(".mca") and delta.encode(s, d, p, st, stats):
+        if sums:
+            if os.path.exists(d): sums.add(d, p)
+            else: sums.add(d + DELTA_SUFFIX, p + DELTA_SUFFIX)
+        return
+    if p and _unchanged(st, p):
+        try:
+            os.link(p, d)
+            stats.add_linked(st.st_size)
+            if sums: sums.add(d, p)
+            return
+        except OSError:
+            pass
+    if stat.S_ISLNK(st.st_mode):
+        shutil.copy2(s, d, follow_symlinks=False)
+    else:
+        h = new_digest() if sums else None
+        copy_file(s, d, st.st_size, stats, digest=h)
+        if sums: sums.record(d, h)
+    stats.add_copied(st.st_size)
+
+
+def copy_tree(src, dst, ignore_patterns=(), prev=None, stats=None, workers=None, delta=None, sums=None):
+    """并行复制目录树 (语义同 shutil.copytree(dirs_exist_ok=True, ignore=ignore_patterns(...)))。
+
+    先遍历一次得到全部文件，按大小从大到小交给线程池，大文件最先开始、小文件填满剩余的并发。
+    指定 prev (上一个快照中对应的目录) 时，大小与修改时间都相同的文件硬链接到 prev 中的文件；
+    硬链接失败 (跨分区、文件系统不支持、链接数上限) 时退回复制。
+    指定 delta (RegionDelta) 时，区域文件只保存相对 prev 变化了的区块。
+    指定 sums (ChecksumRecorder) 时，在复制循环中同时计算每个写入文件的哈希并记录。
+    """
+    stats = stats or CopyStats()
+    dirs, files = _plan_copy(src, dst, ignore_patterns, prev)
+    files.sort(key=lambda t: t[3].st_size, reverse=True)
+    pool_map(lambda t: _copy_task(t, stats, delta, sums), files, workers, stats.worker_init())
+    for s, d in reversed(dirs):  # 文件写完后再设置目录时间戳，子目录先于父目录
+        try:
+            shutil.copystat(s, d)
+        except OSError:
+            pass
+    return stats
+
+
+# ------------------ 校验与原子提交 ------------------
+# 目录快照先写到 .partial-<名称>/，写完校验清单后再重命名为正式名称；
+# BACKUP_NAME_RE 从开头匹配，列表/清理/增量基准都不会看到未完成的快照。
+CHECKSUM_ALGO = "blake2b-128"
+CHECKSUMS_NAME = ".mcchecksums.json"
+PARTIAL_PREFIX = ".partial-"
+PARTIAL_STALE_S = 6 * 3600  # 超过该时间仍未完成的临时目录视为中断残留
+
+
+def new_digest():
+    return hashlib.blake2b(digest_size=16)
+
+
+def file_digest(path):
+    h = new_digest()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class _HashingReader:
+    """包装文件对象：被 tarfile 读取的同时计算哈希"""
+
+    def __init__(self, f):
+        self.f = f
+        self.h = new_digest()
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.h.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.h.hexdigest()
+
+
+class ChecksumRecorder:
+    """收集目录快照中每个文件的 (大小, 哈希)，save() 写入快照根目录的 .mcchecksums.json。
+
+    硬链接到上一个快照的文件与之共享 inode，直接沿用上一个快照记录的哈希。
+    """
+
+    def __init__(self, root, prev_root=None):
+        self.root = root
+        self.prev_root = prev_root
+        self.files = {}
+        self._prev = None
+        self._lock = threading.Lock()
+
+    def _prev_files(self):
+        with self._lock:
+            if self._prev is None:
+                self._prev = (load_checksums(self.prev_root) or {}) if self.prev_root else {}
+            return self._prev
+
+    def add(self, path, prev_path=None):
+        rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+        size = os.path.getsize(path)
+        if prev_path and self.prev_root:
+            old = self._prev_files().get(os.path.relpath(prev_path, self.prev_root).replace(os.sep, "/"))
+            try:
+                if old and old[0] == size and os.path.samefile(path, prev_path):
+                    self.files[rel] = old
+                    return
+            except OSError:
+                pass
+        self.files[rel] = [size, file_digest(path)]
+
+    def record(self, path, digest):
+        """记录复制时已算好的哈希 (digest 为 hashlib 对象)"""
+        rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+        self.files[rel] = [os.path.getsize(path), digest.hexdigest()]
+
+    def save(self):
+        with open(os.path.join(self.root, CHECKSUMS_NAME), 'w', encoding='utf-8') as f:
+            json.dump({"version": 1, "algo": CHECKSUM_ALGO, "files": self.files}, f, separators=(',', ':'))
+
+
+def load_checksums(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, CHECKSUMS_NAME), 'r', encoding='utf-8') as f:
+            return json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def partial_path(dest_dir, name):
+    return os.path.join(dest_dir, PARTIAL_PREFIX + name)
+
+
+def commit_snapshot(partial, final):
+    """把写完的临时目录原子地重命名为正式快照"""
+    os.rename(partial, final)
+
+
+def clean_stale_partials(dest_dir):
+    """删除中断残留的临时快照目录 (未写完的 / 未删完的)，返回删除的名称列表"""
+    removed = []
+    try:
+        names = [n for n in os.listdir(dest_dir) if n.startswith((PARTIAL_PREFIX, DELETING_PREFIX))]
+    except OSError:
+        return removed
+    now = time.time()
+    for n in names:
+        p = os.path.join(dest_dir, n)
+        try:
+            if n.startswith(DELETING_PREFIX):
+                # 待删除的快照不看时间 (重命名不改变修改时间)，只跳过后台线程正在删除的
+                with _deleting_lock:
+                    if p in _deleting: continue
+            elif now - os.path.getmtime(p) < PARTIAL_STALE_S: continue
+            if os.path.isdir(p): shutil.rmtree(p)
+            else: os.remove(p)
+            removed.append(n)
+        except OSError:
+            pass
+    return removed
+
+
+# ------------------ 内容寻址去重仓库 ------------------
+# 仓库位于 <备份根目录>/<服务器名>/.repo/chunks/<哈希前两位>/<哈希>，每个唯一数据块只存一份；
+# 快照是与目录快照并列的 backup-..._<类型>.manifest.json.gz 清单文件。
+MODE_DEDUP = "dedup"
+BACKUP_MODES[MODE_DEDUP] = "去重仓库 (内容寻址分块)"
+
+REPO_DIR_NAME = ".repo"
+MANIFEST_SUFFIX = ".manifest.json.gz"
+DEDUP_CHUNK_SIZE = 64 * 1024  # 区域文件按 4 KiB 扇区对齐，固定分块不会出现边界漂移
+
+# 写快照与回收数据块互斥，避免回收掉正在写入、清单尚未落盘的新数据块
+_repo_lock = threading.Lock()
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+class ChunkStore:
+    def __init__(self, dest_dir):
+        self.root = os.path.join(dest_dir, REPO_DIR_NAME, "chunks")
+
+    def path(self, h):
+        return os.path.join(self.root, h[:2], h)
+
+    def put(self, data):
+        """写入数据块 (已存在则跳过)，返回 (哈希, 是否新写入)"""
+        h = chunk_hash(data)
+        p = self.path(h)
+        if os.path.exists(p):
+            return h, False
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        tmp = f"{p}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, p)
+        return h, True
+
+    def get(self, h):
+        with open(self.path(h), 'rb') as f:
+            return f.read()
+
+    def all_hashes(self):
+        if not os.path.isdir(self.root): return
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if not os.path.isdir(d): continue
+            for name in os.listdir(d):
+                if not name.endswith(".tmp"):
+                    yield name
+
+
+def is_manifest(path):
+    return path.endswith(MANIFEST_SUFFIX)
+
+
+def load_manifest(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(path, manifest):
+    tmp = path + ".tmp"
+    with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def find_previous_manifest(dest_dir):
+    try:
+        names = [n for n in os.listdir(dest_dir) if is_manifest(n) and BACKUP_NAME_RE.match(n)]
+    except OSError:
+        return None
+    if not names: return None
+    return os.path.join(dest_dir, max(names, key=lambda n: BACKUP_NAME_RE.match(n).group(1, 2)))
+
+
+def _walk_files(root, ignore_patterns):
+    """遍历 root 下的文件，返回 [(相对路径, os.stat_result)] 与空目录列表；相对路径使用 '/' 分隔"""
+    files, dirs = [], []
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        base = os.path.join(root, rel) if rel else root
+        with os.scandir(base) as it:
+            entries = list(it)
+        if rel and not entries: dirs.append(rel)
+        for e in entries:
+            if _ignored(e.name, ignore_patterns): continue
+            r = f"{rel}/{e.name}" if rel else e.name
+            if e.is_dir(follow_symlinks=False):
+                dirs.append(r)
+                stack.append(r)
+            elif e.is_symlink():
+                continue  # 清单只记录普通文件，世界目录中不会出现符号链接
+            else:
+                files.append((r, e.stat(follow_symlinks=False)))
+    return files, dirs
+
+
+def write_dedup_snapshot(src_dir, targets, dest_dir, name, ignore_patterns=(), stats=None):
+    """把 src_dir 下的 targets (相对目录名列表；None 表示整个 src_dir) 写入去重仓库并生成清单。
+
+    与上一个清单相比大小和修改时间都未变化的文件直接复用其块列表，不读取文件内容。
+    """
+    with _repo_lock:
+        return _write_dedup_snapshot(src_dir, targets, dest_dir, name, ignore_patterns,
+                                     stats or CopyStats("复用"))
+
+
+def _write_dedup_snapshot(src_dir, targets, dest_dir, name, ignore_patterns, stats):
+    store = ChunkStore(dest_dir)
+    prev_files = {}
+    prev_path = find_previous_manifest(dest_dir)
+    if prev_path:
+        try:
+            prev_files = {f["path"]: f for f in load_manifest(prev_path)["files"]}
+        except Exception:
+            prev_files = {}
+
+    manifest = {"version": 1, "name": name, "chunk_size": DEDUP_CHUNK_SIZE,
+                "targets": targets, "files": [], "dirs": []}
+    tasks = []
+    roots = [(t, os.path.join(src_dir, t)) for t in targets] if targets else [("", src_dir)]
+    for prefix, root in roots:
+        files, dirs = _walk_files(root, ignore_patterns)
+        if prefix: manifest["dirs"].append(prefix)
+        manifest["dirs"].extend(f"{prefix}/{d}" if prefix else d for d in dirs)
+        for rel, st in files:
+            tasks.append((f"{prefix}/{rel}" if prefix else rel, os.path.join(root, rel.replace("/", os.sep)), st))
+
+    def store_file(task):
+        path, full, st = task
+        old = prev_files.get(path)
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            stats.add_linked(st.st_size)
+            return old
+        chunks = []
+        new_bytes = 0
+        with open(full, 'rb') as f:
+            while True:
+                data = f.read(DEDUP_CHUNK_SIZE)
+                if not data: break
+                stats.io(len(data))
+                h, fresh = store.put(data)
+                chunks.append(h)
+                if fresh: new_bytes += len(data)
+        stats.add_copied(new_bytes)
+        stats.add_linked(st.st_size - new_bytes, files=0)
+        return {"path": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "chunks": chunks}
+
+    tasks.sort(key=lambda t: t[2].st_size, reverse=True)
+    manifest["files"] = pool_map(store_file, tasks, initializer=stats.worker_init())
+
+    out = os.path.join(dest_dir, name + MANIFEST_SUFFIX)
+    _save_manifest(out, manifest)
+    return out, stats
+
+
+def restore_dedup_snapshot(manifest_path, dest_root, only_top=None, stats=None):
+    """按清单在 dest_root 下并行重建文件；only_top 指定时只重建该顶层目录"""
+    manifest = load_manifest(manifest_path)
+    store = ChunkStore(os.path.dirname(manifest_path))
+    keep = (lambda p: p == only_top or p.startswith(only_top + "/")) if only_top else (lambda p: True)
+    for d in manifest["dirs"]:
+        if keep(d): os.makedirs(os.path.join(dest_root, d.replace("/", os.sep)), exist_ok=True)
+
+    def rebuild(f):
+        dst = os.path.join(dest_root, f["path"].replace("/", os.sep))
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        with open(dst, 'wb') as out:
+            for h in f["chunks"]:
+                out.write(store.get(h))
+        os.utime(dst, ns=(f["mtime_ns"], f["mtime_ns"]))
+        if stats: stats.add_copied(f["size"])
+
+    pool_map(rebuild, sorted((f for f in manifest["files"] if keep(f["path"])),
+                             key=lambda f: f["size"], reverse=True))
+    return stats
+
+
+def gc_chunk_store(dest_dir):
+    """删除不再被任何清单引用的数据块，返回删除的块数；正在写快照时跳过 (留给下一次清理)"""
+    store = ChunkStore(dest_dir)
+    if not os.path.isdir(store.root): return 0
+    if not _repo_lock.acquire(blocking=False): return 0
+    try:
+        return _sweep(store, dest_dir)
+    finally:
+        _repo_lock.release()
+
+
+def _sweep(store, dest_dir):
+    live = set()
+    for n in os.listdir(dest_dir):
+        if is_manifest(n) and BACKUP_NAME_RE.match(n):
+            for f in load_manifest(os.path.join(dest_dir, n))["files"]:
+                live.update(f["chunks"])
+    removed = 0
+    for h in list(store.all_hashes()):
+        if h not in live:
+            try:
+                os.remove(store.path(h))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def delete_snapshot(path):
+    """删除一个快照 (目录或清单文件)；返回是否删除的是清单 (调用方随后应执行 gc_chunk_store)"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+        return False
+    os.remove(path)
+    return is_manifest(path)
+
+
+# ------------------ 压缩归档 ------------------
+# 快照是 backup-..._<类型>.tar.gz / .tar.zst；第一个成员是记录世界文件夹列表的元数据，
+# 还原时只需流式读取开头即可知道要替换哪些目录。
+MODE_ARCHIVE = "archive"
+BACKUP_MODES[MODE_ARCHIVE] = "压缩归档 (单文件 tar)"
+
+ARCHIVE_META = ".mcbackup.json"
+ARCHIVE_CODECS = {"gzip": ".tar.gz", "zstd": ".tar.zst"}
+ARCHIVE_LEVELS = {"gzip": (1, 9, 6), "zstd": (1, 22, 3)}  # (最小, 最大, 默认)
+DEFAULT_ARCHIVE_CODEC = "gzip"
+ARCHIVE_BLOCK = 1024 * 1024
+ARCHIVE_QUEUE_BLOCKS = 16  # 每级流水线最多缓存的块数，限制内存占用
+
+_EXTRACT_KW = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+
+
+def available_codecs():
+    return [c for c in ARCHIVE_CODECS if c != "zstd" or zstandard is not None]
+
+
+def clamp_level(codec, level):
+    lo, hi, default = ARCHIVE_LEVELS[codec]
+    try:
+        return min(hi, max(lo, int(level)))
+    except (TypeError, ValueError):
+        return default
+
+
+def is_archive(path):
+    return path.endswith(tuple(ARCHIVE_CODECS.values()))
+
+
+def is_snapshot_file(name):
+    """文件型快照 (去重清单或压缩归档)"""
+    return is_manifest(name) or is_archive(name)
+
+
+def _compressor(codec, level):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level, threads=-1).compressobj()
+    return zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31: 带 gzip 头尾
+
+
+class _BlockWriter:
+    """tarfile 的输出端：攒满一块后放入队列交给压缩线程"""
+
+    def __init__(self, q, errors, stats):
+        self.q = q
+        self.errors = errors
+        self.stats = stats
+        self.buf = bytearray()
+
+    def write(self, data):
+        if self.errors: raise self.errors[0]
+        self.stats.io(len(data))
+        self.buf += data
+        if len(self.buf) >= ARCHIVE_BLOCK:
+            self.q.put(bytes(self.buf))
+            self.buf.clear()
+        return len(data)
+
+    def close(self):
+        if self.buf: self.q.put(bytes(self.buf))
+        self.buf.clear()
+
+
+def _pump(q_in, fn, errors):
+    """消费 q_in 直到 None；出错后记录异常并继续取空队列，保证上游不会阻塞"""
+    for block in iter(q_in.get, None):
+        if errors: continue
+        try:
+            fn(block)
+        except BaseException as e:
+            errors.append(e)
+
+
+def write_archive_snapshot(src_dir, targets, dest_dir, name, ignore_patterns=(),
+                           codec=DEFAULT_ARCHIVE_CODEC, level=None, stats=None):
+    """把 targets (None 表示整个 src_dir) 写成一个压缩 tar。
+
+    读取打包、压缩、写盘三级流水线通过有界队列衔接，各自在独立线程中并行。
+    返回 (归档路径, 归档字节数, stats)。
+    """
+    if codec not in available_codecs(): codec = DEFAULT_ARCHIVE_CODEC
+    level = clamp_level(codec, level)
+    stats = stats or CopyStats()
+    out = os.path.join(dest_dir, name + ARCHIVE_CODECS[codec])
+    part = out + ".part"
+    raw_q = queue.Queue(ARCHIVE_QUEUE_BLOCKS)
+    packed_q = queue.Queue(ARCHIVE_QUEUE_BLOCKS)
+    errors = []
+    comp = _compressor(codec, level)
+
+    def compress_loop():
+        if stats.worker_init(): lower_thread_priority()
+        _pump(raw_q, lambda b: packed_q.put(comp.compress(b)), errors)
+        if not errors:
+            try:
+                packed_q.put(comp.flush())
+            except BaseException as e:
+                errors.append(e)
+        packed_q.put(None)
+
+    def write_loop():
+        if stats.worker_init(): lower_thread_priority()
+        try:
+            with open(part, 'wb') as f:
+                _pump(packed_q, f.write, errors)
+        except BaseException as e:
+            errors.append(e)
+            for _ in iter(packed_q.get, None): pass
+
+    def pack_loop():
+        if stats.worker_init(): lower_thread_priority()
+        sink = _BlockWriter(raw_q, errors, stats)
+        try:
+            with tarfile.open(fileobj=sink, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+                meta = json.dumps({"version": 1, "name": name, "targets": targets}).encode("utf-8")
+                info = tarfile.TarInfo(ARCHIVE_META)
+                info.size = len(meta)
+                info.mtime = time.time()
+                tar.addfile(info, io.BytesIO(meta))
+                roots = [(t, os.path.join(src_dir, t)) for t in targets] if targets else [("", src_dir)]
+                sums = {}
+                for prefix, root in roots:
+                    if prefix: tar.add(root, arcname=prefix, recursive=False)
+                    files, dirs = _walk_files(root, ignore_patterns)
+                    for d in sorted(dirs):
+                        tar.add(os.path.join(root, d.replace("/", os.sep)),
+                                arcname=f"{prefix}/{d}" if prefix else d, recursive=False)
+                    for rel, st in files:
+                        arcname = f"{prefix}/{rel}" if prefix else rel
+                        full = os.path.join(root, rel.replace("/", os.sep))
+                        info = tar.gettarinfo(full, arcname)
+                        if info.isreg():
+                            with open(full, 'rb') as f:
+                                reader = _HashingReader(f)
+                                tar.addfile(info, reader)
+                            sums[arcname] = [info.size, reader.hexdigest()]
+                        else:
+                            tar.addfile(info)
+                        stats.add_copied(st.st_size)
+                # 最后一个成员：打包时顺带算出的逐文件校验和
+                data = json.dumps({"version": 1, "algo": CHECKSUM_ALGO, "files": sums}).encode("utf-8")
+                info = tarfile.TarInfo(CHECKSUMS_NAME)
+                info.size = len(data)
+                info.mtime = time.time()
+                tar.addfile(info, io.BytesIO(data))
+            sink.close()
+        except BaseException as e:
+            if not errors: errors.append(e)
+        finally:
+            raw_q.put(None)
+
+    # 打包也放进独立线程：降优先级只作用于流水线线程，不会永久拖慢调用者 (备份/引擎) 线程
+    workers = [threading.Thread(target=pack_loop, name="mc-archive-pack", daemon=True),
+               threading.Thread(target=compress_loop, name="mc-archive-compress", daemon=True),
+               threading.Thread(target=write_loop, name="mc-archive-write", daemon=True)]
+    for t in workers: t.start()
+    for t in workers: t.join()
+
+    if errors:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise errors[0]
+    os.replace(part, out)
+    return out, os.path.getsize(out), stats
+
+
+def _open_archive_stream(path):
+    """返回 (解压后的流, 底层文件)"""
+    raw = open(path, 'rb')
+    if path.endswith(ARCHIVE_CODECS["zstd"]):
+        if zstandard is None:
+            raw.close()
+            raise RuntimeError("还原 zstd 归档需要安装 zstandard: pip install zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(raw), raw
+    return gzip.GzipFile(fileobj=raw, mode='rb'), raw
+
+
+class _ArchiveReader:
+    """以流模式 ('r|') 打开归档，边解压边读取，不需要临时文件"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.stream, self.raw = _open_archive_stream(self.path)
+        self.tar = tarfile.open(fileobj=self.stream, mode="r|")
+        return self.tar
+
+    def __exit__(self, *exc):
+        self.tar.close()
+        self.stream.close()
+        self.raw.close()
+
+
+def read_archive_meta(path):
+    """只解压归档开头的元数据成员"""
+    with _ArchiveReader(path) as tar:
+        first = tar.next()
+        if first is None or first.name != ARCHIVE_META:
+            return {"targets": None}
+        return json.loads(tar.extractfile(first).read().decode("utf-8"))
+
+
+def extract_archive(path, dest_root, stats=None):
+    """流式解压归档到 dest_root (跳过元数据成员)"""
+    with _ArchiveReader(path) as tar:
+        for member in tar:
+            if member.name in (ARCHIVE_META, CHECKSUMS_NAME): continue
+            tar.extract(member, dest_root, **_EXTRACT_KW)
+            if stats and member.isfile(): stats.add_copied(member.size)
+    return stats
+
+
+# ------------------ 区域差量 (.mca) ------------------
+# 区域文件 = 8 KiB 文件头 (1024 个位置项 [3 字节扇区偏移 + 1 字节扇区数] + 1024 个 4 字节时间戳)
+# + 以 4 KiB 扇区为单位存放的区块数据。位置项或时间戳变化的区块才需要保存。
+#
+# .mca.delta 文件格式 (大端):
+#   b"MCADELTA" | u16 链深度 | u16 基准快照名长度 | 基准快照名 | u64 文件大小 | 8 KiB 新文件头
+#   | u32 段数 | 每段: u32 起始扇区, u32 字节数, 数据
+# 基准快照中同一路径要么是完整的 .mca，要么是另一个 .mca.delta (链深度 +1)。
+MODE_DELTA = "delta"
+BACKUP_MODES[MODE_DELTA] = "区域差量 (仅保存变化的区块)"
+
+REGION_SECTOR = 4096
+REGION_HEADER = 2 * REGION_SECTOR
+DELTA_SUFFIX = ".delta"
+DELTA_MAGIC = b"MCADELTA"
+DELTA_META = ".mcdelta.json"
+DELTA_CHAIN_MAX = 12  # 链过长会拖慢还原，到达上限后重新保存完整区域文件
+
+
+class _RegionInfo:
+    __slots__ = ("path", "header", "size", "depth", "base")
+
+    def __init__(self, path, header, size, depth, base):
+        self.path = path
+        self.header = header
+        self.size = size
+        self.depth = depth
+        self.base = base
+
+
+def _read_delta_head(f):
+    if f.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+        raise ValueError(f"不是区域差量文件: {f.name}")
+    depth, name_len = struct.unpack(">HH", f.read(4))
+    base = f.read(name_len).decode("utf-8")
+    size, = struct.unpack(">Q", f.read(8))
+    header = f.read(REGION_HEADER)
+    return depth, base, size, header
+
+
+def _region_info(path):
+    """读取快照中某个区域文件的表示 (完整 .mca 或 .mca.delta)；都不存在时返回 None"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(REGION_HEADER)
+        return _RegionInfo(path, header, os.path.getsize(path), 0, None)
+    except OSError:
+        pass
+    try:
+        with open(path + DELTA_SUFFIX, 'rb') as f:
+            depth, base, size, header = _read_delta_head(f)
+        return _RegionInfo(path + DELTA_SUFFIX, header, size, depth, base)
+    except (OSError, ValueError, struct.error):
+        return None
+
+
+def _snapshot_epoch(name):
+    """快照名中的时间 (本地时间，整秒)；无法解析时返回 None"""
+    m = BACKUP_NAME_RE.match(name)
+    if not m: return None
+    try:
+        return int(datetime.datetime.strptime(m.group(1) + m.group(2), "%Y%m%d%H%M%S").timestamp())
+    except (ValueError, OverflowError):
+        return None
+
+
+def _chunk_time(header, i):
+    return int.from_bytes(header[REGION_SECTOR + i:REGION_SECTOR + i + 4], "big")
+
+
+def _touched_since(header, since):
+    """文件头中是否有区块时间戳不早于 since (这些区块可能在上一个快照读取后的同一秒内被原地重写)"""
+    if since is None: return False
+    return any(_chunk_time(header, i) >= since for i in range(0, REGION_SECTOR, 4) if header[i:i + 4] != b"\0\0\0\0")
+
+
+def _changed_ranges(old, new, since=None):
+    """比较两个文件头，返回新文件中变化区块占用的扇区段 [(起始扇区, 扇区数)]，相邻段合并。
+
+    时间戳只精确到秒：位置和时间戳都没变、但时间戳不早于上一个快照时间 since 的区块，
+    可能是在上一个快照读取之后的同一秒内原地重写的，同样视为变化。"""
+    ranges = []
+    for i in range(0, REGION_SECTOR, 4):
+        loc = new[i:i + 4]
+        if (loc == old[i:i + 4] and new[REGION_SECTOR + i:REGION_SECTOR + i + 4] == old[REGION_SECTOR + i:REGION_SECTOR + i + 4]
+                and (since is None or _chunk_time(new, i) < since)):
+            continue
+        offset = int.from_bytes(loc[:3], "big")
+        count = loc[3]
+        if offset >= 2 and count:
+            ranges.append((offset, count))
+    ranges.sort()
+    merged = []
+    for off, cnt in ranges:
+        if merged and off <= merged[-1][0] + merged[-1][1]:
+            last_off, last_cnt = merged[-1]
+            merged[-1] = (last_off, max(last_cnt, off + cnt - last_off))
+        else:
+            merged.append((off, cnt))
+    return merged
+
+
+class RegionDelta:
+    """一次差量备份的上下文：base_name 为上一个快照目录名，bases 收集本快照依赖的所有基准快照"""
+
+    def __init__(self, base_name):
+        self.base_name = base_name
+        self.base_time = _snapshot_epoch(base_name)
+        self.bases = set()
+        self._lock = threading.Lock()
+
+    def _depend(self, name):
+        with self._lock:
+            self.bases.add(name)
+
+    def encode(self, src, dst, prev_path, st, stats):
+        """写出 src 相对 prev_path 的差量；返回 False 表示应按普通文件复制"""
+        prev = _region_info(prev_path)
+        if prev is None or len(prev.header) < REGION_HEADER:
+            return False
+        with open(src, 'rb') as f:
+            header = f.read(REGION_HEADER)
+            if len(header) < REGION_HEADER:
+                return False
+            stats.io(REGION_HEADER)
+            if header == prev.header and st.st_size == prev.size and not _touched_since(header, self.base_time):
+                # 整个文件没有变化：直接硬链接上一个快照里的表示 (完整文件或差量文件)
+                link = dst if prev.base is None else dst + DELTA_SUFFIX
+                try:
+                    os.link(prev.path, link)
+                except OSError:
+                    shutil.copy2(prev.path, link)
+                if prev.base: self._depend(prev.base)
+                stats.add_linked(st.st_size)
+                return True
+            if prev.depth >= DELTA_CHAIN_MAX:
+                return False
+            name = self.base_name.encode("utf-8")
+            written = 0
+            with open(dst + DELTA_SUFFIX, 'wb') as out:
+                out.write(DELTA_MAGIC)
+                out.write(struct.pack(">HH", prev.depth + 1, len(name)))
+                out.write(name)
+                out.write(struct.pack(">Q", st.st_size))
+                out.write(header)
+                ranges = _changed_ranges(prev.header, header, self.base_time)
+                out.write(struct.pack(">I", len(ranges)))
+                for off, cnt in ranges:
+                    stats.io(cnt * REGION_SECTOR)
+                    f.seek(off * REGION_SECTOR)
+                    data = f.read(cnt * REGION_SECTOR)
+                    out.write(struct.pack(">II", off, len(data)))
+                    out.write(data)
+                written = out.tell()
+        try:
+            shutil.copystat(src, dst + DELTA_SUFFIX)
+        except OSError:
+            pass
+        self._depend(self.base_name)
+        stats.add_copied(written)
+        stats.add_linked(max(0, st.st_size - written), files=0)
+        return True
+
+    def write_meta(self, snapshot_dir):
+        with open(os.path.join(snapshot_dir, DELTA_META), 'w', encoding='utf-8') as f:
+            json.dump({"bases": sorted(self.bases)}, f)
+
+
+def reconstruct_region(dest_dir, snapshot, rel, out):
+    """把快照 snapshot 中的区域文件 rel ('/' 分隔) 重建为完整的 .mca 写到 out"""
+    path = os.path.join(dest_dir, snapshot, rel.replace("/", os.sep))
+    if os.path.exists(path):
+        copy_file(path, out)
+        return
+    with open(path + DELTA_SUFFIX, 'rb') as f:
+        _, base, size, header = _read_delta_head(f)
+        reconstruct_region(dest_dir, base, rel, out)
+        with open(out, 'r+b') as o:
+            o.write(header)
+            count, = struct.unpack(">I", f.read(4))
+            for _ in range(count):
+                off, n = struct.unpack(">II", f.read(8))
+                o.seek(off * REGION_SECTOR)
+                o.write(f.read(n))
+            o.truncate(size)
+    shutil.copystat(path + DELTA_SUFFIX, out)
+
+
+def restore_tree(snapshot_dir, subdir, dst, stats=None):
+    """还原目录快照中的 subdir 到 dst；*.mca.delta 沿基准链重建为完整区域文件"""
+    src = os.path.join(snapshot_dir, subdir)
+    stats = copy_tree(src, dst, ignore_patterns=("*.mca" + DELTA_SUFFIX,) + SNAPSHOT_META_FILES, stats=stats)
+    dest_dir, snapshot = os.path.split(os.path.normpath(snapshot_dir))
+    deltas = []
+    for root, _, files in os.walk(src):
+        for n in files:
+            if n.endswith(".mca" + DELTA_SUFFIX):
+                rel = os.path.relpath(os.path.join(root, n[:-len(DELTA_SUFFIX)]), snapshot_dir)
+                deltas.append(rel.replace(os.sep, "/"))
+
+    def rebuild(rel):
+        out = os.path.join(dst, os.path.relpath(os.path.join(snapshot_dir, rel), src))
+        reconstruct_region(dest_dir, snapshot, rel, out)
+        stats.add_copied(os.path.getsize(out))
+
+    pool_map(rebuild, deltas)
+    return stats
+
+
+def snapshot_bases(path):
+    """目录快照直接依赖的基准快照名"""
+    try:
+        with open(os.path.join(path, DELTA_META), 'r', encoding='utf-8') as f:
+            return json.load(f).get("bases", [])
+    except (OSError, ValueError):
+        return []
+
+
+def protected_snapshots(dest_dir, doomed, names=None, bases=None):
+    """doomed (待删除的快照路径) 中仍被其它保留快照的差量链引用、暂时不能删除的部分；
+    names 为目录中全部快照名 (省略时列目录)，bases(name) 可替换为带缓存的 snapshot_bases"""
+    if bases is None:
+        bases = lambda n: snapshot_bases(os.path.join(dest_dir, n))
+    doomed_names = {os.path.basename(p) for p in doomed}
+    if names is None:
+        try:
+            names = [n for n in os.listdir(dest_dir) if BACKUP_NAME_RE.match(n)]
+        except OSError:
+            return set()
+    needed = set()
+    stack = [n for n in names if n not in doomed_names]
+    while stack:
+        for base in bases(stack.pop()):
+            if base not in needed:
+                needed.add(base)
+                stack.append(base)
+    return {p for p in doomed if os.path.basename(p) in needed}
+
+
+# ------------------ 写时复制快照 ------------------
+# 快照建在服务器目录内的 .backup-snapshot/<备份名>/ 下 (reflink / 子卷快照都要求与源在同一文件系统)，
+# 目录结构与服务器目录相同，备份完成后删除。
+# 注意：不能用普通硬链接代替 —— 区域文件是原地改写的，save-on 之后硬链接看到的内容也会跟着变。
+SNAPSHOT_DIR_NAME = ".backup-snapshot"
+SNAPSHOT_AUTO = "auto"
+SNAPSHOT_OFF = "off"
+SNAPSHOT_BACKENDS = {
+    SNAPSHOT_AUTO: "自动 (btrfs 快照 / reflink)",
+    SNAPSHOT_OFF: "关闭 (备份期间保持 save-off)",
+}
+DEFAULT_SNAPSHOT_BACKEND = SNAPSHOT_AUTO
+FICLONE = 0x40049409  # linux/fs.h: _IOW(0x94, 9, int)
+
+
+class CowUnsupported(Exception):
+    pass
+
+
+def _is_btrfs_subvolume(path):
+    """btrfs 子卷根目录的 inode 号固定为 256"""
+    return (sys.platform.startswith("linux") and shutil.which("btrfs") is not None
+            and os.stat(path).st_ino == 256)
+
+
+def reflink_file(src, dst):
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError as e:
+            raise CowUnsupported(f"reflink 不可用: {e}") from e
+    shutil.copystat(src, dst)
+
+
+def reflink_tree(src, dst, ignore_patterns=()):
+    """用 FICLONE 克隆整个目录树 (只复制元数据，数据块共享直到任一方被改写)"""
+    if fcntl is None:
+        raise CowUnsupported("当前平台不支持 reflink")
+    dirs, files = _plan_copy(src, dst, ignore_patterns, None)
+
+    def clone(task):
+        s, d, _, st = task
+        if stat.S_ISLNK(st.st_mode):
+            shutil.copy2(s, d, follow_symlinks=False)
+        else:
+            reflink_file(s, d)
+
+    pool_map(clone, files)
+    for s, d in reversed(dirs):
+        try:
+            shutil.copystat(s, d)
+        except OSError:
+            pass
+
+
+class CowSnapshot:
+    """一次写时复制快照；root 与服务器目录结构相同，可以直接作为备份源"""
+
+    def __init__(self, root):
+        self.root = root
+        self.backends = set()
+        self.subvolumes = []
+
+    def describe(self):
+        return " + ".join(sorted(self.backends)) or "空"
+
+    def discard(self):
+        """删除快照，返回是否完全清理"""
+        ok = True
+        for sv in self.subvolumes:
+            r = subprocess.run(["btrfs", "subvolume", "delete", sv], capture_output=True)
+            ok = ok and r.returncode == 0
+        shutil.rmtree(self.root, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(self.root))
+        except OSError:
+            pass
+        return ok and not os.path.exists(self.root)
+
+
+def take_cow_snapshot(src_dir, targets, name, ignore_patterns=()):
+    """对 src_dir 下的 targets (None 表示整个目录) 做写时复制快照。
+
+    世界文件夹是 btrfs 子卷时用只读子卷快照，否则用 reflink；都不支持时返回 None (已清理)。
+    """
+    snap = CowSnapshot(os.path.join(src_dir, SNAPSHOT_DIR_NAME, name))
+    try:
+        os.makedirs(snap.root)
+        if targets is None:
+            reflink_tree(src_dir, snap.root, tuple(ignore_patterns) + (SNAPSHOT_DIR_NAME,))
+            snap.backends.add("reflink")
+            return snap
+        for t in targets:
+            s, d = os.path.join(src_dir, t), os.path.join(snap.root, t)
+            if _is_btrfs_subvolume(s):
+                r = subprocess.run(["btrfs", "subvolume", "snapshot", "-r", s, d], capture_output=True)
+                if r.returncode == 0:
+                    snap.subvolumes.append(d)
+                    snap.backends.add("btrfs")
+                    continue
+            reflink_tree(s, d, ignore_patterns)
+            snap.backends.add("reflink")
+        return snap
+    except (CowUnsupported, OSError):
+        snap.discard()
+        return None
+
+
+# ------------------ 快照校验 ------------------
+# 仅存放快照元数据、还原时不复制到服务器目录的文件
+SNAPSHOT_META_FILES = (DELTA_META, CHECKSUMS_NAME)
+
+
+def _verify_dir(path, workers):
+    sums = load_checksums(path)
+    if sums is None:
+        return 0, ["缺少校验清单 (该快照早于校验功能，无法校验)"]
+
+    def check(item):
+        rel, (size, digest) = item
+        full = os.path.join(path, rel.replace("/", os.sep))
+        try:
+            if os.path.getsize(full) != size:
+                return f"{rel}: 大小不符"
+            if file_digest(full) != digest:
+                return f"{rel}: 哈希不符"
+        except OSError as e:
+            return f"{rel}: {e.strerror or e}"
+        return None
+
+    return len(sums), [e for e in pool_map(check, list(sums.items()), workers) if e]
+
+
+def _verify_dedup(path, workers):
+    manifest = load_manifest(path)
+    store = ChunkStore(os.path.dirname(path))
+    chunks = sorted({h for f in manifest["files"] for h in f["chunks"]})
+
+    def check(h):
+        try:
+            data = store.get(h)
+        except OSError:
+            return h, None, "缺失"
+        return h, len(data), None if chunk_hash(data) == h else "哈希不符"
+
+    sizes, errors = {}, []
+    for h, size, err in pool_map(check, chunks, workers):
+        sizes[h] = size
+        if err: errors.append(f"数据块 {h[:12]}…: {err}")
+    for f in manifest["files"]:
+        if all(sizes.get(h) is not None for h in f["chunks"]) and sum(sizes[h] for h in f["chunks"]) != f["size"]:
+            errors.append(f"{f['path']}: 大小不符")
+    return len(manifest["files"]), errors
+
+
+def _verify_archive(path):
+    seen, expected, errors = {}, None, []
+    with _ArchiveReader(path) as tar:
+        for member in tar:
+            if member.name == CHECKSUMS_NAME:
+                expected = json.loads(tar.extractfile(member).read().decode("utf-8"))["files"]
+            elif member.isreg() and member.name != ARCHIVE_META:
+                h = new_digest()
+                f = tar.extractfile(member)
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(block)
+                seen[member.name] = [member.size, h.hexdigest()]
+    if expected is None:
+        return len(seen), ["缺少校验清单 (该归档早于校验功能或写入不完整)"]
+    for name, val in expected.items():
+        if name not in seen: errors.append(f"{name}: 缺失")
+        elif seen[name] != val: errors.append(f"{name}: 哈希不符")
+    return len(expected), errors
+
+
+VERIFY_SNAPSHOT_WORKERS = 4  # 同时校验的快照数，每个快照内部再并行校验文件/数据块
+
+
+def verify_snapshots(paths, workers=None):
+    """并行校验多个快照，按 paths 的顺序逐个产出 (路径, 检查的文件数, 错误列表, 耗时秒)"""
+    workers = max(1, min(workers or VERIFY_SNAPSHOT_WORKERS, len(paths)))
+    per_snapshot = max(1, COPY_WORKERS // workers)
+
+    def one(path):
+        t0 = time.monotonic()
+        checked, errors = verify_snapshot(path, per_snapshot)
+        return path, checked, errors, time.monotonic() - t0
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="mc-verify") as ex:
+        yield from ex.map(one, paths)
+
+
+def verify_snapshot(path, workers=None):
+    """校验一个快照，返回 (检查的文件数, 错误列表)；错误列表为空表示完好。
+
+    目录快照对照 .mcchecksums.json 并行重算哈希；去重快照重算每个数据块的哈希 (块名即哈希)；
+    归档流式解压 (gzip/zstd 自带 CRC) 并对照最后一个成员中的校验和。"""
+    try:
+        if os.path.isdir(path):
+            return _verify_dir(path, workers)
+        if is_manifest(path):
+            return _verify_dedup(path, workers)
+        if is_archive(path):
+            return _verify_archive(path)
+        return 0, ["未知的快照类型"]
+    except Exception as e:
+        return 0, [f"读取失败: {e}"]
+
+
+# ------------------ 快照索引与 GFS 保留 ------------------
+SNAPSHOT_NAME_RE = re.compile(r"(backup-(\d{8})-(\d{6})_(\w+))(\.manifest\.json\.gz|\.tar\.gz|\.tar\.zst)?$")
+KIND_DIR = "dir"
+KIND_DEDUP = "dedup"
+KIND_ARCHIVE = "archive"
+DELETING_PREFIX = ".deleting-"
+DELETE_WORKERS = 2
+
+
+class SnapshotInfo:
+    __slots__ = ("name", "note", "time", "kind")
+
+    def __init__(self, name, note, time_, kind):
+        self.name = name
+        self.note = note
+        self.time = time_
+        self.kind = kind
+
+    def __repr__(self):
+        return f"SnapshotInfo({self.name!r})"
+
+
+def parse_snapshot_name(name):
+    """只根据名称解析快照 (不访问文件系统)；不是完整快照名时返回 None"""
+    m = SNAPSHOT_NAME_RE.match(name)
+    if not m: return None
+    try:
+        t = datetime.datetime.strptime(m.group(2) + m.group(3), "%Y%m%d%H%M%S")
+    except ValueError:
+        return None
+    suffix = m.group(5)
+    kind = KIND_DIR if not suffix else (KIND_DEDUP if suffix == MANIFEST_SUFFIX else KIND_ARCHIVE)
+    return SnapshotInfo(name, m.group(4), t, kind)
+
+
+class BackupIndex:
+    """一个服务器备份目录的快照列表缓存。
+
+    只有目录本身的修改时间变化时才重新列目录，且只解析名称、不逐个 stat 快照。"""
+
+    def __init__(self, dest_dir):
+        self.dest_dir = dest_dir
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._items = {}
+        self._bases = {}
+
+    def _dir_mtime(self):
+        try:
+            return os.stat(self.dest_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def snapshots(self):
+        """全部快照，按时间从新到旧"""
+        with self._lock:
+            mtime = self._dir_mtime()
+            if mtime != self._mtime:
+                self._items = {}
+                if mtime is not None:
+                    for n in os.listdir(self.dest_dir):
+                        info = parse_snapshot_name(n)
+                        if info: self._items[n] = info
+                self._mtime = mtime
+            return sorted(self._items.values(), key=lambda i: (i.time, i.name), reverse=True)
+
+    def add(self, name):
+        info = parse_snapshot_name(name)
+        with self._lock:
+            if info: self._items[name] = info
+            if self._mtime is not None: self._mtime = self._dir_mtime()
+
+    def discard(self, name):
+        with self._lock:
+            self._items.pop(name, None)
+            self._bases.pop(name, None)
+            if self._mtime is not None: self._mtime = self._dir_mtime()
+
+    def bases(self, name):
+        """快照写完后不再改变，差量基准只读一次"""
+        if name not in self._bases:
+            info = self._items.get(name) or parse_snapshot_name(name)
+            self._bases[name] = (snapshot_bases(os.path.join(self.dest_dir, name))
+                                 if info and info.kind == KIND_DIR else [])
+        return self._bases[name]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def backup_index(dest_dir):
+    key = os.path.abspath(dest_dir)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = BackupIndex(key)
+        return _indexes[key]
+
+
+class RetentionPolicy:
+    """GFS 保留策略：最近 keep_last 个非启动前备份 + 最新的启动前备份 + 各层每个时间段最新的一个"""
+
+    TIERS = (("hourly", "小时", lambda t: t.strftime("%Y%m%d%H")),
+             ("daily", "天", lambda t: t.strftime("%Y%m%d")),
+             ("weekly", "周", lambda t: "%d-%02d" % t.isocalendar()[:2]),
+             ("monthly", "月", lambda t: t.strftime("%Y%m")))
+    DEFAULTS = {"keep_last": 10, "hourly": 24, "daily": 7, "weekly": 4, "monthly": 6}
+
+    def __init__(self, keep_last=10, hourly=24, daily=7, weekly=4, monthly=6):
+        self.keep_last = max(1, int(keep_last))
+        self.counts = {"hourly": max(0, int(hourly)), "daily": max(0, int(daily)),
+                       "weekly": max(0, int(weekly)), "monthly": max(0, int(monthly))}
+
+    @classmethod
+    def from_config(cls, data):
+        """逐项读取，缺失或无效的项使用默认值"""
+        def get(key, field):
+            try:
+                return int(data.get(key, cls.DEFAULTS[field]))
+            except (TypeError, ValueError):
+                return cls.DEFAULTS[field]
+        return cls(get("periodic_keep", "keep_last"),
+                   *(get(f"retention_{t}", t) for t, _, _ in cls.TIERS))
+
+    def to_config(self):
+        return {f"retention_{k}": v for k, v in self.counts.items()}
+
+    def select(self, snapshots):
+        """snapshots 按时间从新到旧；返回 {要保留的快照名: 保留原因}"""
+        keep = {}
+        regular = [s for s in snapshots if s.note != "startup"]
+        for s in regular[:self.keep_last]:
+            keep.setdefault(s.name, "最近")
+        for s in snapshots:
+            if s.note == "startup":
+                keep.setdefault(s.name, "最新启动前备份")
+                break
+        for tier, label, key in self.TIERS:
+            limit = self.counts[tier]
+            seen = set()
+            for s in snapshots:
+                if len(seen) >= limit: break
+                k = key(s.time)
+                if k in seen: continue
+                seen.add(k)
+                keep.setdefault(s.name, f"每{label}")
+        return keep
+
+
+_deleter = ThreadPoolExecutor(max_workers=DELETE_WORKERS, thread_name_prefix="mc-prune")
+_deleting = set()
+_deleting_lock = threading.Lock()
+
+
+def _remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def delete_snapshots_async(dest_dir, names, on_done=None, on_gc=None):
+    """删除一批快照：先重命名为 .deleting-* (瞬间完成，列表中立即消失)，再交给后台线程池真正删除。
+
+    on_done(name, error) 在后台线程中对每个快照各调用一次；批次中有去重清单时，全部删完后回收无引用数据块，
+    结果 (回收数量或异常) 交给 on_gc。"""
+    index = backup_index(dest_dir)
+    staged = []
+    for n in names:
+        tmp = os.path.join(dest_dir, DELETING_PREFIX + n)
+        with _deleting_lock:
+            _deleting.add(tmp)
+        try:
+            os.rename(os.path.join(dest_dir, n), tmp)
+            staged.append((n, tmp))
+        except OSError as e:
+            with _deleting_lock:
+                _deleting.discard(tmp)
+            if on_done: on_done(n, e)
+        index.discard(n)
+    backup_catalog(dest_dir).forget([n for n, _ in staged])
+    if not staged: return
+    pending = [len(staged)]
+    lock = threading.Lock()
+    gc_needed = any(is_manifest(n) for n, _ in staged)
+
+    def task(name, path):
+        err = None
+        try:
+            _remove_path(path)
+        except OSError as e:
+            err = e
+        finally:
+            with _deleting_lock:
+                _deleting.discard(path)
+        if on_done: on_done(name, err)
+        with lock:
+            pending[0] -= 1
+            last = pending[0] == 0
+        if last and gc_needed:
+            try:
+                n = gc_chunk_store(dest_dir)
+            except Exception as e:
+                n = e
+            if on_gc: on_gc(n)
+
+    for n, tmp in staged:
+        _deleter.submit(task, n, tmp)
+
+
+# ------------------ 备份目录 (catalog) ------------------
+# 只追加的 JSON lines：每行是某个快照的一组字段 (后写的覆盖先写的)，{"name": ..., "deleted": true} 表示已删除。
+CATALOG_NAME = ".catalog.jsonl"
+CATALOG_COMPACT_MIN = 200  # 作废行超过该数且多于有效条目时重写文件
+
+
+class BackupCatalog:
+    """一个服务器备份目录的快照元数据：写入备份时记录，列表页直接读取。
+
+    文件只追加；其它进程 (例如命令行校验) 追加的内容按文件长度增量读入。"""
+
+    def __init__(self, dest_dir):
+        self.path = os.path.join(dest_dir, CATALOG_NAME)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._offset = 0
+        self._dead = 0
+
+    def _apply(self, rec):
+        name = rec.get("name")
+        if not name: return
+        if rec.get("deleted"):
+            self._dead += 1 + (name in self._entries)
+            self._entries.pop(name, None)
+        else:
+            if name in self._entries: self._dead += 1
+            self._entries.setdefault(name, {}).update(rec)
+
+    def _sync(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        if size < self._offset:  # 被其它进程压缩重写
+            self._entries, self._offset, self._dead = {}, 0, 0
+        if size == self._offset: return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(size - self._offset)
+        end = data.rfind(b"\n") + 1  # 只读入完整的行，写了一半的行留给下一次
+        for line in data[:end].splitlines():
+            try:
+                self._apply(json.loads(line))
+            except ValueError:
+                self._dead += 1
+        self._offset += end
+
+    def _append(self, records):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(r, ensure_ascii=False, separators=(',', ':')) + "\n" for r in records))
+
+    def entries(self):
+        """{快照名: 元数据}"""
+        with self._lock:
+            self._sync()
+            return {k: dict(v) for k, v in self._entries.items()}
+
+    def get(self, name):
+        with self._lock:
+            self._sync()
+            rec = self._entries.get(name)
+            return dict(rec) if rec else None
+
+    def record(self, name, **fields):
+        with self._lock:
+            self._sync()
+            self._append([{"name": name, **fields}])
+            self._sync()
+
+    def forget(self, names):
+        if not names: return
+        with self._lock:
+            self._sync()
+            self._append([{"name": n, "deleted": True} for n in names])
+            self._sync()
+            if self._dead > max(CATALOG_COMPACT_MIN, len(self._entries)):
+                self._compact()
+
+    def _compact(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for rec in self._entries.values():
+                f.write(json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + "\n")
+        os.replace(tmp, self.path)
+        self._offset = os.path.getsize(self.path)
+        self._dead = 0
+
+
+_catalogs = {}
+
+
+def backup_catalog(dest_dir):
+    key = os.path.abspath(dest_dir)
+    with _indexes_lock:
+        if key not in _catalogs:
+            _catalogs[key] = BackupCatalog(key)
+        return _catalogs[key]
+
+
+def record_snapshot(dest_dir, name, targets, stats, stored=None, checksums=True):
+    """备份写完后把统计信息记入目录；stored 为实际占用 (归档文件大小)，省略时取新写入的字节数"""
+    info = parse_snapshot_name(name)
+    backup_catalog(dest_dir).record(
+        name, kind=info.kind if info else None, note=info.note if info else None,
+        time=info.time.isoformat() if info else None, worlds=targets,
+        files=stats.copied_files + stats.linked_files,
+        bytes=stats.copied_bytes + stats.linked_bytes,
+        new_bytes=stats.copied_bytes if stored is None else stored,
+        checksums=checksums)
+
+
+def record_verify(path, errors):
+    """记录一次完整性校验的结果"""
+    backup_catalog(os.path.dirname(os.path.abspath(path))).record(
+        os.path.basename(path), verified="ok" if not errors else "failed",
+        verified_at=datetime.datetime.now().isoformat(timespec="seconds"))
+
+
+# ------------------ 选择性还原 ------------------
+# 维度的区块数据在 <维度目录>/{region,entities,poi}/r.X.Z.mca；下界/末地在原版中是 world/DIM-1、world/DIM1，
+# 在 Paper 等分离世界的服务端中是 world_nether/DIM-1、world_the_end/DIM1。
+DIMENSIONS = {"overworld": "主世界", "nether": "下界", "end": "末地"}
+CHUNK_DIRS = ("region", "entities", "poi")
+REGION_FILE_RE = re.compile(r"r\.(-?\d+)\.(-?\d+)\.mca$")
+REGION_BLOCKS = 512
+UUID_RE = re.compile(r"^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$")
+RESTORE_TMP_SUFFIX = ".restore-tmp"
+
+
+class RestoreSelection:
+    """选择性还原的范围：dirs 中 (不递归) 通过过滤的文件。
+
+    names: 只选这些文件名；box: 区域坐标范围 (rx1, rz1, rx2, rz2)；
+    prune: 范围内现有、但备份里没有的文件 (备份之后新生成的区域) 一并删除。"""
+
+    def __init__(self, dirs, names=None, box=None, prune=False, label=""):
+        self.dirs = set(dirs)
+        self.names = set(names) if names is not None else None
+        self.box = box
+        self.prune = prune
+        self.label = label
+
+    def match(self, rel):
+        d, _, base = rel.rpartition("/")
+        if d not in self.dirs: return False
+        if self.names is not None and base not in self.names: return False
+        if self.box:
+            m = REGION_FILE_RE.match(base)
+            if not m: return False
+            x, z = int(m.group(1)), int(m.group(2))
+            x1, z1, x2, z2 = self.box
+            return x1 <= x <= x2 and z1 <= z <= z2
+        return True
+
+
+def region_box(x1, z1, x2, z2):
+    """方块坐标矩形 -> 覆盖它的区域坐标范围"""
+    return (min(x1, x2) // REGION_BLOCKS, min(z1, z2) // REGION_BLOCKS,
+            max(x1, x2) // REGION_BLOCKS, max(z1, z2) // REGION_BLOCKS)
+
+
+def dimension_selection(level, dim, box=None):
+    """level: 世界名 (level-name)；dim: DIMENSIONS 中的键；box: 方块坐标 (x1, z1, x2, z2)，省略时整个维度"""
+    roots = {"overworld": [level],
+             "nether": [f"{level}/DIM-1", f"{level}_nether/DIM-1"],
+             "end": [f"{level}/DIM1", f"{level}_the_end/DIM1"]}[dim]
+    label = DIMENSIONS[dim]
+    rbox = region_box(*box) if box else None
+    if rbox: label += " 区域 r.%d.%d ~ r.%d.%d" % rbox
+    return RestoreSelection({f"{r}/{c}" for r in roots for c in CHUNK_DIRS}, box=rbox, prune=True, label=label)
+
+
+def resolve_player_uuids(server_dir, tokens):
+    """玩家名或 UUID -> 带连字符的小写 UUID；玩家名从 usercache.json 查找。返回 (uuid 列表, 无法识别的项)"""
+    cache = None
+    uuids, unknown = [], []
+    for t in tokens:
+        if UUID_RE.match(t):
+            h = t.replace("-", "").lower()
+            uuids.append(f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}")
+            continue
+        if cache is None:
+            try:
+                with open(os.path.join(server_dir, "usercache.json"), 'r', encoding='utf-8') as f:
+                    cache = {e["name"].lower(): e["uuid"] for e in json.load(f)}
+            except (OSError, ValueError, KeyError, TypeError):
+                cache = {}
+        u = cache.get(t.lower())
+        if u: uuids.append(u)
+        else: unknown.append(t)
+    return uuids, unknown
+
+
+def player_selection(level, uuids):
+    return RestoreSelection({f"{level}/playerdata"}, names={f"{u}.dat" for u in uuids},
+                            label=f"{len(uuids)} 名玩家的数据")
+
+
+def _replace_file(dst, write):
+    """write(tmp) 写出完整文件后再替换 dst，中途失败不会留下半个文件"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + RESTORE_TMP_SUFFIX
+    try:
+        write(tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        try: os.remove(tmp)
+        except OSError: pass
+        raise
+
+
+def _selected_sources(path, selection):
+    """快照中选中的文件: 返回 (存在于快照中的范围目录集合, [(rel, write(tmp) 回调)]) (归档除外)"""
+    if is_manifest(path):
+        manifest = load_manifest(path)
+        store = ChunkStore(os.path.dirname(path))
+        present = {d for d in manifest["dirs"] if d in selection.dirs}
+
+        def writer(f):
+            def write(tmp):
+                with open(tmp, 'wb') as out:
+                    for h in f["chunks"]:
+                        out.write(store.get(h))
+                os.utime(tmp, ns=(f["mtime_ns"], f["mtime_ns"]))
+            return write
+        return present, [(f["path"], writer(f)) for f in manifest["files"] if selection.match(f["path"])]
+
+    dest_dir, snapshot = os.path.split(os.path.normpath(path))
+    present, items = set(), []
+    for d in selection.dirs:
+        src = os.path.join(path, d.replace("/", os.sep))
+        try:
+            names = os.listdir(src)
+        except OSError:
+            continue
+        present.add(d)
+        for n in names:
+            delta = n.endswith(".mca" + DELTA_SUFFIX)
+            rel = f"{d}/{n[:-len(DELTA_SUFFIX)] if delta else n}"
+            if not selection.match(rel) or not os.path.isfile(os.path.join(src, n)): continue
+            if delta:
+                items.append((rel, lambda tmp, rel=rel: reconstruct_region(dest_dir, snapshot, rel, tmp)))
+            else:
+                items.append((rel, lambda tmp, p=os.path.join(src, n): copy_file(p, tmp)))
+    return present, items
+
+
+def restore_selected(path, dest_root, selection, stats=None):
+    """只把快照中被 selection 选中的文件写回 dest_root；返回 (还原的 rel 列表, 删除的 rel 列表)"""
+    stats = stats or CopyStats()
+    restored = []
+    if is_archive(path):
+        # 归档只能顺序读取：解压流过一遍，只写出选中的成员
+        present = set()
+        with _ArchiveReader(path) as tar:
+            for member in tar:
+                if member.isdir() and member.name in selection.dirs:
+                    present.add(member.name)
+                if not member.isfile() or not selection.match(member.name): continue
+                present.add(member.name.rpartition("/")[0])
+                src = tar.extractfile(member)
+
+                def write(tmp, src=src, mtime=member.mtime):
+                    with open(tmp, 'wb') as out:
+                        shutil.copyfileobj(src, out, IO_SLICE)
+                    os.utime(tmp, (mtime, mtime))
+                _replace_file(os.path.join(dest_root, member.name.replace("/", os.sep)), write)
+                stats.add_copied(member.size)
+                restored.append(member.name)
+    else:
+        present, items = _selected_sources(path, selection)
+
+        def restore(item):
+            rel, write = item
+            dst = os.path.join(dest_root, rel.replace("/", os.sep))
+            _replace_file(dst, write)
+            stats.add_copied(os.path.getsize(dst))
+            return rel
+        restored = pool_map(restore, items)
+
+    removed = []
+    if selection.prune:
+        keep = set(restored)
+        # 只清理快照里确实包含的目录，避免备份缺少某个维度时误删现有数据
+        for d in present:
+            live = os.path.join(dest_root, d.replace("/", os.sep))
+            try:
+                names = os.listdir(live)
+            except OSError:
+                continue
+            for n in names:
+                rel = f"{d}/{n}"
+                if rel in keep or not selection.match(rel) or not os.path.isfile(os.path.join(live, n)): continue
+                os.remove(os.path.join(live, n))
+                removed.append(rel)
+    return restored, removed
+
+
+# ------------------ 暂存 + 重命名换入的整体还原 ------------------
+# <服务器目录>/.restore-stage/  暂存还原出的世界 (与现有世界同一文件系统，换入只需重命名)
+# <服务器目录>/.restore-undo/   被换下的世界 + undo.json，可一次重命名撤销
+RESTORE_STAGE_DIR = ".restore-stage"
+RESTORE_UNDO_DIR = ".restore-undo"
+RESTORE_UNDO_META = "undo.json"
+RESTORE_DIRS = (RESTORE_STAGE_DIR, RESTORE_UNDO_DIR)
+
+
+def stage_restore(path, server_dir, exclude=(), stats=None):
+    """把快照完整还原到暂存目录 (服务器可以继续运行)；返回暂存好的顶层项目名列表"""
+    recover_interrupted_restore(server_dir)
+    clean_stale_partials(server_dir)
+    stats = stats or CopyStats()
+    stage = os.path.join(server_dir, RESTORE_STAGE_DIR)
+    shutil.rmtree(stage, ignore_errors=True)
+    os.makedirs(stage)
+    if is_manifest(path):
+        restore_dedup_snapshot(path, stage, stats=stats)
+    elif is_archive(path):
+        extract_archive(path, stage, stats)
+    else:
+        for n in os.listdir(path):
+            if n in exclude or n in SNAPSHOT_META_FILES: continue
+            src = os.path.join(path, n)
+            if os.path.isdir(src):
+                restore_tree(path, n, os.path.join(stage, n), stats)
+            else:
+                copy_file(src, os.path.join(stage, n), stats=stats)
+    return sorted(n for n in os.listdir(stage) if n not in exclude)
+
+
+def _write_undo_meta(undo, meta):
+    tmp = os.path.join(undo, RESTORE_UNDO_META + ".tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(undo, RESTORE_UNDO_META))
+
+
+def read_undo_point(server_dir):
+    """上一次还原留下的撤销点元数据；没有时返回 None"""
+    try:
+        with open(os.path.join(server_dir, RESTORE_UNDO_DIR, RESTORE_UNDO_META), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return meta if meta.get("state") == "done" else None
+    except (OSError, ValueError):
+        return None
+
+
+def _discard_async(path):
+    """先重命名再在后台删除，调用方不用等待大目录的 rmtree"""
+    if not os.path.lexists(path): return
+    tmp = os.path.join(os.path.dirname(path), DELETING_PREFIX + os.path.basename(path) + f"-{time.time_ns()}")
+    os.rename(path, tmp)
+    with _deleting_lock:
+        _deleting.add(tmp)
+
+    def task():
+        try:
+            _remove_path(tmp)
+        except OSError:
+            pass
+        finally:
+            with _deleting_lock:
+                _deleting.discard(tmp)
+    _deleter.submit(task)
+
+
+def swap_in_restore(server_dir, items, label=""):
+    """把暂存目录中的 items 换入服务器目录 (服务器必须已停止)。
+
+    每一项只需两次重命名：现有 -> 撤销点，暂存 -> 现有。换入前先写日志 (state=swapping)，
+    中途崩溃时 recover_interrupted_restore() 能回到还原前的状态。"""
+    stage = os.path.join(server_dir, RESTORE_STAGE_DIR)
+    undo = os.path.join(server_dir, RESTORE_UNDO_DIR)
+    _discard_async(undo)  # 只保留最近一次还原的撤销点
+    os.makedirs(undo)
+    meta = {"state": "swapping", "label": label, "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "items": [{"name": n, "existed": os.path.lexists(os.path.join(server_dir, n))} for n in items]}
+    _write_undo_meta(undo, meta)
+    try:
+        for item in meta["items"]:
+            n = item["name"]
+            if item["existed"]:
+                os.rename(os.path.join(server_dir, n), os.path.join(undo, n))
+            os.rename(os.path.join(stage, n), os.path.join(server_dir, n))
+    except BaseException:
+        recover_interrupted_restore(server_dir)
+        raise
+    meta["state"] = "done"
+    _write_undo_meta(undo, meta)
+    _discard_async(stage)
+    return meta
+
+
+def _swap_back(server_dir, meta, restored_to):
+    """把换入的项目移到 restored_to (不存在则新建)，再把撤销点中的原数据放回"""
+    undo = os.path.join(server_dir, RESTORE_UNDO_DIR)
+    os.makedirs(restored_to, exist_ok=True)
+    for item in reversed(meta["items"]):
+        n = item["name"]
+        live, old = os.path.join(server_dir, n), os.path.join(undo, n)
+        if os.path.lexists(live) and (not item["existed"] or os.path.lexists(old)):
+            os.rename(live, os.path.join(restored_to, n))
+        if item["existed"] and os.path.lexists(old):
+            os.rename(old, live)
+
+
+def recover_interrupted_restore(server_dir):
+    """换入过程中断 (崩溃/断电) 时回到还原前的状态；返回是否做了恢复"""
+    undo = os.path.join(server_dir, RESTORE_UNDO_DIR)
+    try:
+        with open(os.path.join(undo, RESTORE_UNDO_META), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if meta.get("state") != "swapping": return False
+    stage = os.path.join(server_dir, RESTORE_STAGE_DIR)
+    for item in reversed(meta["items"]):
+        n = item["name"]
+        if os.path.lexists(os.path.join(stage, n)):
+            # 暂存的还没换入：只需把已挪走的现有数据放回
+            if item["existed"] and os.path.lexists(os.path.join(undo, n)):
+                os.rename(os.path.join(undo, n), os.path.join(server_dir, n))
+        else:
+            _swap_back(server_dir, {"items": [item]}, stage)
+    _discard_async(undo)
+    return True
+
+
+def undo_restore(server_dir):
+    """撤销上一次整体还原 (服务器必须已停止)：换回被换下的世界，还原进来的世界被删除。返回撤销点元数据"""
+    meta = read_undo_point(server_dir)
+    if meta is None:
+        raise RuntimeError("没有可撤销的还原")
+    trash = os.path.join(server_dir, RESTORE_STAGE_DIR)
+    _discard_async(trash)
+    _swap_back(server_dir, meta, trash)
+    _discard_async(trash)
+    _discard_async(os.path.join(server_dir, RESTORE_UNDO_DIR))
+    return meta
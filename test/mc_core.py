@@ -0,0 +1,1826 @@
+# mc_core.py
+"""
+服务器管理核心 (不依赖 GUI)
+
+进程控制、控制台管道、日志轮转/索引、备份/还原与部署逻辑。
+Tk 界面 (mc_server_manager_v_2.py) 与无界面守护进程 (mc_daemon.py) 共用这里的实现。
+"""
+
+import os
+import re
+import json
+import time
+import queue
+import gzip
+import bisect
+import shutil
+import sqlite3
+import zipfile
+import datetime
+import threading
+import collections
+import subprocess
+
+from mc_log_events import (LineClassifier, strip_ansi, EVENT_JOIN, EVENT_LEAVE, EVENT_LIST,
+                           EVENT_STARTUP_DONE, EVENT_SAVED, EVENT_LAG, EVENT_TPS)
+import mc_backup
+
+try:
+    import requests
+except ImportError:  # 只有部署 / 获取版本列表需要
+    requests = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# ------------------ 全局常量 ------------------
+DEFAULT_SERVER_JAR = "server.jar"
+STOP_WAIT_SECONDS = 12
+LOG_DIR = "logs"  # 总日志目录
+LOG_APP_DIR = os.path.join(LOG_DIR, "app")       # 程序日志目录
+LOG_SERVER_DIR = os.path.join(LOG_DIR, "server") # 服务器日志目录
+BACKUP_DIR = "backups"
+SERVERS_ROOT_DIR = "servers" 
+DEFAULT_XMS = "1G" 
+DEFAULT_XMX = "2G" 
+
+# 控制台 / 日志管道
+SERVER_CONSOLE_ENCODING = "utf-8"   # 启动参数强制 Java 控制台使用 UTF-8，日志原样写盘
+SERVER_JVM_ENCODING_ARGS = ['-Dfile.encoding=UTF-8', '-Dstdout.encoding=UTF-8',
+                            '-Dstderr.encoding=UTF-8', '-Dstdin.encoding=UTF-8']
+READ_CHUNK_BYTES = 64 * 1024        # 读取线程每次 os.read 的字节数
+DEFAULT_CONSOLE_SCROLLBACK = 5000   # 控制台默认保留行数 (可在 manager_config.json 中按服务器配置)
+STDOUT_QUEUE_HIGH_WATER = 20000     # 读取线程与界面之间最多积压的行数 (可在 manager_config.json 中配置)
+LOG_WRITE_BUFFER_BYTES = 1024 * 1024  # 日志文件写缓冲
+LOG_FLUSH_INTERVAL_S = 2.0            # 日志最长刷盘间隔
+LOG_FLUSH_BYTES = 256 * 1024          # 累计写入超过此值立即刷盘
+# 日志轮转默认值 (控制台日志可在 manager_config.json 中按服务器配置)
+DEFAULT_LOG_ROTATE_MB = 64
+DEFAULT_LOG_ROTATE_HOURS = 24
+DEFAULT_LOG_KEEP_DAYS = 30
+DEFAULT_LOG_KEEP_FILES = 200
+LOG_INDEX_PATH = os.path.join(LOG_DIR, "console_index.sqlite3")  # 控制台历史检索索引
+LOG_INDEX_INTERVAL_S = 60             # 后台索引刷新间隔
+PLAYER_DB_PATH = os.path.join(LOG_DIR, "player_sessions.sqlite3")  # 玩家在线记录
+PLAYER_DB_FLUSH_S = 2.0               # 玩家事件批量写入间隔
+SAVE_CONFIRM_TIMEOUT_S = 120          # 备份前等待 "Saved the game" 确认的最长时间
+BACKUP_LAG_PAUSE_S = 15               # 出现 "Can't keep up" 后备份暂停的秒数
+BACKUP_LOW_TPS = 18.0                 # tps 报告低于该值时同样暂停备份
+RESTORE_STOP_TIMEOUT_S = 180          # 运行中还原时等待服务器停止的最长时间
+ENGINE_LOG_BACKLOG = 1000             # 守护进程为每个服务器保留的管理器日志行数
+
+
+# ------------------ 工具函数 ------------------
+def ensure_dirs():
+    if not os.path.isdir(LOG_APP_DIR):
+        os.makedirs(LOG_APP_DIR, exist_ok=True)
+    if not os.path.isdir(LOG_SERVER_DIR):
+        os.makedirs(LOG_SERVER_DIR, exist_ok=True)
+        
+    if not os.path.isdir(BACKUP_DIR):
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+    if not os.path.isdir(SERVERS_ROOT_DIR): 
+        os.makedirs(SERVERS_ROOT_DIR, exist_ok=True)
+
+def timestamp_str():
+    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+
+def parse_memory_value(s):
+    if not s: return None
+    s = s.strip()
+    m = re.match(r'^(\d+)([gGmM])?$', s)
+    if not m: return None
+    num = m.group(1)
+    suf = m.group(2)
+    if not suf: return f"{num}M"
+    if suf.lower() == 'g': return f"{num}G"
+    return f"{num}M"
+
+def get_required_java_version(mc_version):
+    try:
+        parts = mc_version.split(".")
+        if mc_version.startswith("1.") and len(parts) > 1 and parts[1].isdigit():
+            major = int(parts[1])
+            minor = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
+        elif parts[0].isdigit():
+            major = int(parts[0])
+            minor = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+        else:
+            return 8
+        return 21 if major >= 21 or (major == 20 and minor >= 5) else 17 if major >= 17 else 8
+    except Exception:
+        return 8
+
+def get_paper_versions():
+    try:
+        response = requests.get("https://api.papermc.io/v2/projects/paper", timeout=5)
+        response.raise_for_status()
+        data = response.json()
+        versions = data["versions"]
+        versions.reverse() 
+        return versions
+    except Exception:
+        return []
+
+def get_adoptium_download_url(version):
+    base = f"https://api.adoptium.net/v3/assets/latest/{version}/hotspot"
+    params = {"architecture": "x64", "heap_size": "normal", "image_type": "jdk", "jvm_impl": "hotspot", "os": "windows", "vendor": "eclipse"}
+    try:
+        response = requests.get(base, params=params, timeout=10)
+        data = response.json()
+        if data:
+            return data[0]["binary"]["package"]["link"]
+        return None
+    except Exception:
+        return None
+
+# ------------------ 日志轮转 / 压缩 / 保留 ------------------
+class LogRotation:
+    """日志轮转设置：按大小或时长切分，切下的分段后台 gzip 压缩，按天数/数量清理"""
+
+    def __init__(self, max_mb=DEFAULT_LOG_ROTATE_MB, max_hours=DEFAULT_LOG_ROTATE_HOURS,
+                 keep_days=DEFAULT_LOG_KEEP_DAYS, keep_files=DEFAULT_LOG_KEEP_FILES, compress=True):
+        self.max_bytes = int(float(max_mb) * 1024 * 1024) if max_mb else 0
+        self.max_age_s = float(max_hours) * 3600 if max_hours else 0
+        self.keep_days = float(keep_days) if keep_days else 0
+        self.keep_files = int(keep_files) if keep_files else 0
+        self.compress = bool(compress)
+
+    @classmethod
+    def from_config(cls, data):
+        try:
+            return cls(data.get("log_rotate_mb", DEFAULT_LOG_ROTATE_MB),
+                       data.get("log_rotate_hours", DEFAULT_LOG_ROTATE_HOURS),
+                       data.get("log_keep_days", DEFAULT_LOG_KEEP_DAYS),
+                       data.get("log_keep_files", DEFAULT_LOG_KEEP_FILES),
+                       data.get("log_compress", True))
+        except (TypeError, ValueError):
+            return cls()
+
+    def to_config(self):
+        return {
+            "log_rotate_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "log_rotate_hours": round(self.max_age_s / 3600, 2),
+            "log_keep_days": self.keep_days,
+            "log_keep_files": self.keep_files,
+            "log_compress": self.compress,
+        }
+
+
+_LOG_NAME_RE = re.compile(r"^(?P<prefix>.+?)-\d{8}-\d{6}(?:-\d+)?\.log(?:\.gz)?$")
+
+def _log_prefix(path):
+    m = _LOG_NAME_RE.match(os.path.basename(path))
+    return m.group("prefix") if m else os.path.splitext(os.path.basename(path))[0]
+
+def _next_log_path(path):
+    """按原日志的前缀生成新的分段文件名: <prefix>-<时间戳>[-n].log"""
+    folder = os.path.dirname(path)
+    base = f"{_log_prefix(path)}-{timestamp_str()}"
+    cand = os.path.join(folder, base + ".log")
+    n = 1
+    while os.path.exists(cand) or os.path.exists(cand + ".gz"):
+        cand = os.path.join(folder, f"{base}-{n}.log")
+        n += 1
+    return cand
+
+def gzip_log_file(path):
+    """把已关闭的日志分段压缩为 .log.gz (先写临时文件再改名)，成功后删除原文件"""
+    gz_path = path + ".gz"
+    tmp_path = gz_path + ".tmp"
+    try:
+        with open(path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_path, gz_path)
+        os.remove(path)
+        return gz_path
+    except Exception:
+        try: os.remove(tmp_path)
+        except OSError: pass
+        return None
+
+def prune_log_dir(folder, prefix, rotation, active_path=None):
+    """按保留天数与文件数量清理同前缀的历史日志 (不会删除正在写入的文件)"""
+    if not rotation.keep_days and not rotation.keep_files: return
+    try:
+        entries = []
+        for name in os.listdir(folder):
+            m = _LOG_NAME_RE.match(name)
+            if not m or m.group("prefix") != prefix: continue
+            full = os.path.join(folder, name)
+            if active_path and os.path.abspath(full) == os.path.abspath(active_path): continue
+            entries.append((name, full))
+    except OSError:
+        return
+    # 文件名中带时间戳，按名称倒序即由新到旧
+    entries.sort(reverse=True)
+    cutoff = time.time() - rotation.keep_days * 86400 if rotation.keep_days else None
+    for i, (name, full) in enumerate(entries):
+        too_many = rotation.keep_files and i >= rotation.keep_files
+        try:
+            too_old = cutoff is not None and os.path.getmtime(full) < cutoff
+            if too_many or too_old:
+                os.remove(full)
+        except OSError:
+            pass
+
+def console_log_path(server_name):
+    """新的控制台日志路径 logs/server/console-<服务器名>-<时间>.log。
+    保留策略按服务器配置、按文件名前缀清理，所以前缀中必须带服务器名，避免一个服务器的设置删掉其它服务器的日志"""
+    safe = re.sub(r"[^\w.-]", "_", server_name or "server")
+    return os.path.join(LOG_SERVER_DIR, f"console-{safe}-{timestamp_str()}.log")
+
+def finalize_log_segment(path, rotation):
+    """后台压缩一个已关闭的分段并执行保留策略，不阻塞日志写入线程"""
+    def work():
+        if rotation.compress: gzip_log_file(path)
+        prune_log_dir(os.path.dirname(path), _log_prefix(path), rotation)
+    # 非守护线程：程序退出时也会等待压缩完成
+    threading.Thread(target=work, name="log-compress", daemon=False).start()
+
+# ------------------ 日志写入线程 ------------------
+class BufferedLogWriter:
+    """独立线程写日志文件：大缓冲写入，按时间或累计字节数刷盘，调用方永不阻塞在磁盘上。
+    文件以二进制打开 (UTF-8)：write() 接受文本，write_bytes() 直接写入原始字节。
+    指定 rotation 时按大小/时长切分新文件，切下的分段在后台压缩与清理。
+    close() 之后再写入会抛出 ValueError (与已关闭的文件对象一致)，不会悄悄丢弃。"""
+
+    _FLUSH = object()
+    _CLOSE = object()
+
+    def __init__(self, path, name="log-writer", rotation=None):
+        self.path = path
+        self.rotation = rotation
+        self._fh = open(path, 'ab', buffering=LOG_WRITE_BUFFER_BYTES)
+        self._q = queue.Queue()
+        self._lock = threading.Lock()
+        self.closed = False
+        self.bytes_written = 0
+        self._segment_bytes = os.path.getsize(path)
+        self._segment_start = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        with self._lock:
+            if self.closed:
+                raise ValueError(f"日志已关闭: {self.path}")
+            self._q.put(item)
+
+    def write(self, text):
+        self._put(text)
+
+    def write_bytes(self, data):
+        if data:
+            self._put(data)
+
+    def write_lines(self, lines):
+        if lines:
+            self._put('\n'.join(lines) + '\n')
+
+    def flush(self, timeout=5.0):
+        """请求刷盘并等待写入线程完成 (不要在界面线程上调用)"""
+        done = threading.Event()
+        self._put((self._FLUSH, done))
+        done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        with self._lock:
+            if self.closed: return
+            self.closed = True
+            self._q.put((self._CLOSE, None))
+        self._thread.join(timeout)
+
+    def _run(self):
+        pending = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                items = [self._q.get(timeout=LOG_FLUSH_INTERVAL_S)]
+            except queue.Empty:
+                items = []
+            # 一次取出所有已排队的内容，合并写入
+            while True:
+                try: items.append(self._q.get_nowait())
+                except queue.Empty: break
+
+            for it in items:
+                if not isinstance(it, tuple):
+                    try:
+                        if isinstance(it, str): it = it.encode('utf-8', errors='replace')
+                        self._fh.write(it)
+                        pending += len(it)
+                        self.bytes_written += len(it)
+                        self._segment_bytes += len(it)
+                    except Exception: pass
+                    continue
+
+                kind, done = it
+                try: self._fh.flush()
+                except Exception: pass
+                pending = 0
+                last_flush = time.monotonic()
+                if kind is self._CLOSE:
+                    try: self._fh.close()
+                    except Exception: pass
+                    if self.rotation:
+                        finalize_log_segment(self.path, self.rotation)
+                    return
+                done.set()
+
+            if pending >= LOG_FLUSH_BYTES or (pending and time.monotonic() - last_flush >= LOG_FLUSH_INTERVAL_S):
+                try: self._fh.flush()
+                except Exception: pass
+                pending = 0
+                last_flush = time.monotonic()
+
+            if self._should_rotate():
+                self._rotate()
+
+    def _should_rotate(self):
+        r = self.rotation
+        if not r or not self._segment_bytes: return False
+        if r.max_bytes and self._segment_bytes >= r.max_bytes: return True
+        return bool(r.max_age_s and time.monotonic() - self._segment_start >= r.max_age_s)
+
+    def _rotate(self):
+        """在写入线程内切换到新分段；旧分段交给后台压缩"""
+        try:
+            new_path = _next_log_path(self.path)
+            new_fh = open(new_path, 'ab', buffering=LOG_WRITE_BUFFER_BYTES)
+        except Exception:
+            return
+        old_path, old_fh = self.path, self._fh
+        self.path, self._fh = new_path, new_fh
+        self._segment_bytes = 0
+        self._segment_start = time.monotonic()
+        try: old_fh.close()
+        except Exception: pass
+        finalize_log_segment(old_path, self.rotation)
+
+# ------------------ 读取线程 -> 界面 的行缓冲 ------------------
+class LineBatchQueue:
+    """读取线程按批推送日志行，界面线程按批取出。
+
+    积压超过高水位时丢弃最旧的普通行 (keep 判定为重要的行会保留，但最多保留高水位一半的数量，
+    超出时丢弃其中最旧的，队列长度始终有上限)，丢弃数量会被累计并通过 take_dropped() 报告。
+    磁盘日志不经过此队列。
+
+    notify 在队列由空变为非空时调用一次 (用于唤醒界面线程)；界面取完数据后调用 rearm()，
+    在锁内判断是否还有积压，保证不会丢失唤醒。
+    """
+
+    def __init__(self, high_water, keep=None, notify=None):
+        self.high_water = max(1000, int(high_water))
+        self.keep = keep
+        self.notify = notify
+        self._signaled = False
+        self._lines = collections.deque()
+        self._lock = threading.Lock()
+        self.batches_in = 0
+        self.lines_in = 0
+        self.dropped_total = 0
+        self._dropped_pending = 0
+
+    def put_lines(self, lines):
+        if not lines: return
+        with self._lock:
+            self._lines.extend(lines)
+            self.batches_in += 1
+            self.lines_in += len(lines)
+            if len(self._lines) > self.high_water:
+                self._shed_locked()
+            wake = not self._signaled
+            self._signaled = True
+        if wake and self.notify:
+            self.notify()
+
+    def rearm(self):
+        """界面处理完一轮后调用：队列已空则重新允许唤醒并返回 False，仍有积压返回 True"""
+        with self._lock:
+            if self._lines:
+                return True
+            self._signaled = False
+            return False
+
+    def reset_wakeup(self):
+        """notify 投递失败时调用：清除已唤醒标记，下一批写入会重新调用 notify，而不是永远等待 rearm()"""
+        with self._lock:
+            self._signaled = False
+
+    def put(self, line):
+        self.put_lines([line])
+
+    def _shed_locked(self):
+        # 丢到高水位的一半，避免每批都触发
+        target = self.high_water // 2
+        excess = len(self._lines) - target
+        kept = []
+        dropped = 0
+        while excess > 0 and self._lines:
+            line = self._lines.popleft()
+            excess -= 1
+            if self.keep and self.keep(line):
+                kept.append(line)
+            else:
+                dropped += 1
+        # 重要行也不能无限累积 (例如插件刷屏恰好命中关键字)：只保留最新的一部分
+        limit = self.high_water // 2
+        if len(kept) > limit:
+            dropped += len(kept) - limit
+            kept = kept[-limit:]
+        if kept:
+            self._lines.extendleft(reversed(kept))
+        self.dropped_total += dropped
+        self._dropped_pending += dropped
+
+    def drain(self, max_lines):
+        with self._lock:
+            n = min(max_lines, len(self._lines))
+            return [self._lines.popleft() for _ in range(n)]
+
+    def take_dropped(self):
+        with self._lock:
+            n = self._dropped_pending
+            self._dropped_pending = 0
+            return n
+
+    def empty(self):
+        return not self._lines
+
+    def qsize(self):
+        return len(self._lines)
+
+    def clear(self):
+        with self._lock:
+            self._lines.clear()
+
+    def reset_counters(self):
+        with self._lock:
+            self.batches_in = self.lines_in = 0
+            self.dropped_total = self._dropped_pending = 0
+
+
+# 积压时不丢弃的行：玩家进出/list 回显，备份前等待的存档确认，触发备份让路的卡顿告警，
+# 以及启动完成 (Done (3.2s)! For help, type "help"，两段都要出现，避免任何含 "Done" 的行都被保留)
+_STATE_NEEDLES = ("joined the game", "left the game", "players online", "Saved the game", "Can't keep up")
+_STATE_NEEDLES_B = tuple(n.encode() for n in _STATE_NEEDLES)
+_STARTUP_NEEDLES = ("Done (", "For help")
+_STARTUP_NEEDLES_B = tuple(n.encode() for n in _STARTUP_NEEDLES)
+
+def is_state_line(line):
+    """会改变管理器状态的日志行 (启动完成/玩家进出/list 回显/存档确认/卡顿告警)，积压时不丢弃；支持 str 与未解码的 bytes"""
+    raw = isinstance(line, bytes)
+    for n in _STATE_NEEDLES_B if raw else _STATE_NEEDLES:
+        if n in line: return True
+    done, help_ = _STARTUP_NEEDLES_B if raw else _STARTUP_NEEDLES
+    return done in line and help_ in line
+
+
+def decode_console_batch(batch, encoding=SERVER_CONSOLE_ENCODING):
+    """把队列中取出的一批行 (未解码的 bytes 与管理器自己插入的 str 混合) 解码为 str；
+    连续的 bytes 行拼接后一次性解码"""
+    out = []
+    run = []
+    for item in batch:
+        if isinstance(item, bytes):
+            run.append(item)
+            continue
+        if run:
+            out.extend(b'\n'.join(run).decode(encoding, errors='replace').split('\n'))
+            run = []
+        out.append(item)
+    if run:
+        out.extend(b'\n'.join(run).decode(encoding, errors='replace').split('\n'))
+    return out
+
+# ------------------ 控制台滚动缓冲 ------------------
+class ConsoleScrollback:
+    """固定容量的环形缓冲，记录文本框中保留的行；超出容量时批量裁剪最旧的行"""
+
+    def __init__(self, capacity):
+        self.capacity = max(100, int(capacity))
+        self.lines = collections.deque(maxlen=self.capacity)
+        self.widget_lines = 0  # 文本框中当前的行数
+
+    def set_capacity(self, capacity):
+        capacity = max(100, int(capacity))
+        if capacity != self.capacity:
+            self.capacity = capacity
+            self.lines = collections.deque(self.lines, maxlen=capacity)
+
+    def append(self, new_lines):
+        """追加若干行，返回需要从文本框顶部删除的行数 (0 表示无需裁剪)"""
+        self.lines.extend(new_lines)
+        self.widget_lines += len(new_lines)
+        # 允许超出 10% 后再一次性裁剪，避免每次插入都删除
+        if self.widget_lines > self.capacity + max(1, self.capacity // 10):
+            excess = self.widget_lines - self.capacity
+            self.widget_lines = self.capacity
+            return excess
+        return 0
+
+    def clear(self):
+        self.lines.clear()
+        self.widget_lines = 0
+
+
+def textbox_append(widget, scrollback, lines):
+    """向只读文本框追加多行，并按滚动缓冲容量批量删除最旧的行"""
+    if not lines: return
+    excess = scrollback.append(lines)
+    widget.configure(state='normal')
+    widget.insert('end', '\n'.join(lines) + '\n')
+    if excess:
+        widget.delete('1.0', f'{excess + 1}.0')
+    widget.see('end')
+    widget.configure(state='disabled')
+
+# ------------------ 在线玩家名册 ------------------
+def format_duration(secs):
+    """在线时长的显示文本：不足 1 小时显示分钟，否则显示 "2 小时 05 分" """
+    minutes = int(max(0, secs) // 60)
+    if minutes < 60: return f"{minutes} 分钟"
+    return f"{minutes // 60} 小时 {minutes % 60:02d} 分"
+
+
+class PlayerRoster:
+    """有序的在线玩家名册，记录每位玩家的加入时间。
+
+    join/leave 以二分查找增量维护排序，并把变化记录为操作日志 (ops)，
+    界面每次刷新只按日志增删对应的行，而不是整表重建。
+    """
+
+    def __init__(self):
+        self.join_times = {}  # 玩家名 -> 加入时间 (time.time())
+        self.names = []       # 排序后的玩家名
+        self.ops = []         # 待应用到界面的操作: ('ins', 下标, 名字) / ('del', 下标)
+        self.full_redraw = True
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.join_times
+
+    def join(self, name, ts=None):
+        if name in self.join_times: return False
+        self.join_times[name] = ts or time.time()
+        idx = bisect.bisect_left(self.names, name)
+        self.names.insert(idx, name)
+        self.ops.append(('ins', idx, name))
+        return True
+
+    def leave(self, name, ts=None):
+        """移除玩家，返回本次在线时长 (秒)；玩家不在名册中返回 None"""
+        joined = self.join_times.pop(name, None)
+        if joined is None: return None
+        idx = bisect.bisect_left(self.names, name)
+        del self.names[idx]
+        self.ops.append(('del', idx))
+        return max(0.0, (ts or time.time()) - joined)
+
+    def replace(self, names, ts=None):
+        """按 /list 结果同步：保留仍在线玩家的加入时间，只增删差异部分；返回 (加入的, 离开的)"""
+        new = set(names)
+        left = [n for n in self.names if n not in new]
+        for n in left:
+            self.leave(n, ts)
+        joined = sorted(new - set(self.join_times))
+        for n in joined:
+            self.join(n, ts)
+        return joined, left
+
+    def clear(self):
+        self.join_times.clear()
+        self.names.clear()
+        self.ops.clear()
+        self.full_redraw = True
+
+    def session_seconds(self, name, now=None):
+        joined = self.join_times.get(name)
+        return None if joined is None else max(0.0, (now or time.time()) - joined)
+
+    def take_ops(self):
+        """取出待应用的操作；操作过多时返回 None 表示整表重绘更划算"""
+        ops, self.ops = self.ops, []
+        if self.full_redraw or len(ops) > len(self.names) // 2 + 16:
+            self.full_redraw = False
+            return None
+        return ops
+
+    def display_line(self, name, now=None):
+        joined = self.join_times.get(name)
+        if not joined: return f"{name}  (--:-- 加入)"
+        since = datetime.datetime.fromtimestamp(joined).strftime("%H:%M")
+        return f"{name}  ({since} 加入，已在线 {format_duration(self.session_seconds(name, now))})"
+
+# ------------------ 玩家在线记录 (统计) ------------------
+class PlayerSessionStore:
+    """按服务器持久化玩家的每次在线会话 (SQLite WAL)。
+
+    record_* 只把事件放入队列，由后台线程批量写入；查询在调用线程上新开连接执行。
+    """
+
+    def __init__(self, db_path=PLAYER_DB_PATH):
+        self.db_path = db_path
+        self._q = queue.Queue()
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions (id INTEGER PRIMARY KEY, server TEXT NOT NULL, "
+                       "player TEXT NOT NULL, join_ts REAL NOT NULL, leave_ts REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_open ON sessions (server, player) WHERE leave_ts IS NULL")
+            db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_time ON sessions (server, join_ts)")
+        self._thread = threading.Thread(target=self._run, name="player-store", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    # --- 写入 (任意线程调用，不阻塞) ---
+    def record_join(self, server, player, ts=None):
+        self._q.put(('join', server, player, ts or time.time()))
+
+    def record_leave(self, server, player, ts=None):
+        self._q.put(('leave', server, player, ts or time.time()))
+
+    def close_open_sessions(self, server, ts=None):
+        """服务器启动/停止时结束该服务器所有未结束的会话"""
+        self._q.put(('close_all', server, None, ts or time.time()))
+
+    def flush(self, timeout=5.0):
+        done = threading.Event()
+        self._q.put(('flush', None, None, done))
+        done.wait(timeout)
+
+    def _run(self):
+        db = self._connect()
+        while True:
+            try:
+                items = [self._q.get(timeout=PLAYER_DB_FLUSH_S)]
+            except queue.Empty:
+                continue
+            # 攒一小段时间的事件，在一个事务里写入
+            time.sleep(0.05)
+            while True:
+                try: items.append(self._q.get_nowait())
+                except queue.Empty: break
+            waiters = []
+            try:
+                with db:
+                    for kind, server, player, ts in items:
+                        if kind == 'join':
+                            db.execute("INSERT INTO sessions (server, player, join_ts) VALUES (?, ?, ?)", (server, player, ts))
+                        elif kind == 'leave':
+                            db.execute("UPDATE sessions SET leave_ts = ? WHERE server = ? AND player = ? AND leave_ts IS NULL",
+                                       (ts, server, player))
+                        elif kind == 'close_all':
+                            db.execute("UPDATE sessions SET leave_ts = MAX(join_ts, ?) WHERE server = ? AND leave_ts IS NULL",
+                                       (ts, server))
+                        elif kind == 'flush':
+                            waiters.append(ts)
+            except sqlite3.Error:
+                pass
+            for w in waiters: w.set()
+
+    # --- 查询 ---
+    def peak_concurrency(self, server, since=0):
+        """返回 (最高同时在线人数, 出现时间)"""
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT ts, SUM(d) OVER (ORDER BY ts, d ROWS UNBOUNDED PRECEDING) AS c FROM ("
+                " SELECT join_ts AS ts, 1 AS d FROM sessions WHERE server = ? AND COALESCE(leave_ts, ?) >= ?"
+                " UNION ALL"
+                " SELECT leave_ts AS ts, -1 AS d FROM sessions WHERE server = ? AND leave_ts IS NOT NULL AND leave_ts >= ?"
+                ") ORDER BY c DESC, ts DESC LIMIT 1", (server, now, since, server, since)).fetchone()
+        return (row[1], row[0]) if row else (0, None)
+
+    def playtime(self, server, since=0, limit=20):
+        """返回 [(玩家, 在线秒数, 会话次数)]，按在线时长降序"""
+        now = time.time()
+        with self._connect() as db:
+            return db.execute(
+                "SELECT player, SUM(COALESCE(leave_ts, ?) - MAX(join_ts, ?)) AS secs, COUNT(*) FROM sessions"
+                " WHERE server = ? AND COALESCE(leave_ts, ?) >= ? GROUP BY player ORDER BY secs DESC LIMIT ?",
+                (now, since, server, now, since, limit)).fetchall()
+
+    def recent_sessions(self, server, since=0, limit=20):
+        """返回最近的会话 [(玩家, 加入时间, 离开时间或 None)]，按加入时间由新到旧"""
+        with self._connect() as db:
+            return db.execute(
+                "SELECT player, join_ts, leave_ts FROM sessions WHERE server = ? AND COALESCE(leave_ts, ?) >= ?"
+                " ORDER BY join_ts DESC LIMIT ?", (server, time.time(), since, limit)).fetchall()
+
+    def hourly_heatmap(self, server, since=0):
+        """返回 7x24 矩阵 (周一=0)，值为该时段累计的玩家在线小时数"""
+        now = time.time()
+        grid = [[0.0] * 24 for _ in range(7)]
+        with self._connect() as db:
+            rows = db.execute("SELECT MAX(join_ts, ?), COALESCE(leave_ts, ?) FROM sessions"
+                              " WHERE server = ? AND COALESCE(leave_ts, ?) >= ?", (since, now, server, now, since)).fetchall()
+        for start, end in rows:
+            t = start
+            while t < end:
+                dt = datetime.datetime.fromtimestamp(t)
+                hour_end = (dt.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)).timestamp()
+                seg = min(end, hour_end) - t
+                grid[dt.weekday()][dt.hour] += seg / 3600.0
+                t = hour_end
+        return grid
+
+# ------------------ 控制台历史索引 ------------------
+_LINE_TIME_RE = re.compile(r'^\[(\d{2}):(\d{2}):(\d{2})')
+
+class ConsoleLogIndex:
+    """logs/server/ 下所有控制台日志 (含 .log.gz) 的全文索引。
+
+    使用 SQLite FTS5 trigram 分词 (不可用时退回默认分词)，每个日志文件记录已索引到的字节偏移，
+    增量索引正在写入的文件；分段被压缩后按同名记录继续，不会重复索引。
+    """
+
+    def __init__(self, db_path=LOG_INDEX_PATH, log_dir=LOG_SERVER_DIR):
+        self.db_path = db_path
+        self.log_dir = log_dir
+        self._lock = threading.Lock()
+        self.trigram = True
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, session TEXT, "
+                       "offset INTEGER, lines INTEGER, day TEXT, last_time TEXT, complete INTEGER)")
+            try:
+                db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5("
+                           "text, ts UNINDEXED, session UNINDEXED, lineno UNINDEXED, tokenize='trigram')")
+            except sqlite3.OperationalError:
+                db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5("
+                           "text, ts UNINDEXED, session UNINDEXED, lineno UNINDEXED)")
+            sql = db.execute("SELECT sql FROM sqlite_master WHERE name='lines'").fetchone()
+            self.trigram = bool(sql and 'trigram' in sql[0])
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @staticmethod
+    def _session_of(name):
+        # console-survival-20240101-120000.log(.gz) -> console-survival-20240101-120000
+        if name.endswith('.gz'): name = name[:-3]
+        return name[:-4] if name.endswith('.log') else name
+
+    def update(self):
+        """增量索引新出现或增长的日志，清理已被删除的日志；返回新增行数"""
+        if not self._lock.acquire(blocking=False): return 0
+        try:
+            return self._update_locked()
+        finally:
+            self._lock.release()
+
+    def _update_locked(self):
+        try:
+            names = [n for n in os.listdir(self.log_dir)
+                     if n.startswith("console-") and (n.endswith(".log") or n.endswith(".log.gz"))]
+        except OSError:
+            return 0
+
+        # 同一分段可能同时存在 .log 与 .log.gz (压缩进行中)，优先读取未压缩的
+        by_session = {}
+        for n in sorted(names):
+            by_session.setdefault(self._session_of(n), n)
+
+        added = 0
+        with self._connect() as db:
+            known = {row[0]: row for row in db.execute("SELECT name, session, offset, lines, day, last_time, complete FROM files")}
+            for session, fname in by_session.items():
+                rec = known.get(session)
+                if rec and rec[6]: continue
+                added += self._index_file(db, session, os.path.join(self.log_dir, fname), rec)
+            for session in set(known) - set(by_session):
+                db.execute("DELETE FROM lines WHERE session = ?", (session,))
+                db.execute("DELETE FROM files WHERE name = ?", (session,))
+        return added
+
+    def _index_file(self, db, session, path, rec):
+        offset = rec[2] if rec else 0
+        lineno = rec[3] if rec else 0
+        m = re.search(r"(\d{8})-\d{6}", session)
+        day = rec[4] if rec else (datetime.datetime.strptime(m.group(1), "%Y%m%d").date().isoformat() if m else "")
+        last_time = rec[5] if rec else ""
+        is_gz = path.endswith(".gz")
+
+        try:
+            fh = gzip.open(path, 'rb') if is_gz else open(path, 'rb')
+        except OSError:
+            return 0
+
+        added = 0
+        rows = []
+
+        def collect(raw_lines):
+            nonlocal lineno, day, last_time
+            for raw in raw_lines:
+                lineno += 1
+                text = strip_ansi(raw.decode('utf-8', errors='replace').rstrip())
+                if not text: continue
+                tm = _LINE_TIME_RE.match(text)
+                if tm and day:
+                    cur = f"{tm.group(1)}:{tm.group(2)}:{tm.group(3)}"
+                    if last_time and cur < last_time:
+                        # 时间回绕说明跨过了午夜
+                        day = (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+                    last_time = cur
+                rows.append((text, f"{day} {last_time}".strip(), session, lineno))
+
+        with fh:
+            try:
+                fh.seek(offset)
+            except (OSError, EOFError):
+                return 0
+            tail = b''
+            while True:
+                chunk = fh.read(4 * 1024 * 1024)
+                if not chunk:
+                    # 压缩分段不会再增长，最后一行没有换行也要索引；正在写入的文件留到下次
+                    if is_gz and tail:
+                        offset += len(tail)
+                        collect([tail])
+                    break
+                data = tail + chunk
+                parts = data.split(b'\n')
+                tail = parts.pop()
+                offset += len(data) - len(tail)
+                collect(parts)
+                if len(rows) >= 5000:
+                    db.executemany("INSERT INTO lines (text, ts, session, lineno) VALUES (?, ?, ?, ?)", rows)
+                    added += len(rows)
+                    rows.clear()
+        if rows:
+            db.executemany("INSERT INTO lines (text, ts, session, lineno) VALUES (?, ?, ?, ?)", rows)
+            added += len(rows)
+        db.execute("INSERT OR REPLACE INTO files (name, session, offset, lines, day, last_time, complete) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?)", (session, session, offset, lineno, day, last_time, 1 if is_gz else 0))
+        return added
+
+    def search(self, query, limit=200, session=None):
+        """返回 [(时间, 会话, 行号, 内容)]，按时间由新到旧"""
+        query = query.strip()
+        if not query: return []
+        sql = "SELECT ts, session, lineno, text FROM lines WHERE "
+        if self.trigram and len(query) >= 3:
+            sql += "lines MATCH ?"
+            args = ['"' + query.replace('"', '""') + '"']
+        elif not self.trigram and re.fullmatch(r"[\w ]+", query):
+            sql += "lines MATCH ?"
+            args = ['"' + query + '"']
+        else:
+            # 少于 3 个字符时 trigram 无法使用，退回扫描
+            sql += "text LIKE ? ESCAPE '\\'"
+            args = ['%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%']
+        if session:
+            sql += " AND session = ?"
+            args.append(session)
+        sql += " ORDER BY ts DESC, lineno DESC LIMIT ?"
+        args.append(int(limit))
+        with self._connect() as db:
+            return db.execute(sql, args).fetchall()
+
+    def stats(self):
+        with self._connect() as db:
+            files = db.execute("SELECT COUNT(*), COALESCE(SUM(lines), 0) FROM files").fetchone()
+        return {"files": files[0], "lines": files[1]}
+
+# ------------------ 服务器配置 (manager_config.json) ------------------
+SERVER_CONFIG_NAME = "manager_config.json"
+SERVER_LOCK_NAME = ".manager.lock"  # 跨进程占用锁 (界面与守护进程不能同时管理同一个服务器)
+_MEMORY_RE = re.compile(r"Xms(\d+[GM]).*?Xmx(\d+[GM])")
+
+
+def server_config_defaults():
+    """manager_config.json 中与界面无关的默认值"""
+    return {
+        "memory": f"Xms{DEFAULT_XMS}, Xmx{DEFAULT_XMX}",
+        "startup_backup": True,
+        "periodic_backup_enabled": False,
+        "periodic_interval": "10",
+        "periodic_keep": "10",
+        "backup_mode": mc_backup.DEFAULT_BACKUP_MODE,
+        "archive_codec": mc_backup.DEFAULT_ARCHIVE_CODEC,
+        "archive_level": "",
+        "snapshot_backend": mc_backup.DEFAULT_SNAPSHOT_BACKEND,
+        "backup_limit_mbps": "0",
+        "backup_idle_priority": True,
+        "backup_pause_on_lag": True,
+        **mc_backup.RetentionPolicy().to_config(),
+        "console_scrollback": DEFAULT_CONSOLE_SCROLLBACK,
+        "console_queue_high_water": STDOUT_QUEUE_HIGH_WATER,
+        **LogRotation().to_config()
+    }
+
+
+def load_server_config(folder, defaults=None):
+    """读取服务器目录下的 manager_config.json，缺失的项使用默认值"""
+    data = dict(server_config_defaults() if defaults is None else defaults)
+    path = os.path.join(folder, SERVER_CONFIG_NAME)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+    return data
+
+
+def parse_memory_option(text):
+    """内存选项 "Xms2G, Xmx4G" -> ("2G", "4G")；无法解析时返回 None"""
+    m = _MEMORY_RE.search(text or "")
+    return (m.group(1), m.group(2)) if m else None
+
+
+def find_server_jar(folder):
+    """服务器目录中的 JAR：优先 server.jar，其次名称像服务端的 JAR，否则取第一个"""
+    if not folder: return None
+    try:
+        cands = [f for f in os.listdir(folder) if f.lower().endswith('.jar')]
+    except OSError: return None
+    if not cands: return None
+
+    for c in cands:
+        if c.lower() == DEFAULT_SERVER_JAR: return os.path.join(folder, c)
+
+    for c in cands:
+        if 'server' in c.lower() or 'minecraft' in c.lower() or 'paper' in c.lower():
+            return os.path.join(folder, c)
+
+    return os.path.join(folder, cands[0])
+
+
+def read_level_name(server_dir):
+    """server.properties 中的世界名 (level-name)，默认 world"""
+    level_name = "world" # 默认值
+    p_path = os.path.join(server_dir, "server.properties")
+    if os.path.exists(p_path):
+        try:
+            with open(p_path, 'r', encoding='utf-8', errors='ignore') as f:
+                for line in f:
+                    if line.strip().startswith("level-name="):
+                        val = line.strip().split("=", 1)[1].strip()
+                        if val: level_name = val
+                        break
+        except: pass
+    return level_name
+
+
+def resolve_backup_targets(src_dir):
+    """返回 (要备份的世界文件夹列表, 忽略规则)；未检测到世界文件夹时列表为 None，表示全量备份服务器目录"""
+    level_name = read_level_name(src_dir)
+    candidates = {level_name, f"{level_name}_nether", f"{level_name}_the_end", "world_nether", "world_the_end"}
+    found = sorted(t for t in candidates if os.path.isdir(os.path.join(src_dir, t)))
+    if found:
+        return found, ("session.lock",)
+    return None, ("*.jar", "backups", "logs", "servers", "session.lock", SERVER_LOCK_NAME, mc_backup.SNAPSHOT_DIR_NAME,
+                  *mc_backup.RESTORE_DIRS, mc_backup.DELETING_PREFIX + "*")
+
+
+# ------------------ 备份 / 清理 / 还原 ------------------
+# 以下函数不依赖界面：进度通过 log(text) 回调报告 (在调用线程中调用)，GUI 与守护进程共用。
+class BackupSettings:
+    """一次备份/清理所需的设置"""
+
+    def __init__(self, backup_root, mode=mc_backup.DEFAULT_BACKUP_MODE, codec=mc_backup.DEFAULT_ARCHIVE_CODEC,
+                 level=None, snapshot_backend=mc_backup.DEFAULT_SNAPSHOT_BACKEND, retention=None):
+        self.backup_root = backup_root
+        self.mode = mode if mode in mc_backup.BACKUP_MODES else mc_backup.DEFAULT_BACKUP_MODE
+        self.codec = codec
+        self.level = level or None
+        self.snapshot_backend = snapshot_backend
+        self.retention = retention or mc_backup.RetentionPolicy()
+
+    @classmethod
+    def from_config(cls, backup_root, data):
+        codec = data.get("archive_codec")
+        return cls(backup_root, data.get("backup_mode"),
+                   codec if codec in mc_backup.available_codecs() else mc_backup.DEFAULT_ARCHIVE_CODEC,
+                   data.get("archive_level"),
+                   data.get("snapshot_backend", mc_backup.DEFAULT_SNAPSHOT_BACKEND),
+                   mc_backup.RetentionPolicy.from_config(data))
+
+    def dest_dir(self, src_dir):
+        return os.path.join(self.backup_root, os.path.basename(os.path.normpath(src_dir)))
+
+
+def configure_throttle(throttle, data):
+    """按配置中的限速 / 低优先级设置节流器"""
+    try:
+        limit = max(0.0, float(data.get("backup_limit_mbps") or 0))
+    except (TypeError, ValueError):
+        limit = 0.0
+    throttle.configure(limit, bool(data.get("backup_idle_priority", True)))
+
+
+def flush_world(write, barrier, alive, log, tag):
+    """关闭自动保存并执行 save-all flush，等到控制台出现 "Saved the game" 再返回 (最长 SAVE_CONFIRM_TIMEOUT_S 秒)。
+    write(cmd) 向服务器控制台发送一条命令"""
+    token = barrier.arm()
+    t0 = time.monotonic()
+    write("save-off")
+    write("save-all flush")
+    if barrier.wait(token, SAVE_CONFIRM_TIMEOUT_S, alive=alive):
+        log(f"💾 [{tag}] 服务器已确认存档 ({time.monotonic() - t0:.1f} 秒)")
+        return True
+    if alive():
+        log(f"⚠️ [{tag}] {SAVE_CONFIRM_TIMEOUT_S} 秒内未收到存档确认，继续备份 (数据可能不完整)")
+    return False
+
+
+def run_backup(src_dir, note, settings, log, throttle=None, release=None):
+    """备份 src_dir 的世界，返回快照名 (失败时返回 None)。
+
+    throttle: 服务器运行时传入节流器；release: 世界数据可以再次写入时的回调 (例如发送 save-on)。
+    能做写时复制快照时，快照完成后立即调用 release，之后从快照备份；否则备份结束后调用。"""
+    cow = None
+    work_dest = None
+    try:
+        if not src_dir: return None
+        dest_dir = settings.dest_dir(src_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+
+        name = f"backup-{timestamp_str()}_{note}"
+        final_dest = os.path.join(dest_dir, name)
+        # 目录快照先写入临时目录，写完校验清单后再重命名，列表中不会出现不完整的备份
+        work_dest = mc_backup.partial_path(dest_dir, name)
+        for stale in mc_backup.clean_stale_partials(dest_dir):
+            log(f"🗑️ 清理中断残留的临时备份: {stale}")
+        targets, ignore = resolve_backup_targets(src_dir)
+
+        # 写时复制快照：只在 save-off 期间停留快照所需的时间
+        data_root = src_dir
+        if release and settings.snapshot_backend != mc_backup.SNAPSHOT_OFF:
+            t0 = time.monotonic()
+            cow = mc_backup.take_cow_snapshot(src_dir, targets, name, ignore)
+            if cow:
+                data_root = cow.root
+                release()
+                release = None
+                log(f"📸 写时复制快照完成 ({cow.describe()}，{time.monotonic() - t0:.2f} 秒)，后台继续备份...")
+            else:
+                log("   - 当前文件系统不支持写时复制快照，备份期间保持 save-off")
+
+        # 增量模式：未变化的文件硬链接到上一个快照；去重模式：写入数据块仓库并生成清单
+        # 区域差量模式：在增量的基础上，区域文件只保存相对上一个快照变化了的区块
+        mode = settings.mode
+        prev_snapshot = None
+        if mode in (mc_backup.MODE_INCREMENTAL, mc_backup.MODE_DELTA):
+            prev_snapshot = mc_backup.find_previous_snapshot(dest_dir, exclude=name)
+        delta = None
+        stored = None
+        if mode == mc_backup.MODE_DELTA and prev_snapshot:
+            delta = mc_backup.RegionDelta(os.path.basename(prev_snapshot))
+        stats = mc_backup.CopyStats("复用" if mode == mc_backup.MODE_DEDUP else "硬链接", throttle=throttle)
+
+        # 备份存在的世界文件夹 (targets 为 None 时备份整个服务器目录)
+        if mode == mc_backup.MODE_ARCHIVE:
+            out, size, _ = mc_backup.write_archive_snapshot(data_root, targets, dest_dir, name, ignore,
+                                                            settings.codec, settings.level, stats)
+            ratio = size / stats.copied_bytes * 100 if stats.copied_bytes else 100
+            log(f"   - 归档文件: {os.path.basename(out)} ({size / 1024 / 1024:.1f} MB，压缩率 {ratio:.0f}%)")
+            snapshot_name, stored = os.path.basename(out), size
+        elif mode == mc_backup.MODE_DEDUP:
+            mc_backup.write_dedup_snapshot(data_root, targets, dest_dir, name, ignore, stats)
+            snapshot_name = name + mc_backup.MANIFEST_SUFFIX
+        else:
+            sums = mc_backup.ChecksumRecorder(work_dest, prev_snapshot)
+            if targets is None:
+                mc_backup.copy_tree(data_root, work_dest, ignore_patterns=ignore, prev=prev_snapshot,
+                                    stats=stats, delta=delta, sums=sums)
+            else:
+                for t in targets:
+                    mc_backup.copy_tree(os.path.join(data_root, t), os.path.join(work_dest, t),
+                                        ignore_patterns=ignore,
+                                        prev=os.path.join(prev_snapshot, t) if prev_snapshot else None,
+                                        stats=stats, delta=delta, sums=sums)
+            if delta: delta.write_meta(work_dest)
+            sums.save()
+            mc_backup.commit_snapshot(work_dest, final_dest)
+            snapshot_name = name
+        mc_backup.backup_index(dest_dir).add(snapshot_name)
+        mc_backup.record_snapshot(dest_dir, snapshot_name, targets, stats, stored)
+
+        if targets is None:
+            log("⚠️ 未检测到标准世界结构，已执行全量文件备份")
+            log(f"✅ 全量备份完成: {name}")
+        else:
+            for target in targets:
+                log(f"   - 已备份世界目录: {target}")
+            log(f"✅ 备份完成: {name} (共 {len(targets)} 个世界文件夹)")
+        log(f"   - {stats.summary()}")
+        return snapshot_name
+
+    except Exception as e:
+        log(f"❌ 备份失败: {e}")
+        if work_dest: shutil.rmtree(work_dest, ignore_errors=True)
+        return None
+    finally:
+        if release: release()
+        if cow and not cow.discard():
+            log(f"⚠️ 快照清理不完整，请手动删除: {cow.root}")
+
+
+def prune_backups(src_dir, settings, log, tag="备份清理"):
+    """按 GFS 保留策略清理旧备份。快照列表来自缓存的索引 (按名称中的时间排序，不逐个 stat)，
+    删除在后台线程池中进行，不会拖住下一次备份"""
+    if not src_dir: return
+    folder = settings.dest_dir(src_dir)
+    if not os.path.isdir(folder): return
+
+    index = mc_backup.backup_index(folder)
+    snapshots = index.snapshots()
+    keep = settings.retention.select(snapshots)
+    doomed = [os.path.join(folder, i.name) for i in snapshots if i.name not in keep]
+    if not doomed: return
+
+    protected = mc_backup.protected_snapshots(folder, doomed, names=[i.name for i in snapshots], bases=index.bases)
+    names = []
+    for p in doomed:
+        if p in protected:
+            log(f"📌 [{tag}] 暂时保留 {os.path.basename(p)} (被区域差量快照引用)")
+        else:
+            names.append(os.path.basename(p))
+
+    def on_done(name, err):
+        if err: log(f"❌ [{tag}] 清理失败 {name}: {err}")
+        else: log(f"🗑️ [{tag}] 清理旧备份: {name}")
+
+    def on_gc(result):
+        if isinstance(result, Exception): log(f"❌ [去重仓库] 回收数据块失败: {result}")
+        elif result: log(f"🧹 [去重仓库] 回收 {result} 个无引用数据块")
+
+    mc_backup.delete_snapshots_async(folder, names, on_done=on_done, on_gc=on_gc)
+
+
+def list_backups(backup_root, server_name):
+    """服务器的全部备份 (从新到旧)：名称解析自缓存的目录索引，大小/文件数/校验状态来自备份目录 (catalog)"""
+    folder = os.path.join(backup_root, server_name)
+    if not server_name or not os.path.isdir(folder): return []
+    catalog = mc_backup.backup_catalog(folder).entries()
+    out = []
+    for info in mc_backup.backup_index(folder).snapshots():
+        meta = catalog.get(info.name) or {}
+        out.append({"name": info.name, "kind": info.kind, "note": info.note, "time": info.time.isoformat(),
+                    "path": os.path.join(folder, info.name), "bytes": meta.get("bytes"),
+                    "files": meta.get("files"), "worlds": meta.get("worlds"), "verified": meta.get("verified")})
+    return out
+
+
+def restore_backup(server_path, backup_path, label, log, throttle=None, stop_server=None):
+    """先把备份暂存到服务器目录下 (服务器可继续运行)，再停服、重命名换入。
+
+    stop_server(): 服务器在运行时停止它并等到进程退出，返回 True；未运行返回 False。
+    返回是否停止过服务器 (调用方据此重新启动)；失败时记录日志并抛出异常，现有世界不变。"""
+    stopped = False
+    log(f"🔁 [还原] 开始将服务器 {os.path.basename(server_path)} 还原到 {label}...")
+    try:
+        if mc_backup.recover_interrupted_restore(server_path):
+            log("⚠️ [还原] 检测到上次中断的还原，已恢复到还原前的世界")
+        # 1. 暂存：服务器运行时按备份限速/低优先级进行
+        log("📥 [还原] 正在暂存备份数据...")
+        stats = mc_backup.CopyStats(throttle=throttle)
+        exclude = ("logs", "backups", "servers", SERVER_LOCK_NAME, os.path.basename(server_path), *mc_backup.RESTORE_DIRS)
+        items = mc_backup.stage_restore(backup_path, server_path, exclude, stats)
+        if not items:
+            raise RuntimeError("备份中没有可还原的内容")
+        log(f"   - 暂存完成: {', '.join(items)} ({stats.summary()})")
+
+        # 2. 停服：换入只需要重命名，停机时间就是停服 + 重启
+        if stop_server:
+            stopped = stop_server()
+
+        # 3. 换入
+        t0 = time.monotonic()
+        mc_backup.swap_in_restore(server_path, items, label)
+        log(f"🔀 [还原] 世界已切换 ({(time.monotonic() - t0) * 1000:.0f} 毫秒)，旧世界保留为撤销点")
+        log("✅ [还原] 世界还原成功" + ("，正在重新启动服务器..." if stopped else "！请重新启动服务器。"))
+        return stopped
+    except Exception as e:
+        shutil.rmtree(os.path.join(server_path, mc_backup.RESTORE_STAGE_DIR), ignore_errors=True)
+        log(f"❌ [还原] 还原失败: {e}" + (" (服务器已停止，世界未改动)" if stopped else ""))
+        raise
+
+
+# ------------------ 部署 ------------------
+def _download(url, dest, log=None, params=None):
+    with requests.get(url, params=params, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        dl = 0
+        with open(dest, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=8192):
+                f.write(chunk)
+                dl += len(chunk)
+                if log and dl % (5 * 1024 * 1024) < 8192:
+                    log(f"   已下载: {dl/1024/1024:.1f} MB ...")
+
+
+def deploy_paper(folder, version, log, download_java=False, online_mode=True):
+    """在 folder 中部署 Paper 服务器 (下载 JAR、可选下载 Java、写入 eula 与 server.properties)；
+    返回下载的 java 路径 (未下载时为 None)，失败时抛出异常"""
+    if requests is None:
+        raise RuntimeError("部署需要 requests 库: pip install requests")
+    log(f"🚀 开始在 {folder} 部署 Paper {version}...")
+    os.makedirs(folder, exist_ok=True)
+    java_path = None
+
+    # A. 下载 Java
+    if download_java:
+        req_ver = get_required_java_version(version)
+        log(f"⬇️ 正在查找 Java {req_ver} 下载链接...")
+        url = get_adoptium_download_url(req_ver)
+        if url:
+            log(f"⬇️ 开始下载 Java: {url}")
+            zip_path = os.path.join(folder, "java_temp.zip")
+            try:
+                _download(url, zip_path, log)
+                log("📦 解压 Java 中...")
+                extract_dir = os.path.join(folder, f"java{req_ver}")
+                os.makedirs(extract_dir, exist_ok=True)
+                with zipfile.ZipFile(zip_path, 'r') as z:
+                    z.extractall(extract_dir)
+                os.remove(zip_path)
+                for root, dirs, files in os.walk(extract_dir):
+                    if "java.exe" in files:
+                        java_path = os.path.join(root, "java.exe")
+                        break
+                if java_path:
+                    log(f"✅ Java 安装成功: {java_path}")
+                else:
+                    log("⚠️ 解压后未找到 java.exe")
+            except Exception as e:
+                log(f"❌ Java 下载/安装失败: {e}")
+        else:
+            log("❌ 无法获取 Java 下载地址。")
+
+    # B. 下载 Server Jar
+    log(f"⬇️ 正在获取 Paper {version} 最新构建...")
+    try:
+        resp = requests.get(f"https://api.papermc.io/v2/projects/paper/versions/{version}", timeout=10)
+        if resp.status_code == 404:
+            raise Exception(f"版本 {version} 在 PaperMC 中不存在！请检查是否输入了基岩版版本号？")
+        resp.raise_for_status() # 检查其他网络错误
+        bd = resp.json()
+        if "builds" not in bd:
+            raise Exception(f"API 返回数据异常，未找到构建列表。返回内容: {bd}")
+
+        latest = bd["builds"][-1]
+        jar_url = f"https://api.papermc.io/v2/projects/paper/versions/{version}/builds/{latest}/downloads/paper-{version}-{latest}.jar"
+        log(f"⬇️ 下载 Server JAR ({latest})...")
+        _download(jar_url, os.path.join(folder, DEFAULT_SERVER_JAR))
+        log("✅ Server JAR 下载完成。")
+    except Exception as e:
+        log(f"❌ Server JAR 下载失败: {e}")
+        raise
+
+    # C. 写入文件
+    log("📝 生成配置文件...")
+    with open(os.path.join(folder, "eula.txt"), "w") as f:
+        f.write("eula=true\n")
+    with open(os.path.join(folder, "server.properties"), "w") as f:
+        f.write(f"online-mode={'true' if online_mode else 'false'}\n")
+        f.write("max-players=20\n")
+        f.write("pvp=true\n")
+        f.write("server-port=25565\n")
+        f.write("motd=A Minecraft Server\n")
+
+    # 始终创建 start.bat，方便用户手动启动
+    with open(os.path.join(folder, "start.bat"), "w") as f:
+        f.write("@echo off\n")
+        f.write(f'"{java_path or "java"}" -Xms2G -Xmx2G -jar server.jar nogui\n')
+        f.write("pause\n")
+
+    log("🎉 部署完成！")
+    return java_path
+
+
+# ------------------ 跨进程占用锁 ------------------
+class ServerLock:
+    """服务器目录下 .manager.lock 上的文件锁：同一服务器同时只能由一个管理器进程 (界面或守护进程)
+    运行服务器、周期备份或还原。进程内可重入，最后一个使用者释放时解锁；进程退出时由系统自动解锁"""
+
+    def __init__(self, server_dir):
+        self.path = os.path.join(server_dir, SERVER_LOCK_NAME)
+        self._fd = None
+        self._users = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if not self._users:
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                try:
+                    if fcntl: fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    else: msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                except OSError:
+                    os.close(fd)
+                    raise RuntimeError("服务器正由另一个管理器进程 (界面或守护进程) 使用") from None
+                self._fd = fd
+            self._users += 1
+
+    def release(self):
+        with self._lock:
+            if not self._users: return
+            self._users -= 1
+            if self._users: return
+            fd, self._fd = self._fd, None
+            try:
+                if fcntl: fcntl.flock(fd, fcntl.LOCK_UN)
+                else: msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            except OSError:
+                pass
+            os.close(fd)
+
+
+# ------------------ 无界面服务器核心 ------------------
+class ServerEngine:
+    """一个服务器的无界面运行核心：进程控制、控制台管道、存档确认、周期备份与还原。
+
+    状态变化通过 subscribe(callback) 通知，callback(kind, data) 在工作线程中调用：
+    ("console", [行...]) 控制台输出，("log", 文本) 管理器日志，("state", 状态) 运行状态，
+    ("backup", 快照名或 None) 备份/清理完成。
+
+    console_queue: 界面模式下传入 LineBatchQueue，读取线程只把未解码的行放进队列，
+    由界面线程按帧预算取出后调用 publish()；不传时读取线程直接 publish()。
+    从启动到进程退出 (以及备份/还原期间) 持有 ServerLock，界面与守护进程不会同时拉起同一个服务器。"""
+
+    STOPPED = "stopped"
+    STARTING = "starting"
+    RUNNING = "running"
+    STOPPING = "stopping"
+
+    def __init__(self, server_dir, backup_root=BACKUP_DIR, console_queue=None):
+        self.server_dir = os.path.abspath(server_dir)
+        self.name = os.path.basename(self.server_dir)
+        self.backup_root = backup_root
+        self.console_queue = console_queue
+        self.config = load_server_config(self.server_dir)
+        self.state = self.STOPPED
+        self.process = None
+        self.jar = None  # 最近一次启动使用的 JAR (还原后按它重启)
+        self.server_lock = ServerLock(self.server_dir)
+        self.log_writer = None  # 本次运行的控制台日志
+        self.job = None  # 正在进行的备份/还原
+        self.console = collections.deque(maxlen=DEFAULT_CONSOLE_SCROLLBACK)  # 新连接的客户端先收到最近的输出
+        self.logs = collections.deque(maxlen=ENGINE_LOG_BACKLOG)
+        self.roster = PlayerRoster()
+        self.save_barrier = mc_backup.SaveBarrier()
+        self.throttle = mc_backup.Throttle()
+        self._listeners = []
+        self._state_lock = threading.Lock()
+        self._stdin_lock = threading.Lock()
+        self._console_lock = threading.Lock()  # 串行化 publish：分类器、名册与控制台缓冲不是线程安全的
+        self._logs_lock = threading.Lock()
+        self._job_lock = threading.Lock()
+        self._exited = threading.Event()
+        self._exited.set()
+        self._cancel_start = False  # 启动前备份期间收到 stop 时不再拉起进程
+        self._hold_stopped = False  # 选择性还原/撤销还原期间不允许启动
+        self._stop_periodic = threading.Event()
+
+        c = self.classifier = LineClassifier()
+        c.subscribe(EVENT_STARTUP_DONE, self._on_startup_done)
+        c.subscribe(EVENT_SAVED, self.save_barrier.notify)
+        c.subscribe(EVENT_LAG, self._on_lag)
+        c.subscribe(EVENT_TPS, self._on_lag)
+        c.subscribe(EVENT_JOIN, lambda ev: self.roster.join(ev.data["player"]))
+        c.subscribe(EVENT_LEAVE, lambda ev: self.roster.leave(ev.data["player"]))
+        c.subscribe(EVENT_LIST, lambda ev: self.roster.replace(ev.data["players"]))
+
+    # --- 事件 ---
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def subscribe_with_backlog(self, callback):
+        """订阅事件并返回此刻最近的控制台输出；与 publish 在同一把锁内，衔接处既不丢行也不重复"""
+        with self._console_lock:
+            self.subscribe(callback)
+            return list(self.console)
+
+    def unsubscribe(self, callback):
+        try: self._listeners.remove(callback)
+        except ValueError: pass
+
+    def _emit(self, kind, data):
+        for cb in list(self._listeners):
+            try:
+                cb(kind, data)
+            except Exception:
+                pass
+
+    def log(self, text):
+        line = datetime.datetime.now().strftime("[%H:%M:%S] ") + text
+        with self._logs_lock:
+            self.logs.append(line)
+        self._emit("log", line)
+
+    def recent_logs(self):
+        with self._logs_lock:
+            return list(self.logs)
+
+    def _set_state(self, state):
+        self.state = state
+        self._emit("state", state)
+
+    def _on_startup_done(self, event):
+        if self.state == self.STARTING:
+            self.roster.clear()
+            self._set_state(self.RUNNING)
+
+    def _on_lag(self, ev):
+        """"Can't keep up" 或 tps 偏低时暂停正在进行的备份 I/O"""
+        if not self.config.get("backup_pause_on_lag", True): return
+        if ev.kind == EVENT_TPS and ev.data["tps"][0] >= BACKUP_LOW_TPS: return
+        self.throttle.hold(BACKUP_LAG_PAUSE_S)
+
+    def reload_config(self):
+        """重新读取 manager_config.json (界面保存设置后调用)，限速/低优先级立即生效"""
+        self.config = load_server_config(self.server_dir)
+        configure_throttle(self.throttle, self.config)
+
+    def status(self):
+        proc = self.process
+        with self._console_lock:
+            players = list(self.roster.names)
+        return {"name": self.name, "path": self.server_dir, "state": self.state,
+                "pid": proc.pid if proc and proc.poll() is None else None,
+                "players": players, "job": self.job}
+
+    # --- 进程控制 ---
+    def start(self, jar=None):
+        """启动服务器 (jar 默认自动查找)；启动前备份与拉起进程在后台线程中进行"""
+        with self._state_lock:
+            if self.state != self.STOPPED:
+                raise RuntimeError("服务器正在运行或启动中")
+            if self._hold_stopped:
+                raise RuntimeError(f"正在进行 {self.job}，完成后才能启动")
+            jar = jar or find_server_jar(self.server_dir)
+            if not jar:
+                raise RuntimeError(f"在 {self.server_dir} 中找不到服务器 JAR")
+            self.server_lock.acquire()
+            self.jar = jar
+            self.config = load_server_config(self.server_dir)
+            self._cancel_start = False
+            self._exited.clear()
+            self._set_state(self.STARTING)
+        threading.Thread(target=self._start_worker, args=(jar,), name=f"start-{self.name}", daemon=True).start()
+
+    def _start_worker(self, jar):
+        cfg = self.config
+        configure_throttle(self.throttle, cfg)
+        if cfg.get("startup_backup"):
+            with self._job_lock:
+                self.job = "startup-backup"
+                settings = BackupSettings.from_config(self.backup_root, cfg)
+                prune_backups(self.server_dir, settings, self.log, "启动前备份")
+                self.log(f"🔄 [启动备份] 正在备份 {self.server_dir}...")
+                name = run_backup(self.server_dir, "startup", settings, self.log)
+                self.job = None
+            self._emit("backup", name)
+
+        xms, xmx = parse_memory_option(cfg.get("memory")) or (DEFAULT_XMS, DEFAULT_XMX)
+        ensure_dirs()
+        try:
+            writer = BufferedLogWriter(console_log_path(self.name),
+                                       name=f"console-log-{self.name}", rotation=LogRotation.from_config(cfg))
+        except OSError:
+            writer = None
+        cmd = ['java', f'-Xmx{xmx}', f'-Xms{xms}', *SERVER_JVM_ENCODING_ARGS, '-jar', jar, 'nogui']
+        with self._state_lock:
+            proc = None
+            if self._cancel_start:
+                self.log("🛑 启动已取消")
+            else:
+                try:
+                    proc = subprocess.Popen(cmd, cwd=self.server_dir, stdin=subprocess.PIPE,
+                                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                except Exception as e:
+                    self.log(f"❌ 启动异常: {e}")
+            if not proc:
+                if writer: writer.close()
+                self.server_lock.release()
+                self._set_state(self.STOPPED)
+                self._exited.set()
+                return
+            self.process = proc
+            self.log_writer = writer
+        self.log(f"🚀 启动命令: {' '.join(cmd)}")
+        self.log(f"📂 工作目录: {self.server_dir}")
+
+        reader = threading.Thread(target=self._read_console, args=(proc, writer), name=f"console-{self.name}", daemon=True)
+        reader.start()
+        threading.Thread(target=self._monitor, args=(proc, reader, writer), daemon=True).start()
+        if cfg.get("periodic_backup_enabled"):
+            self._stop_periodic.clear()
+            threading.Thread(target=self._periodic_backup_loop, name=f"periodic-{self.name}", daemon=True).start()
+
+    def publish(self, lines):
+        """解码一批控制台行 (bytes 与 str 混合)，分类并推送；返回解码后的行。
+
+        读取线程、命令回显与进程监视线程都可能调用，整批在锁内处理，事件按输出顺序分发"""
+        lines = decode_console_batch(lines)
+        with self._console_lock:
+            self.classifier.feed(lines)
+            self.roster.take_ops()  # 引擎名册不做增量刷新，丢弃操作日志
+            self.console.extend(lines)
+            self._emit("console", lines)
+        return lines
+
+    def pump_console(self, max_lines, deadline, clock=time.perf_counter):
+        """界面模式：从 console_queue 按批 (每批最多 512 行) 取出并 publish，直到队列取空、
+        累计 max_lines 行或 clock() 超过 deadline；返回 (解码后的行, 取出的行数)"""
+        out = []
+        taken = 0
+        while taken < max_lines and clock() < deadline:
+            batch = self.console_queue.drain(min(512, max_lines - taken))
+            if not batch: break
+            taken += len(batch)
+            out.extend(self.publish(batch))
+        return out, taken
+
+    def _console_out(self, lines):
+        """界面模式下放进界面的批量队列 (积压时可丢弃非状态行)，否则直接推送"""
+        if self.console_queue is not None:
+            self.console_queue.put_lines(lines)
+        else:
+            self.publish(lines)
+
+    def _read_console(self, proc, writer):
+        """按大块读取原始字节，整块切分行；原始字节直接写盘，界面积压/丢弃不影响日志完整性"""
+        fd = proc.stdout.fileno()
+        tail = b''
+        while True:
+            try:
+                chunk = os.read(fd, READ_CHUNK_BYTES)
+            except OSError:
+                break
+            if not chunk: break
+            data = tail + chunk if tail else chunk
+            cut = data.rfind(b'\n') + 1
+            if not cut and len(data) < READ_CHUNK_BYTES:
+                tail = data
+                continue
+            if not cut: cut = len(data)
+            complete, tail = data[:cut], data[cut:]
+            if writer: writer.write_bytes(complete)
+            if b'\r' in complete:
+                complete = complete.replace(b'\r\n', b'\n').replace(b'\r', b'')
+            lines = complete.split(b'\n')
+            if not lines[-1]: lines.pop()
+            self._console_out(lines)
+        if tail:
+            if writer: writer.write_bytes(tail + b'\n')
+            self._console_out([tail.rstrip()])
+        proc.stdout.close()
+
+    def _monitor(self, proc, reader, writer):
+        proc.wait()
+        reader.join(timeout=5)
+        if writer:
+            # 先摘下句柄，之后的命令回显等不会再写入已关闭的日志
+            self.log_writer = None
+            writer.write("🔴 服务器进程已退出。\n")
+            writer.close()
+        self._stop_periodic.set()
+        with self._console_lock:
+            self.roster.clear()
+        self.process = None
+        self._console_out(["🔴 服务器进程已退出。"])
+        self.server_lock.release()
+        self._set_state(self.STOPPED)
+        self._exited.set()
+
+    def command(self, text):
+        proc = self.process
+        if not proc or proc.poll() is not None:
+            raise RuntimeError("服务器未运行")
+        with self._stdin_lock:
+            proc.stdin.write((text.rstrip("\n") + "\n").encode(SERVER_CONSOLE_ENCODING))
+            proc.stdin.flush()
+        writer = self.log_writer
+        if writer:
+            try: writer.write(f"> {text}\n")
+            except ValueError: pass
+        self._console_out([f"> {text}"])
+
+    def _write_quiet(self, text):
+        try:
+            self.command(text)
+        except (RuntimeError, OSError) as e:
+            self.log(f"❌ 写入失败: {e}")
+
+    def stop(self):
+        with self._state_lock:
+            if self.state == self.STARTING and not self.process:
+                self._cancel_start = True
+                self._set_state(self.STOPPING)
+                return
+        if not self.process or self.process.poll() is not None:
+            raise RuntimeError("服务器未运行")
+        self._set_state(self.STOPPING)
+        self.command("stop")
+        self.log("🛑 发送 stop 指令...")
+
+    def wait_stopped(self, timeout=None):
+        """等待服务器进程退出并完成收尾；超时返回 False"""
+        return self._exited.wait(timeout)
+
+    # --- 备份 / 还原 ---
+    def _claim_job(self, job):
+        if not self._job_lock.acquire(blocking=False):
+            raise RuntimeError(f"已有任务正在进行: {self.job}")
+        try:
+            self.server_lock.acquire()
+        except BaseException:
+            self._job_lock.release()
+            raise
+        self.job = job
+
+    def _claim_stopped_job(self, job):
+        """认领只能在停服时进行的任务 (直接改写世界文件)；任务结束前 start() 拒绝启动"""
+        self._claim_job(job)
+        with self._state_lock:
+            if self.state == self.STOPPED:
+                self._hold_stopped = True
+                return
+        self._release_job()
+        raise RuntimeError("服务器正在运行或启动中，请先停止服务器")
+
+    def _release_job(self):
+        self._hold_stopped = False
+        self.job = None
+        self.server_lock.release()
+        self._job_lock.release()
+
+    def backup(self, note="manual", settings=None):
+        """在后台线程中备份 (settings 默认取自 manager_config.json)；已有备份/还原在进行时抛出 RuntimeError"""
+        if not re.fullmatch(r"\w+", note or ""):
+            raise ValueError("备注只能包含字母、数字和下划线")
+        self._claim_job(f"backup:{note}")
+
+        def worker():
+            try:
+                self._backup(note, settings)
+            finally:
+                self._release_job()
+        threading.Thread(target=worker, name=f"backup-{self.name}", daemon=True).start()
+
+    def _backup(self, note, settings=None):
+        tag = {"manual": "手动备份", "periodic": "周期备份"}.get(note, note)
+        settings = settings or BackupSettings.from_config(self.backup_root, self.config)
+        running = self.state == self.RUNNING
+        release = None
+        if running:
+            self.log(f"⏳ [{tag}] 正在准备世界保存(save-off/save-all flush)...")
+            flush_world(self._write_quiet, self.save_barrier, lambda: self.state == self.RUNNING, self.log, tag)
+            release = lambda: self._resume_autosave(tag)
+        name = run_backup(self.server_dir, note, settings, self.log, throttle=self.throttle if running else None,
+                          release=release)
+        prune_backups(self.server_dir, settings, self.log)
+        self._emit("backup", name)
+
+    def _resume_autosave(self, tag):
+        if self.state == self.RUNNING:
+            self._write_quiet("save-on")
+            self.log(f"✅ [{tag}] 服务器自动保存已恢复(save-on)")
+
+    def _periodic_backup_loop(self):
+        try:
+            iv = max(1, int(self.config.get("periodic_interval") or 10))
+        except (TypeError, ValueError):
+            iv = 10
+        self.log(f"⏱️ 周期备份启动，间隔 {iv} 分钟")
+        while not self._stop_periodic.wait(iv * 60):
+            if self.state != self.RUNNING: continue
+            try:
+                self._claim_job("backup:periodic")
+            except RuntimeError:
+                self.log("⏭️ [周期备份] 上一个任务尚未结束，跳过本次备份")
+                continue
+            try:
+                self._backup("periodic")
+            finally:
+                self._release_job()
+
+    def list_backups(self):
+        return list_backups(self.backup_root, self.name)
+
+    def _backup_path(self, backup_name):
+        path = os.path.join(self.backup_root, self.name, backup_name)
+        if not mc_backup.parse_snapshot_name(backup_name) or not os.path.exists(path):
+            raise ValueError(f"找不到备份: {backup_name}")
+        return path
+
+    def restore(self, backup_name):
+        """在后台线程中整体还原 backup_name；服务器运行时暂存完成后短暂停服切换，无论切换成败都自动重启"""
+        path = self._backup_path(backup_name)
+        self._claim_job(f"restore:{backup_name}")
+
+        def worker():
+            try:
+                self._restore(path, backup_name)
+            except Exception:
+                pass  # 已记录在日志中
+        threading.Thread(target=worker, name=f"restore-{self.name}", daemon=True).start()
+
+    def restore_path(self, path, label):
+        """在调用者线程中整体还原备份路径 path (界面的还原线程使用)；返回是否停服并重启，失败时抛出异常"""
+        self._claim_job(f"restore:{label}")
+        return self._restore(path, label)
+
+    def _restore(self, path, label):
+        """已持有任务锁；还原成功或失败，只要为此停过服就在释放任务后重新启动"""
+        running = self.state == self.RUNNING
+        stopped = []
+
+        def stop_server():
+            stopped.append(self._stop_for_restore())
+            return stopped[-1]
+
+        try:
+            restore_backup(self.server_dir, path, label, self.log,
+                           throttle=self.throttle if running else None, stop_server=stop_server)
+        except Exception:
+            if any(stopped): self.log("🔄 [还原] 以原有世界重新启动服务器...")
+            raise
+        finally:
+            self._release_job()
+            if any(stopped):
+                try:
+                    self.start(self.jar)
+                except (RuntimeError, OSError) as e:
+                    self.log(f"❌ 重新启动失败: {e}")
+        return any(stopped)
+
+    def restore_selected(self, backup_name, selection):
+        """在后台线程中把 backup_name 里被 selection (mc_backup.RestoreSelection) 选中的文件写回；服务器必须已停止"""
+        path = self._backup_path(backup_name)
+        self._claim_stopped_job(f"restore-selected:{backup_name}")
+
+        def worker():
+            try:
+                self._restore_selected(path, backup_name, selection)
+            except Exception:
+                pass  # 已记录在日志中
+            finally:
+                self._release_job()
+        threading.Thread(target=worker, name=f"restore-selected-{self.name}", daemon=True).start()
+
+    def restore_selected_path(self, path, label, selection):
+        """在调用者线程中选择性还原备份路径 path (界面的还原线程使用)；返回 (还原的 rel 列表, 删除的 rel 列表)"""
+        self._claim_stopped_job(f"restore-selected:{label}")
+        try:
+            return self._restore_selected(path, label, selection)
+        finally:
+            self._release_job()
+
+    def _restore_selected(self, path, label, selection):
+        self.log(f"🔁 [选择性还原] 从 {label} 还原 {selection.label}...")
+        stats = mc_backup.CopyStats()
+        try:
+            restored, removed = mc_backup.restore_selected(path, self.server_dir, selection, stats)
+        except Exception as e:
+            self.log(f"❌ [选择性还原] 还原失败: {e}")
+            raise
+        for rel in removed:
+            self.log(f"🗑️ [选择性还原] 删除备份之后新生成的文件: {rel}")
+        if restored or removed:
+            self.log(f"✅ [选择性还原] 完成: 还原 {len(restored)} 个文件，删除 {len(removed)} 个文件 ({stats.summary()})")
+        else:
+            self.log("⚠️ [选择性还原] 备份中没有匹配的文件，未做任何修改")
+        return restored, removed
+
+    def undo_point(self):
+        """上一次整体还原留下的撤销点元数据；没有时返回 None"""
+        return mc_backup.read_undo_point(self.server_dir)
+
+    def undo_restore(self):
+        """在调用者线程中撤销上一次整体还原 (服务器必须已停止，只是几次重命名)；返回撤销点元数据"""
+        self._claim_stopped_job("undo-restore")
+        try:
+            meta = mc_backup.undo_restore(self.server_dir)
+        except Exception as e:
+            self.log(f"❌ [还原] 撤销失败: {e}")
+            raise
+        finally:
+            self._release_job()
+        self.log(f"↩️ [还原] 已撤销 {meta['time']} 的还原 ({meta['label']})，世界已换回")
+        return meta
+
+    def _stop_for_restore(self):
+        if self.state not in (self.STARTING, self.RUNNING) or not self.process:
+            return False
+        self.log("🛑 [还原] 停止服务器以切换世界...")
+        self.stop()
+        if not self.wait_stopped(RESTORE_STOP_TIMEOUT_S):
+            raise RuntimeError(f"服务器 {RESTORE_STOP_TIMEOUT_S} 秒内未停止，已放弃切换")
+        return True
@@ -0,0 +1,443 @@
+# mc_daemon.py
+"""
+无界面守护进程：在 asyncio 中托管 mc_core.ServerEngine，提供本地 HTTP / WebSocket API，
+供 web-ui 等客户端使用 (只依赖标准库)。
+
+    python mc_daemon.py [--host 127.0.0.1] [--port 8765] [--token 口令]
+
+REST (JSON)：
+    GET  /api/servers                        服务器列表及状态
+    GET  /api/servers/<名称>                 单个服务器状态
+    POST /api/servers/<名称>/start           启动
+    POST /api/servers/<名称>/stop            停止
+    POST /api/servers/<名称>/command         {"command": "say hi"}
+    POST /api/servers/<名称>/backup          {"note": "manual"}
+    POST /api/servers/<名称>/restore         {"backup": "backup-20240101-120000_manual"} 整体还原；
+                                             另带 "dimension": "overworld" | "nether" | "end" (可选 "box": [x1, z1, x2, z2])
+                                             或 "players": ["玩家名或 UUID", ...] 时为选择性还原 (服务器必须已停止)
+    GET  /api/servers/<名称>/backups         备份列表
+    GET  /api/servers/<名称>/undo            上一次整体还原的撤销点 ({"undo": 元数据或 null})
+    POST /api/servers/<名称>/undo            撤销上一次整体还原 (服务器必须已停止)
+WebSocket：
+    /api/servers/<名称>/console              先推送最近的输出，之后推送
+                                             {"type": "console" | "log", "lines": [...]} / {"type": "state", "state": ...} /
+                                             {"type": "backup", "name": 快照名或 null} (备份/清理完成)；
+                                             客户端发送的文本帧作为控制台命令执行
+
+请求需带 "Authorization: Bearer <口令>"；浏览器的 WebSocket 无法设置请求头，可改用 ?token=<口令>。
+未指定 --token 时启动时随机生成口令并打印；--token "" 关闭口令，此时只接受 Host 为本机的请求。
+带 Origin 头的请求 (含 WebSocket 握手) 必须来自 --cors-origin，POST 必须使用 Content-Type: application/json，
+以防其它网页跨站提交请求、劫持 WebSocket 或借 DNS 重绑定访问本地接口。
+"""
+
+import os
+import re
+import sys
+import hmac
+import secrets
+import json
+import base64
+import signal
+import struct
+import asyncio
+import hashlib
+import argparse
+import urllib.parse
+
+import mc_backup
+from mc_core import BACKUP_DIR, SERVERS_ROOT_DIR, ServerEngine, ensure_dirs, read_level_name
+
+# ------------------ 常量 ------------------
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CORS_ORIGIN = "http://localhost:3000"  # web-ui 开发服务器
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_MAX_FRAME = 64 * 1024
+WS_CLIENT_QUEUE = 2000          # 每个 WebSocket 客户端最多积压的消息数，超出后断开该客户端
+SHUTDOWN_STOP_TIMEOUT_S = 60    # 退出守护进程时等待服务器停止的最长时间
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+_ROUTE_RE = re.compile(r"^/api/servers(?:/(?P<name>[^/]+)(?:/(?P<action>[a-z]+))?)?/?$")
+
+HTTP_REASONS = {101: "Switching Protocols", 200: "OK", 202: "Accepted", 204: "No Content", 400: "Bad Request",
+                401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict",
+                413: "Payload Too Large", 415: "Unsupported Media Type", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------------ WebSocket 帧 ------------------
+WS_TEXT, WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+
+def ws_accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def ws_encode(opcode, payload=b""):
+    """服务器发出的帧不加掩码"""
+    n = len(payload)
+    if n < 126:
+        head = struct.pack("!BB", 0x80 | opcode, n)
+    elif n < 1 << 16:
+        head = struct.pack("!BBH", 0x80 | opcode, 126, n)
+    else:
+        head = struct.pack("!BBQ", 0x80 | opcode, 127, n)
+    return head + payload
+
+
+async def ws_read_frame(reader):
+    """读取一帧，返回 (opcode, 载荷)；不支持分片消息"""
+    b1, b2 = await reader.readexactly(2)
+    opcode, n = b1 & 0x0F, b2 & 0x7F
+    if not b1 & 0x80 or opcode == 0:
+        raise HttpError(400, "不支持分片的 WebSocket 消息")
+    if n == 126:
+        n = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif n == 127:
+        n = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if n > WS_MAX_FRAME:
+        raise HttpError(413, "WebSocket 消息过大")
+    mask = await reader.readexactly(4) if b2 & 0x80 else None
+    data = await reader.readexactly(n)
+    if mask:
+        data = bytes(b ^ mask[i & 3] for i, b in enumerate(data))
+    return opcode, data
+
+
+# ------------------ 守护进程 ------------------
+class Daemon:
+    def __init__(self, servers_root=SERVERS_ROOT_DIR, backup_root=BACKUP_DIR, token=None,
+                 cors_origin=DEFAULT_CORS_ORIGIN):
+        self.servers_root = os.path.abspath(servers_root)
+        self.backup_root = os.path.abspath(backup_root)
+        self.token = token
+        self.cors_origin = cors_origin
+        self.engines = {}
+
+    # --- 服务器 ---
+    def server_names(self):
+        try:
+            return sorted(n for n in os.listdir(self.servers_root)
+                          if not n.startswith(".") and os.path.isdir(os.path.join(self.servers_root, n)))
+        except OSError:
+            return []
+
+    def engine(self, name):
+        """按服务器文件夹名取得 (首次访问时创建) 引擎"""
+        eng = self.engines.get(name)
+        if eng: return eng
+        path = os.path.join(self.servers_root, name)
+        if name.startswith(".") or os.sep in name or "/" in name or not os.path.isdir(path):
+            raise HttpError(404, f"找不到服务器: {name}")
+        eng = self.engines[name] = ServerEngine(path, self.backup_root)
+        eng.subscribe(lambda kind, data, name=name: kind == "log" and print(f"[{name}] {data}", flush=True))
+        return eng
+
+    def status(self, name):
+        eng = self.engines.get(name)
+        return eng.status() if eng else {"name": name, "path": os.path.join(self.servers_root, name),
+                                         "state": ServerEngine.STOPPED, "pid": None, "players": [], "job": None}
+
+    async def shutdown(self):
+        """停止所有运行中的服务器"""
+        running = [e for e in self.engines.values() if e.state != ServerEngine.STOPPED]
+        for eng in running:
+            try:
+                eng.stop()
+            except RuntimeError:
+                pass
+        for eng in running:
+            if not await asyncio.to_thread(eng.wait_stopped, SHUTDOWN_STOP_TIMEOUT_S) and eng.process:
+                eng.log(f"⚠️ {SHUTDOWN_STOP_TIMEOUT_S} 秒内未停止，强制结束进程")
+                eng.process.kill()
+
+    # --- HTTP ---
+    def _check_origin(self, headers):
+        """拒绝来自其它网页的跨站请求 / WebSocket 握手，以及 (无口令时) 经 DNS 重绑定伪装成本机的请求"""
+        origin = headers.get("origin")
+        if origin is not None and origin != self.cors_origin:
+            raise HttpError(403, f"不允许的来源: {origin}")
+        if not self.token:
+            host = urllib.parse.urlsplit("//" + headers.get("host", "")).hostname
+            if host not in LOCAL_HOSTS:
+                raise HttpError(403, "未设置口令时只接受发往本机地址的请求")
+
+    def _authorized(self, headers, query):
+        if not self.token: return True
+        auth = headers.get("authorization", "")
+        given = auth[7:] if auth.lower().startswith("bearer ") else query.get("token", [""])[0]
+        return hmac.compare_digest(given.encode(), self.token.encode())
+
+    def _head(self, status, extra=()):
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+        if self.cors_origin:
+            lines += [f"Access-Control-Allow-Origin: {self.cors_origin}",
+                      "Access-Control-Allow-Headers: Authorization, Content-Type",
+                      "Access-Control-Allow-Methods: GET, POST, OPTIONS"]
+        lines += list(extra)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    async def _respond(self, writer, status, payload=None):
+        body = b"" if payload is None else json.dumps(payload, ensure_ascii=False).encode()
+        writer.write(self._head(status, ["Content-Type: application/json; charset=utf-8",
+                                         f"Content-Length: {len(body)}", "Connection: close"]) + body)
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                raw = await reader.readuntil(b"\r\n\r\n")
+            except asyncio.LimitOverrunError:
+                raise HttpError(413, "请求头过大")
+            request_line, *header_lines = raw.decode("latin-1").split("\r\n")
+            try:
+                method, target, _ = request_line.split(" ", 2)
+            except ValueError:
+                raise HttpError(400, "无效的请求行")
+            headers = {}
+            for line in header_lines:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+            url = urllib.parse.urlsplit(target)
+            query = urllib.parse.parse_qs(url.query)
+
+            self._check_origin(headers)
+            if method == "OPTIONS":
+                writer.write(self._head(204, ["Content-Length: 0", "Connection: close"]))
+                await writer.drain()
+                return
+            if not self._authorized(headers, query):
+                raise HttpError(401, "口令无效")
+            m = _ROUTE_RE.match(urllib.parse.unquote(url.path))
+            if not m:
+                raise HttpError(404, "未知的接口")
+            name, action = m.group("name"), m.group("action")
+
+            if action == "console" and headers.get("upgrade", "").lower() == "websocket":
+                await self._websocket(self.engine(name), headers, reader, writer)
+                return
+
+            if method == "POST" and headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+                raise HttpError(415, "POST 请求必须使用 Content-Type: application/json")
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY_BYTES:
+                raise HttpError(413, "请求体过大")
+            body = {}
+            if length:
+                try:
+                    body = json.loads(await reader.readexactly(length))
+                except ValueError:
+                    raise HttpError(400, "请求体不是有效的 JSON")
+                if not isinstance(body, dict):
+                    raise HttpError(400, "请求体必须是 JSON 对象")
+            status, payload = await self.dispatch(method, name, action, body)
+            await self._respond(writer, status, payload)
+        except HttpError as e:
+            await self._respond(writer, e.status, {"error": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            await self._respond(writer, 500, {"error": str(e)})
+        finally:
+            try:
+                writer.close()
+            except Exception:
+                pass
+
+    async def dispatch(self, method, name, action, body):
+        """返回 (状态码, JSON 数据)；引擎的 RuntimeError (状态冲突) 映射为 409，ValueError 映射为 400"""
+        if name is None:
+            if method != "GET": raise HttpError(405, "只支持 GET")
+            return 200, {"servers": [self.status(n) for n in self.server_names()]}
+        eng = self.engine(name)
+        if action is None:
+            if method != "GET": raise HttpError(405, "只支持 GET")
+            return 200, eng.status()
+        if action == "backups":
+            if method != "GET": raise HttpError(405, "只支持 GET")
+            return 200, {"backups": await asyncio.to_thread(eng.list_backups)}
+        if action == "undo" and method == "GET":
+            return 200, {"undo": await asyncio.to_thread(eng.undo_point)}
+
+        actions = {
+            "start": lambda: eng.start(),
+            "stop": lambda: eng.stop(),
+            "command": lambda: eng.command(self._field(body, "command")),
+            "backup": lambda: eng.backup(body.get("note") or "manual"),
+            "restore": lambda: self._restore(eng, body),
+            "undo": lambda: eng.undo_restore(),
+        }
+        if action not in actions:
+            raise HttpError(404, "未知的接口")
+        if method != "POST":
+            raise HttpError(405, "只支持 POST")
+        try:
+            result = await asyncio.to_thread(actions[action])
+        except RuntimeError as e:
+            raise HttpError(409, str(e))
+        except (ValueError, OSError) as e:
+            raise HttpError(400, str(e))
+        if action == "undo":
+            return 200, {"undo": result, **eng.status()}
+        return 202, eng.status()
+
+    def _restore(self, eng, body):
+        backup = self._field(body, "backup")
+        selection = self._selection(eng, body)
+        if selection is None:
+            eng.restore(backup)
+        else:
+            eng.restore_selected(backup, selection)
+
+    @staticmethod
+    def _selection(eng, body):
+        """请求体中的选择性还原范围；没有 "dimension" / "players" 时返回 None (整体还原)"""
+        players, dim = body.get("players"), body.get("dimension")
+        if players is None and dim is None: return None
+        level = read_level_name(eng.server_dir)
+        if players is not None:
+            if not isinstance(players, list) or not players or not all(isinstance(p, str) and p for p in players):
+                raise HttpError(400, "players 必须是非空的玩家名 / UUID 列表")
+            uuids, unknown = mc_backup.resolve_player_uuids(eng.server_dir, players)
+            if unknown:
+                raise HttpError(400, f"在 usercache.json 中找不到这些玩家，请改用 UUID: {', '.join(unknown)}")
+            return mc_backup.player_selection(level, uuids)
+        if dim not in mc_backup.DIMENSIONS:
+            raise HttpError(400, f"dimension 必须是 {' / '.join(mc_backup.DIMENSIONS)} 之一")
+        box = body.get("box")
+        if box is not None and (not isinstance(box, list) or len(box) != 4
+                                or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in box)):
+            raise HttpError(400, "box 必须是方块坐标 [x1, z1, x2, z2]")
+        return mc_backup.dimension_selection(level, dim, [int(v) for v in box] if box else None)
+
+    @staticmethod
+    def _field(body, key):
+        value = body.get(key)
+        if not isinstance(value, str) or not value.strip():
+            raise HttpError(400, f"缺少字段: {key}")
+        return value.strip()
+
+    # --- WebSocket 控制台 ---
+    async def _websocket(self, eng, headers, reader, writer):
+        key = headers.get("sec-websocket-key")
+        if not key:
+            raise HttpError(400, "缺少 Sec-WebSocket-Key")
+        writer.write(self._head(101, ["Upgrade: websocket", "Connection: Upgrade",
+                                      f"Sec-WebSocket-Accept: {ws_accept_key(key)}"]))
+        loop = asyncio.get_running_loop()
+        out = asyncio.Queue(WS_CLIENT_QUEUE)
+
+        def push(msg):
+            if out.full():  # 客户端跟不上：放入 None 让发送协程断开连接
+                while not out.empty(): out.get_nowait()
+                out.put_nowait(None)
+            else:
+                out.put_nowait(msg)
+
+        def on_event(kind, data):
+            if kind == "state": msg = {"type": "state", "state": data}
+            elif kind == "backup": msg = {"type": "backup", "name": data}
+            else: msg = {"type": kind, "lines": data if kind == "console" else [data]}
+            loop.call_soon_threadsafe(push, msg)
+
+        backlog = eng.subscribe_with_backlog(on_event)
+        for msg in ({"type": "state", "state": eng.state}, {"type": "log", "lines": eng.recent_logs()},
+                    {"type": "console", "lines": backlog}):
+            writer.write(ws_encode(WS_TEXT, json.dumps(msg, ensure_ascii=False).encode()))
+
+        async def sender():
+            while True:
+                msg = await out.get()
+                if msg is None:
+                    writer.write(ws_encode(WS_CLOSE, struct.pack("!H", 1008) + "消息积压过多".encode()))
+                    return
+                writer.write(ws_encode(WS_TEXT, json.dumps(msg, ensure_ascii=False).encode()))
+                await writer.drain()
+
+        send_task = asyncio.create_task(sender())
+        try:
+            while not send_task.done():
+                read = asyncio.create_task(ws_read_frame(reader))
+                await asyncio.wait({read, send_task}, return_when=asyncio.FIRST_COMPLETED)
+                if not read.done():
+                    read.cancel()
+                    break
+                opcode, data = read.result()
+                if opcode == WS_CLOSE:
+                    writer.write(ws_encode(WS_CLOSE, data[:2]))
+                    break
+                if opcode == WS_PING:
+                    writer.write(ws_encode(WS_PONG, data))
+                elif opcode == WS_TEXT:
+                    text = data.decode("utf-8", errors="replace")
+                    try:
+                        msg = json.loads(text)
+                        text = msg.get("command", "") if isinstance(msg, dict) else text
+                    except ValueError:
+                        pass
+                    if text.strip():
+                        try:
+                            await asyncio.to_thread(eng.command, text.strip())
+                        except (RuntimeError, OSError) as e:
+                            push({"type": "error", "message": str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError, HttpError):
+            pass
+        finally:
+            eng.unsubscribe(on_event)
+            send_task.cancel()
+            try:
+                await writer.drain()
+            except Exception:
+                pass
+
+
+async def serve(args):
+    ensure_dirs()
+    if args.token is None:
+        args.token = secrets.token_urlsafe(24)
+        print(f"🔑 本次访问口令: {args.token} (可用 --token 或环境变量 MC_DAEMON_TOKEN 指定)", flush=True)
+    daemon = Daemon(args.servers_root, args.backup_dir, args.token, args.cors_origin or None)
+    server = await asyncio.start_server(daemon.handle, args.host, args.port, limit=MAX_HEADER_BYTES)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows
+            pass
+    print(f"🌐 守护进程已启动: http://{args.host}:{args.port}/api/servers (服务器目录 {daemon.servers_root})", flush=True)
+    if not args.token and args.host not in LOCAL_HOSTS:
+        print("⚠️ 监听非本机地址但未设置 --token，任何人都可以控制服务器", flush=True)
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        print("🛑 正在停止运行中的服务器...", flush=True)
+        await daemon.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="mc_daemon.py", description="无界面运行服务器管理核心并提供本地 HTTP/WebSocket API")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--token", default=os.environ.get("MC_DAEMON_TOKEN"), help="访问口令 (也可通过环境变量 MC_DAEMON_TOKEN 设置)；不指定时随机生成，传空字符串关闭")
+    parser.add_argument("--servers-root", default=SERVERS_ROOT_DIR)
+    parser.add_argument("--backup-dir", default=BACKUP_DIR)
+    parser.add_argument("--cors-origin", default=DEFAULT_CORS_ORIGIN, help="允许跨域访问的来源，传空字符串关闭")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# mc_log_events.py
+"""
+控制台日志行分类引擎 (不依赖 GUI)
+
+每条规则 = 廉价的子串预筛 + 预编译正则；命中后产生类型化事件并分发给订阅者。
+规则按注册顺序匹配，第一条命中的规则生效 (例如聊天内容里出现 "joined the game" 不会被当成玩家加入)。
+"""
+
+import re
+
+# ------------------ 事件类型 ------------------
+EVENT_CHAT = "chat"
+EVENT_JOIN = "join"
+EVENT_LEAVE = "leave"
+EVENT_LIST = "list"
+EVENT_STARTUP_DONE = "startup_done"
+EVENT_TPS = "tps"
+EVENT_LAG = "lag"
+EVENT_SAVED = "saved"
+EVENT_WARN = "warn"
+EVENT_ERROR = "error"
+
+_ANSI_RE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def strip_ansi(line):
+    """去除 ANSI 颜色代码 (行内没有 ESC 时直接返回)"""
+    return _ANSI_RE.sub('', line) if '\x1b' in line else line
+
+
+class LogEvent:
+    __slots__ = ("kind", "data", "line")
+
+    def __init__(self, kind, data, line):
+        self.kind = kind
+        self.data = data
+        self.line = line
+
+    def __repr__(self):
+        return f"LogEvent({self.kind!r}, {self.data!r})"
+
+
+class LineRule:
+    """needles: 任一子串出现才会执行正则；parse(match) 返回事件数据 (返回 None 视为未命中)"""
+    __slots__ = ("kind", "needles", "pattern", "parse")
+
+    def __init__(self, kind, needles, pattern, parse=None):
+        self.kind = kind
+        self.needles = tuple(needles)
+        self.pattern = re.compile(pattern)
+        self.parse = parse or (lambda m: m.groupdict() or m.groups())
+
+
+def _parse_list(m):
+    names = m.group("names").strip()
+    return {"players": [n.strip() for n in names.split(",") if n.strip()] if names else []}
+
+def _parse_tps(m):
+    return {"tps": [float(m.group(i)) for i in (1, 2, 3)]}
+
+def _parse_lag(m):
+    return {"ms": int(m.group("ms")), "ticks": int(m.group("ticks"))}
+
+def _parse_done(m):
+    return {"seconds": float(m.group("sec").replace(",", "."))} if m.group("sec") else {"seconds": None}
+
+
+_LEVEL_RE = r"^(?:\[[^\]]*\]\s*)*?\[[^\]]*\b%s\]"  # 行首任意一个方括号组中的日志级别
+
+
+def default_rules():
+    """原版 / Paper 控制台的常用事件规则 (顺序即优先级)"""
+    return [
+        # 聊天 "<Steve> hello" 放在最前，避免聊天内容误触发其它规则
+        LineRule(EVENT_CHAT, ("<",), r"\]:\s*<(?P<player>[^>\s]+)>\s(?P<message>.*)$"),
+        LineRule(EVENT_JOIN, ("joined the game",), r"\b(?P<player>\w+)\s+joined the game"),
+        LineRule(EVENT_LEAVE, ("left the game",), r"\b(?P<player>\w+)\s+left the game"),
+        LineRule(EVENT_LIST, ("players online:",), r"players online:\s*(?P<names>.*)$", _parse_list),
+        LineRule(EVENT_STARTUP_DONE, ("Done",), r"\bDone\s*\((?:(?P<sec>[\d.,]+)s\))?", _parse_done),
+        LineRule(EVENT_SAVED, ("Saved the game",), r"Saved the game", lambda m: {}),
+        LineRule(EVENT_TPS, ("TPS from last",),
+                 r"TPS from last 1m, 5m, 15m:\s*\*?([\d.]+),\s*\*?([\d.]+),\s*\*?([\d.]+)", _parse_tps),
+        LineRule(EVENT_LAG, ("Can't keep up",), r"Running (?P<ms>\d+)ms or (?P<ticks>\d+) ticks behind", _parse_lag),
+        # 级别可能在第一个方括号 (Paper: "[12:00:00 WARN]:") 或后面的方括号 (原版: "[12:00:00] [Server thread/WARN]:")
+        LineRule(EVENT_WARN, ("WARN",), _LEVEL_RE % "WARN", lambda m: {}),
+        LineRule(EVENT_ERROR, ("ERROR", "SEVERE"), _LEVEL_RE % "(?:ERROR|SEVERE)", lambda m: {}),
+    ]
+
+
+class LineClassifier:
+    """可插拔的日志行分类器：register() 增加规则，subscribe() 订阅某类事件"""
+
+    def __init__(self, rules=None):
+        self.rules = list(default_rules() if rules is None else rules)
+        self.subscribers = {}
+        self.counts = {}
+
+    def register(self, rule, first=False):
+        if first: self.rules.insert(0, rule)
+        else: self.rules.append(rule)
+
+    def subscribe(self, kind, callback):
+        self.subscribers.setdefault(kind, []).append(callback)
+
+    def classify(self, line):
+        """返回该行对应的 LogEvent；没有规则命中时返回 None"""
+        clean = None
+        for rule in self.rules:
+            for needle in rule.needles:
+                if needle in line:
+                    break
+            else:
+                continue
+            if clean is None:
+                clean = strip_ansi(line)
+            m = rule.pattern.search(clean)
+            if not m: continue
+            data = rule.parse(m)
+            if data is None: continue
+            return LogEvent(rule.kind, data, clean)
+        return None
+
+    def feed(self, lines):
+        """分类一批日志行并分发事件；返回产生的事件数"""
+        subs = self.subscribers
+        counts = self.counts
+        n = 0
+        for line in lines:
+            ev = self.classify(line)
+            if ev is None: continue
+            n += 1
+            counts[ev.kind] = counts.get(ev.kind, 0) + 1
+            for cb in subs.get(ev.kind, ()):
+                cb(ev)
+        return n
@@ -2,22 +2,28 @@
 import os
 import subprocess
 import threading
-import queue
 import time
 import shutil
 import re
 import datetime
-import zipfile
 import sys
 import webbrowser
 import json
+import argparse
 import customtkinter as ctk
 from tkinter import filedialog, messagebox
-
-# Try to import requests
-try:
-    import requests
-except ImportError:
+from mc_log_events import EVENT_JOIN, EVENT_LEAVE, EVENT_LIST
+import mc_backup
+import mc_core
+from mc_core import (BACKUP_DIR, DEFAULT_CONSOLE_SCROLLBACK, DEFAULT_XMS, DEFAULT_XMX, LOG_APP_DIR,
+                     LOG_INDEX_INTERVAL_S, SERVERS_ROOT_DIR, STDOUT_QUEUE_HIGH_WATER, BackupSettings,
+                     BufferedLogWriter, ConsoleLogIndex, ConsoleScrollback, LineBatchQueue, LogRotation,
+                     PlayerRoster, PlayerSessionStore, ServerEngine, deploy_paper, ensure_dirs, format_duration,
+                     get_paper_versions, is_state_line, list_backups, load_server_config, parse_memory_option,
+                     read_level_name, server_config_defaults, textbox_append, timestamp_str)
+
+# 部署与获取版本列表需要 requests (mc_core 中为可选依赖)
+if mc_core.requests is None:
     try:
         from tkinter import messagebox
         messagebox.showerror("缺少依赖", "请先安装 requests 库: pip install requests")
@@ -25,88 +31,19 @@ except ImportError:
         print("缺少 requests 库，请安装: pip install requests")
     sys.exit(1)
 
-# ------------------ 全局常量 ------------------
-DEFAULT_SERVER_JAR = "server.jar"
-READ_QUEUE_POLL_MS = 200
-STOP_WAIT_SECONDS = 12
-LOG_DIR = "logs"  # 总日志目录
-LOG_APP_DIR = os.path.join(LOG_DIR, "app")       # 程序日志目录
-LOG_SERVER_DIR = os.path.join(LOG_DIR, "server") # 服务器日志目录
-BACKUP_DIR = "backups"
-SERVERS_ROOT_DIR = "servers" 
-DEFAULT_XMS = "1G" 
-DEFAULT_XMX = "2G" 
+# ------------------ 界面常量 ------------------
 START_BUTTON_BLOCK_MS = 15000
+CONSOLE_FRAME_BUDGET_MS = 25        # 每次刷新控制台最多占用主线程的时间（毫秒）
+CONSOLE_MAX_LINES_PER_TICK = 5000   # 每次刷新最多处理的行数
+APP_LOG_SCROLLBACK = 2000           # 程序日志保留行数
+PLAYER_DURATION_REFRESH_MS = 60000  # 有玩家在线时刷新玩家列表中在线时长的间隔（毫秒）
+RESTORE_SCOPE_PLAYERS = "玩家数据"      # 选择性还原范围中代表 playerdata 的选项
 
 # 奶白色按钮配色 (UI Theme)
 MILKY_FG = "#F5F5DC"
 MILKY_HOVER = "#F0EBD8"
 MILKY_TEXT = "#111111"
 
-# ------------------ 工具函数 ------------------
-def ensure_dirs():
-    if not os.path.isdir(LOG_APP_DIR):
-        os.makedirs(LOG_APP_DIR, exist_ok=True)
-    if not os.path.isdir(LOG_SERVER_DIR):
-        os.makedirs(LOG_SERVER_DIR, exist_ok=True)
-        
-    if not os.path.isdir(BACKUP_DIR):
-        os.makedirs(BACKUP_DIR, exist_ok=True)
-    if not os.path.isdir(SERVERS_ROOT_DIR): 
-        os.makedirs(SERVERS_ROOT_DIR, exist_ok=True)
-
-def _timestamp_str():
-    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-
-def parse_memory_value(s):
-    if not s: return None
-    s = s.strip()
-    m = re.match(r'^(\d+)([gGmM])?$', s)
-    if not m: return None
-    num = m.group(1)
-    suf = m.group(2)
-    if not suf: return f"{num}M"
-    if suf.lower() == 'g': return f"{num}G"
-    return f"{num}M"
-
-def get_required_java_version(mc_version):
-    try:
-        parts = mc_version.split(".")
-        if mc_version.startswith("1.") and len(parts) > 1 and parts[1].isdigit():
-            major = int(parts[1])
-            minor = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 0
-        elif parts[0].isdigit():
-            major = int(parts[0])
-            minor = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
-        else:
-            return 8
-        return 21 if major >= 21 or (major == 20 and minor >= 5) else 17 if major >= 17 else 8
-    except Exception:
-        return 8
-
-def get_paper_versions():
-    try:
-        response = requests.get("https://api.papermc.io/v2/projects/paper", timeout=5)
-        response.raise_for_status()
-        data = response.json()
-        versions = data["versions"]
-        versions.reverse() 
-        return versions
-    except Exception as e:
-        return []
-
-def get_adoptium_download_url(version):
-    base = f"https://api.adoptium.net/v3/assets/latest/{version}/hotspot"
-    params = {"architecture": "x64", "heap_size": "normal", "image_type": "jdk", "jvm_impl": "hotspot", "os": "windows", "vendor": "eclipse"}
-    try:
-        response = requests.get(base, params=params, timeout=10)
-        data = response.json()
-        if data:
-            return data[0]["binary"]["package"]["link"]
-        return None
-    except Exception:
-        return None
-
 # ------------------ 主应用类 ------------------
 class PageManager(ctk.CTk):
     def __init__(self):
@@ -119,34 +56,62 @@ class PageManager(ctk.CTk):
         # [修改 1] 调小最小尺寸，适应笔记本小屏幕
         self.minsize(1024, 600)
 
-        # 核心状态
-        self.server_process = None
+        # 核心状态：进程、控制台读取、备份任务与周期备份都由 mc_core.ServerEngine 管理 (每个服务器目录一个引擎)
+        self.engines = {}
+        self.engine = None  # 最近一次启动的服务器
         self.server_running = False
-        self.stdout_queue = queue.Queue() 
-        self.reader_thread = None
-        self.reader_thread_stop_event = threading.Event()
-        
-        # 新增：在线玩家集合
-        self.online_players = set()
-        
-        # --- 日志文件句柄分离 ---
-        self.server_log_file_handle = None 
+        # 每个引擎有自己的控制台批量队列 (见 _engine_for)；这里记住当前服务器配置的高水位
+        self.console_high_water = STDOUT_QUEUE_HIGH_WATER
+
+        # 控制台/程序日志的滚动缓冲 (完整历史保存在磁盘日志中)
+        self.server_scrollback = ConsoleScrollback(DEFAULT_CONSOLE_SCROLLBACK)
+        self.app_scrollback = ConsoleScrollback(APP_LOG_SCROLLBACK)
+
+        # 控制台渲染统计 (每次刷新的行数 / 耗时)
+        self.console_stats = {
+            "lines_total": 0,
+            "ticks": 0,
+            "last_tick_lines": 0,
+            "last_tick_ms": 0.0,
+            "max_tick_lines": 0,
+            "max_tick_ms": 0.0,
+            "queue_dropped": 0,
+        }
+
+        # 在线玩家名册 (增量更新界面，合并到每个刷新周期重绘一次)
+        self.player_roster = PlayerRoster()
+        self._player_redraw_pending = False
+        self._player_duration_pending = False
+
+        # 玩家在线记录 (持久化，供统计页面查询)
+        self.running_server_name = None
+        try:
+            ensure_dirs()
+            self.player_store = PlayerSessionStore()
+        except Exception:
+            self.player_store = None
+
+        # --- 程序日志 (BufferedLogWriter，写盘在独立线程；控制台日志由引擎写入) ---
         self.app_log_file_handle = None    
+        self.log_rotation = LogRotation()  # 控制台日志轮转设置 (随服务器配置加载)
         
         ensure_dirs()
         try:
             # App 日志保存到 logs/app/ 目录
-            app_log_path = os.path.join(LOG_APP_DIR, f"app-{_timestamp_str()}.log")
-            self.app_log_file_handle = open(app_log_path, 'a', encoding='utf-8')
+            app_log_path = os.path.join(LOG_APP_DIR, f"app-{timestamp_str()}.log")
+            self.app_log_file_handle = BufferedLogWriter(app_log_path, name="app-log-writer", rotation=LogRotation())
         except: pass
         
         # 备份相关
-        self.periodic_backup_thread = None
-        self.periodic_backup_stop_event = threading.Event()
-        self.startup_backup_done_event = threading.Event()
         self.periodic_backup_var = ctk.BooleanVar(value=False)
         self.startup_backup_var = ctk.BooleanVar(value=True)
+        self.backup_mode_var = ctk.StringVar(value=mc_backup.BACKUP_MODES[mc_backup.DEFAULT_BACKUP_MODE])
+        self.archive_codec_var = ctk.StringVar(value=mc_backup.DEFAULT_ARCHIVE_CODEC)
+        self.backup_idle_var = ctk.BooleanVar(value=True)
+        self.backup_pause_on_lag_var = ctk.BooleanVar(value=True)
+        self.snapshot_backend_var = ctk.StringVar(value=mc_backup.SNAPSHOT_BACKENDS[mc_backup.DEFAULT_SNAPSHOT_BACKEND])
         self.backup_map = {} 
+        self.restore_in_progress = False
 
         # 路径与配置
         self.current_server_path = None
@@ -189,12 +154,22 @@ class PageManager(ctk.CTk):
         self.create_pages()
 
         # 启动队列轮询
-        self.after(READ_QUEUE_POLL_MS, self.poll_stdout_queue)
+        # 控制台队列有数据时由读取线程唤醒 (无数据时不轮询)
+        self.bind("<<ConsoleData>>", lambda e: self.poll_stdout_queue())
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         
         # 启动时执行服务器扫描
         self.after(100, self._initial_scan_servers)
 
+        # 后台控制台日志索引
+        self.log_index = None
+        self.log_index_stop_event = threading.Event()
+        try:
+            self.log_index = ConsoleLogIndex()
+            threading.Thread(target=self._log_index_loop, name="log-indexer", daemon=True).start()
+        except Exception as e:
+            self.app_log_insert(f"⚠️ 日志索引不可用: {e}")
+
     def _build_top_bar(self):
         top_bar = ctk.CTkFrame(self, height=36, corner_radius=0)
         top_bar.pack(side="top", fill="x")
@@ -232,6 +207,8 @@ class PageManager(ctk.CTk):
             ("启动页面", 'main'),
             ("安装部署", 'install'), 
             ("备份设置", 'backup'),
+            ("日志搜索", 'search'),
+            ("玩家统计", 'analytics'),
             ("扩展功能", 'extra')
         ]
         
@@ -266,7 +243,8 @@ class PageManager(ctk.CTk):
         self.player_list_frame = ctk.CTkFrame(self.top_split_frame, corner_radius=6, border_width=2, border_color="#555555")
         self.player_list_frame.grid(row=0, column=0, sticky="nsew", padx=(0, 3), pady=0)
         
-        ctk.CTkLabel(self.player_list_frame, text="在线玩家列表", font=("", 12, "bold")).pack(pady=5)
+        self.player_list_title = ctk.CTkLabel(self.player_list_frame, text="在线玩家列表", font=("", 12, "bold"))
+        self.player_list_title.pack(pady=5)
         self.player_list_box = ctk.CTkTextbox(self.player_list_frame) 
         self.player_list_box.pack(fill="both", expand=True, padx=5, pady=5)
         self.player_list_box.insert("0.0", "等待服务器启动...")
@@ -279,8 +257,8 @@ class PageManager(ctk.CTk):
         ctk.CTkLabel(self.app_log_frame, text="程序运行日志 (App Log)", font=("", 12, "bold")).pack(pady=5)
         self.app_log_text = ctk.CTkTextbox(self.app_log_frame, wrap="word")
         self.app_log_text.pack(fill="both", expand=True, padx=5, pady=5)
-        self.app_log_text.insert('0.0', '💡 欢迎使用 Minecraft Server Manager V3\n')
         self.app_log_text.configure(state='disabled')
+        textbox_append(self.app_log_text, self.app_scrollback, ['💡 欢迎使用 Minecraft Server Manager V3'])
 
         # === 下半部分 (Bottom Area) ===
         # 3. 下方: Server Log + Command
@@ -317,6 +295,8 @@ class PageManager(ctk.CTk):
         self._create_main_page()
         self._create_install_page() 
         self._create_backup_page()
+        self._create_search_page()
+        self._create_analytics_page()
         self._create_extra_page()
         
         for p in self.pages.values():
@@ -573,6 +553,49 @@ class PageManager(ctk.CTk):
                             fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=120)
         btn.grid(row=4, column=1, pady=(0,12), padx=12, sticky="e")
         
+        # 备份模式
+        ctk.CTkLabel(auto_frame, text="备份模式:").grid(row=5, column=0, padx=12, sticky="w")
+        self.backup_mode_combo = ctk.CTkComboBox(auto_frame, values=list(mc_backup.BACKUP_MODES.values()),
+                                                 variable=self.backup_mode_var, width=220,
+                                                 command=lambda v: self._save_manager_config())
+        self.backup_mode_combo.grid(row=6, column=0, columnspan=2, padx=12, pady=(0,12), sticky="w")
+
+        # 压缩归档模式的编码与级别 (zstd 需要安装 zstandard)
+        ctk.CTkLabel(auto_frame, text="归档压缩:").grid(row=7, column=0, padx=12, sticky="w")
+        ctk.CTkLabel(auto_frame, text="压缩级别:").grid(row=7, column=1, padx=12, sticky="w")
+        ctk.CTkComboBox(auto_frame, values=mc_backup.available_codecs(), variable=self.archive_codec_var, width=120,
+                        command=lambda v: self._save_manager_config()).grid(row=8, column=0, padx=12, pady=(0,12), sticky="w")
+        self.archive_level_entry = ctk.CTkEntry(auto_frame, placeholder_text="默认", width=100)
+        self.archive_level_entry.grid(row=8, column=1, padx=12, pady=(0,12), sticky="w")
+
+        # 写时复制快照：快照完成后立即 save-on，备份在后台从快照进行
+        ctk.CTkLabel(auto_frame, text="快照后端:").grid(row=9, column=0, padx=12, sticky="w")
+        ctk.CTkComboBox(auto_frame, values=list(mc_backup.SNAPSHOT_BACKENDS.values()),
+                        variable=self.snapshot_backend_var, width=220,
+                        command=lambda v: self._save_manager_config()).grid(row=10, column=0, columnspan=2, padx=12, pady=(0,12), sticky="w")
+
+        # 运行中备份的节流 (点击 "应用设置" 生效)
+        ctk.CTkLabel(auto_frame, text="备份限速(MB/s，0 为不限):").grid(row=11, column=0, padx=12, sticky="w")
+        self.backup_limit_entry = ctk.CTkEntry(auto_frame, placeholder_text="0", width=100)
+        self.backup_limit_entry.grid(row=12, column=0, padx=12, pady=(0,12), sticky="w")
+        ctk.CTkSwitch(auto_frame, text="低优先级 I/O", variable=self.backup_idle_var,
+                      command=self._save_manager_config).grid(row=11, column=1, padx=12, sticky="w")
+        ctk.CTkSwitch(auto_frame, text="服务器卡顿时暂停备份", variable=self.backup_pause_on_lag_var,
+                      command=self._save_manager_config).grid(row=12, column=1, padx=12, pady=(0,12), sticky="w")
+
+        # GFS 分层保留：在 "保留数量" 之外，每小时/每天/每周/每月各保留最新的一个 (点击 "应用设置" 生效)
+        ctk.CTkLabel(auto_frame, text="分层保留 (每小时 / 每天 / 每周 / 每月 的个数，0 为不保留):").grid(
+            row=13, column=0, columnspan=2, padx=12, sticky="w")
+        tiers_frame = ctk.CTkFrame(auto_frame, fg_color="transparent")
+        tiers_frame.grid(row=14, column=0, columnspan=2, padx=12, pady=(0,12), sticky="w")
+        self.retention_entries = {}
+        defaults = mc_backup.RetentionPolicy.DEFAULTS
+        for col, (tier, label, _) in enumerate(mc_backup.RetentionPolicy.TIERS):
+            ctk.CTkLabel(tiers_frame, text=f"{label}:").grid(row=0, column=col * 2, padx=(0 if col == 0 else 8, 4))
+            entry = ctk.CTkEntry(tiers_frame, placeholder_text=str(defaults[tier]), width=50)
+            entry.grid(row=0, column=col * 2 + 1)
+            self.retention_entries[tier] = entry
+
         ctk.CTkButton(auto_frame, text="立即备份世界", command=self._manual_backup,
                       fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=120).grid(row=4, column=0, pady=(0,12), padx=12, sticky="w")
 
@@ -595,11 +618,31 @@ class PageManager(ctk.CTk):
         self.restore_btn = ctk.CTkButton(restore_frame, text="还原选中备份", command=self._restore_backup_world,
                                         fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=120)
         self.restore_btn.grid(row=2, column=0, padx=12, pady=(8,4), sticky="w")
-        
+        self.verify_btn = ctk.CTkButton(restore_frame, text="校验选中备份", command=self._verify_selected_backup,
+                                        fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=120)
+        self.verify_btn.grid(row=2, column=0, padx=12, pady=(8,4), sticky="e")
+        self.undo_restore_btn = ctk.CTkButton(restore_frame, text="撤销上次还原", command=self._undo_last_restore,
+                                              fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=120)
+        self.undo_restore_btn.grid(row=2, column=0, padx=12, pady=(8,4))
+        
+        # 选择性还原：只写回一个维度 / 一片区域 / 指定玩家的数据
+        selective_frame = ctk.CTkFrame(restore_frame, fg_color="transparent")
+        selective_frame.grid(row=3, column=0, padx=12, pady=(4,4), sticky="ew")
+        selective_frame.grid_columnconfigure(1, weight=1)
+        self.restore_scope_var = ctk.StringVar(value=mc_backup.DIMENSIONS["overworld"])
+        ctk.CTkComboBox(selective_frame, values=list(mc_backup.DIMENSIONS.values()) + [RESTORE_SCOPE_PLAYERS],
+                        variable=self.restore_scope_var, width=120).grid(row=0, column=0, padx=(0,8), sticky="w")
+        self.restore_target_entry = ctk.CTkEntry(selective_frame,
+                                                 placeholder_text="方块坐标 x1,z1,x2,z2 (留空为整个维度) / 玩家名或 UUID，逗号分隔")
+        self.restore_target_entry.grid(row=0, column=1, sticky="ew")
+        self.selective_restore_btn = ctk.CTkButton(selective_frame, text="选择性还原", command=self._selective_restore,
+                                                   fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=120)
+        self.selective_restore_btn.grid(row=0, column=2, padx=(8,0), sticky="e")
+
         restore_hint_frame = ctk.CTkFrame(restore_frame, fg_color="transparent")
-        restore_hint_frame.grid(row=3, column=0, padx=12, pady=(0,8), sticky="ew")
+        restore_hint_frame.grid(row=4, column=0, padx=12, pady=(0,8), sticky="ew")
         
-        restore_hint = "提示: 还原备份要求服务器停止。\n备份类型中文: startup(启动前), manual(手动), periodic(周期)."
+        restore_hint = "提示: 服务器运行时也可以还原，备份在后台暂存完成后才会短暂停服切换并自动重启；选择性还原要求服务器停止。\n备份类型中文: startup(启动前), manual(手动), periodic(周期).\n选择性还原只覆盖选中的区域/玩家文件，维度或区域范围内备份之后新生成的区域文件会被删除。"
         ctk.CTkLabel(restore_hint_frame, text=restore_hint, text_color=MILKY_FG, font=("", 10)).pack(anchor="w")
 
 
@@ -612,6 +655,150 @@ class PageManager(ctk.CTk):
         page.bind("<Visibility>", lambda e: self._refresh_backup_list() if self.current_page == 'backup' else None)
 
 
+    # ---------------- 页面 4: 日志搜索 (Search) ----------------
+    def _create_search_page(self):
+        page = ctk.CTkFrame(self.page_container, corner_radius=6, fg_color="transparent")
+        self.pages['search'] = page
+
+        ctk.CTkLabel(page, text="控制台历史搜索", font=("", 18, "bold")).pack(pady=10)
+
+        query_frame = ctk.CTkFrame(page)
+        query_frame.pack(fill="x", padx=20, pady=(0, 8))
+        query_frame.grid_columnconfigure(0, weight=1)
+
+        self.search_query_var = ctk.StringVar(value="")
+        search_entry = ctk.CTkEntry(query_frame, textvariable=self.search_query_var,
+                                    placeholder_text="输入关键字，例如 /op 或 Exception (回车搜索)")
+        search_entry.grid(row=0, column=0, padx=(8, 6), pady=8, sticky="ew")
+        search_entry.bind('<Return>', lambda e: self._run_log_search())
+        ctk.CTkButton(query_frame, text="搜索", command=self._run_log_search,
+                      fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=70).grid(row=0, column=1, padx=(0, 8), pady=8)
+
+        self.search_status_label = ctk.CTkLabel(page, text="索引: 未建立", anchor="w")
+        self.search_status_label.pack(fill="x", padx=20)
+
+        self.search_result_text = ctk.CTkTextbox(page, wrap="none", font=("Consolas", 11))
+        self.search_result_text.pack(fill="both", expand=True, padx=20, pady=(4, 12))
+        self.search_result_text.configure(state="disabled")
+
+    def _log_index_loop(self):
+        """后台定期增量索引 logs/server/ 下的控制台日志"""
+        while not self.log_index_stop_event.is_set():
+            try:
+                added = self.log_index.update()
+                if added:
+                    st = self.log_index.stats()
+                    self.after(0, lambda st=st: self.search_status_label.configure(
+                        text=f"索引: {st['files']} 个日志文件，{st['lines']} 行"))
+            except Exception as e:
+                self.after(0, lambda err=e: self.app_log_insert(f"⚠️ 日志索引失败: {err}"))
+            self.log_index_stop_event.wait(LOG_INDEX_INTERVAL_S)
+
+    def _run_log_search(self):
+        query = self.search_query_var.get().strip()
+        if not query: return
+        self.search_status_label.configure(text=f"🔍 正在搜索: {query} ...")
+
+        def worker():
+            try:
+                # 搜索前先补上最新写入的内容
+                self.log_index.update()
+                t0 = time.perf_counter()
+                rows = self.log_index.search(query, limit=500)
+                ms = (time.perf_counter() - t0) * 1000
+            except Exception as e:
+                self.after(0, lambda err=e: self.search_status_label.configure(text=f"❌ 搜索失败: {err}"))
+                return
+            self.after(0, self._show_search_results, query, rows, ms)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _show_search_results(self, query, rows, ms):
+        self.search_status_label.configure(text=f"✅ '{query}' 共 {len(rows)} 条结果 (最多显示 500 条，用时 {ms:.1f} ms)")
+        content = "\n".join(f"{ts}  [{session}#{lineno}]  {text}" for ts, session, lineno, text in rows)
+        self.search_result_text.configure(state="normal")
+        self.search_result_text.delete("1.0", "end")
+        self.search_result_text.insert("1.0", content or "无匹配结果")
+        self.search_result_text.configure(state="disabled")
+
+    # ---------------- 页面 5: 玩家统计 (Analytics) ----------------
+    def _create_analytics_page(self):
+        page = ctk.CTkFrame(self.page_container, corner_radius=6, fg_color="transparent")
+        self.pages['analytics'] = page
+
+        ctk.CTkLabel(page, text="玩家统计", font=("", 18, "bold")).pack(pady=10)
+        ctk.CTkLabel(page, textvariable=self.available_servers_var, font=("", 15, "bold"),
+                     text_color="#F0EBD8").pack(pady=(0, 8))
+
+        ctrl = ctk.CTkFrame(page)
+        ctrl.pack(fill="x", padx=20, pady=(0, 8))
+        ctk.CTkLabel(ctrl, text="统计范围:").pack(side="left", padx=8, pady=8)
+        self.analytics_range_var = ctk.StringVar(value="最近 7 天")
+        ctk.CTkComboBox(ctrl, values=["最近 24 小时", "最近 7 天", "最近 30 天", "全部"],
+                        variable=self.analytics_range_var, width=140).pack(side="left", padx=4)
+        ctk.CTkButton(ctrl, text="刷新统计", command=self._refresh_analytics,
+                      fg_color=MILKY_FG, hover_color=MILKY_HOVER, text_color=MILKY_TEXT, width=90).pack(side="right", padx=8)
+
+        self.analytics_text = ctk.CTkTextbox(page, wrap="none", font=("Consolas", 11))
+        self.analytics_text.pack(fill="both", expand=True, padx=20, pady=(4, 12))
+        self.analytics_text.configure(state="disabled")
+
+    def _refresh_analytics(self):
+        server = self.available_servers_var.get()
+        if not self.player_store or not server or server == "未检测到服务器":
+            self._show_analytics("请先选择服务器。")
+            return
+        days = {"最近 24 小时": 1, "最近 7 天": 7, "最近 30 天": 30}.get(self.analytics_range_var.get())
+        since = time.time() - days * 86400 if days else 0
+
+        def worker():
+            try:
+                self.player_store.flush()
+                peak, peak_ts = self.player_store.peak_concurrency(server, since)
+                top = self.player_store.playtime(server, since)
+                grid = self.player_store.hourly_heatmap(server, since)
+                recent = self.player_store.recent_sessions(server, since)
+            except Exception as e:
+                self.after(0, self._show_analytics, f"❌ 统计失败: {e}")
+                return
+            self.after(0, self._show_analytics, self._format_analytics(peak, peak_ts, top, grid, recent))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    @staticmethod
+    def _format_analytics(peak, peak_ts, top, grid, recent=()):
+        out = []
+        when = datetime.datetime.fromtimestamp(peak_ts).strftime("%Y-%m-%d %H:%M") if peak_ts else "-"
+        out.append(f"最高同时在线: {peak} 人 ({when})")
+        out.append("")
+        out.append("在线时长排行:")
+        if not top: out.append("  (暂无记录)")
+        for i, (player, secs, count) in enumerate(top, 1):
+            out.append(f"  {i:>2}. {player:<18} {secs / 3600:7.1f} 小时   {count} 次")
+        out.append("")
+        out.append("每小时在线热力图 (玩家·小时，越深越多):")
+        out.append("      " + "".join(f"{h:<3}" for h in range(24)))
+        peak_cell = max(max(row) for row in grid) or 1
+        shades = " ░▒▓█"
+        for d, name in enumerate(["周一", "周二", "周三", "周四", "周五", "周六", "周日"]):
+            cells = "".join(shades[min(4, int(v / peak_cell * 4 + 0.999))] * 2 + " " for v in grid[d])
+            out.append(f"{name}  {cells}")
+        out.append("")
+        out.append("最近会话:")
+        if not recent: out.append("  (暂无记录)")
+        now = time.time()
+        for player, join_ts, leave_ts in recent:
+            when = datetime.datetime.fromtimestamp(join_ts).strftime("%m-%d %H:%M")
+            length = format_duration((leave_ts or now) - join_ts)
+            out.append(f"  {when}  {player:<18} {length}{'' if leave_ts else ' (在线中)'}")
+        return "\n".join(out)
+
+    def _show_analytics(self, text):
+        self.analytics_text.configure(state="normal")
+        self.analytics_text.delete("1.0", "end")
+        self.analytics_text.insert("1.0", text)
+        self.analytics_text.configure(state="disabled")
+
     def _create_extra_page(self):
         page = ctk.CTkFrame(self.page_container, corner_radius=6, fg_color="transparent")
         self.pages['extra'] = page
@@ -671,114 +858,11 @@ class PageManager(ctk.CTk):
         threading.Thread(target=self._deploy_worker, args=(folder, version), daemon=True).start()
 
     def _deploy_worker(self, folder, version):
-        self.app_log_insert(f"🚀 开始在 {folder} 部署 Paper {version}...")
-        
         try:
-            if not os.path.exists(SERVERS_ROOT_DIR):
-                os.makedirs(SERVERS_ROOT_DIR)
-            if not os.path.exists(folder):
-                os.makedirs(folder)
-            
-            java_path = None
-            
-            # A. 下载 Java
-            if self.install_java_dl_var.get():
-                req_ver = get_required_java_version(version)
-                self.app_log_insert(f"⬇️ 正在查找 Java {req_ver} 下载链接...")
-                url = get_adoptium_download_url(req_ver)
-                if url:
-                    self.app_log_insert(f"⬇️ 开始下载 Java: {url}")
-                    zip_path = os.path.join(folder, "java_temp.zip")
-                    try:
-                        with requests.get(url, stream=True) as r:
-                            r.raise_for_status()
-                            dl = 0
-                            with open(zip_path, 'wb') as f:
-                                for chunk in r.iter_content(chunk_size=8192):
-                                    f.write(chunk)
-                                    dl += len(chunk)
-                                    if dl % (5 * 1024 * 1024) < 8192: 
-                                        self.app_log_insert(f"   已下载: {dl/1024/1024:.1f} MB ...")
-                        self.app_log_insert("📦 解压 Java 中...")
-                        extract_dir = os.path.join(folder, f"java{req_ver}")
-                        os.makedirs(extract_dir, exist_ok=True)
-                        with zipfile.ZipFile(zip_path, 'r') as z:
-                            z.extractall(extract_dir)
-                        os.remove(zip_path)
-                        
-                        java_root_dir = os.path.join(folder, f"java{req_ver}")
-                        java_path = None
-                        for root, dirs, files in os.walk(java_root_dir):
-                            if "java.exe" in files:
-                                java_path = os.path.join(root, "java.exe")
-                                break
-                        if java_path:
-                            self.app_log_insert(f"✅ Java 安装成功: {java_path}")
-                        else:
-                            self.app_log_insert("⚠️ 解压后未找到 java.exe")
-                    except Exception as e:
-                        self.app_log_insert(f"❌ Java 下载/安装失败: {e}")
-                else:
-                    self.app_log_insert("❌ 无法获取 Java 下载地址。")
-
-            # B. 下载 Server Jar
-            self.app_log_insert(f"⬇️ 正在获取 Paper {version} 最新构建...")
-            try:
-                builds_url = f"https://api.papermc.io/v2/projects/paper/versions/{version}"
-                resp = requests.get(builds_url)
-                
-                # [新增] 检查 API 是否返回了 404 (版本不存在)
-                if resp.status_code == 404:
-                    raise Exception(f"版本 {version} 在 PaperMC 中不存在！请检查是否输入了基岩版版本号？")
-                
-                resp.raise_for_status() # 检查其他网络错误
-                bd = resp.json()
-                
-                if "builds" not in bd:
-                    raise Exception(f"API 返回数据异常，未找到构建列表。返回内容: {bd}")
-
-                latest = bd["builds"][-1]
-                jar_url = f"https://api.papermc.io/v2/projects/paper/versions/{version}/builds/{latest}/downloads/paper-{version}-{latest}.jar"
-                
-                jar_dest = os.path.join(folder, "server.jar")
-                self.app_log_insert(f"⬇️ 下载 Server JAR ({latest})...")
-                with requests.get(jar_url, stream=True) as r:
-                    r.raise_for_status()
-                    with open(jar_dest, 'wb') as f:
-                        for chunk in r.iter_content(8192):
-                            f.write(chunk)
-                self.app_log_insert("✅ Server JAR 下载完成。")
-            except Exception as e:
-                self.app_log_insert(f"❌ Server JAR 下载失败: {e}")
-                raise e # 抛出异常以停止后续流程
-
-            # C. 写入文件
-            self.app_log_insert("📝 生成配置文件...")
-            with open(os.path.join(folder, "eula.txt"), "w") as f:
-                f.write("eula=true\n")
-            
-            props_path = os.path.join(folder, "server.properties")
-            om = "true" if self.install_online_mode_var.get() else "false"
-            with open(props_path, "w") as f:
-                f.write(f"online-mode={om}\n")
-                f.write("max-players=20\n")
-                f.write("pvp=true\n")
-                f.write("server-port=25565\n")
-                f.write("motd=A Minecraft Server\n")
-            
-            # 始终创建 start.bat，方便用户手动启动
-            bat_path = os.path.join(folder, "start.bat")
-            cmd_java = java_path if java_path else "java"
-            with open(bat_path, "w") as f:
-                f.write("@echo off\n")
-                f.write(f'"{cmd_java}" -Xms2G -Xmx2G -jar server.jar nogui\n')
-                f.write("pause\n")
-
-            self.app_log_insert("🎉 部署完成！")
-            
+            ensure_dirs()
+            deploy_paper(folder, version, self.app_log_insert, download_java=self.install_java_dl_var.get(),
+                         online_mode=self.install_online_mode_var.get())
             self.after(0, self._deployment_success_callback, folder)
-
-
         except Exception as e:
             self.after(0, self._deployment_failure_callback, str(e))
         finally:
@@ -856,30 +940,44 @@ class PageManager(ctk.CTk):
     
     # [新增] 加载管理器配置
     def _load_manager_config(self, folder):
-        config_path = os.path.join(folder, "manager_config.json")
-        defaults = {
-            "memory": self.MEMORY_OPTIONS_DISPLAY[1], # Default 2G/4G
-            "startup_backup": True,
-            "periodic_backup_enabled": False,
-            "periodic_interval": "10",
-            "periodic_keep": "10"
-        }
-        
-        data = defaults.copy()
-        if os.path.exists(config_path):
-            try:
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    saved = json.load(f)
-                    data.update(saved)
-            except: pass 
+        data = load_server_config(folder, {**server_config_defaults(), "memory": self.MEMORY_OPTIONS_DISPLAY[1]}) # Default 2G/4G
 
         # Apply to UI
         self.pending_memory_var.set(data["memory"])
         self.memory_var.set(data["memory"])
         
         self.startup_backup_var.set(data["startup_backup"])
+
+        try:
+            self.server_scrollback.set_capacity(data["console_scrollback"])
+        except (TypeError, ValueError):
+            self.server_scrollback.set_capacity(DEFAULT_CONSOLE_SCROLLBACK)
+        self.log_rotation = LogRotation.from_config(data)
+        try:
+            self.console_high_water = max(1000, int(data["console_queue_high_water"]))
+        except (TypeError, ValueError):
+            self.console_high_water = STDOUT_QUEUE_HIGH_WATER
+        eng = self._engine_for(folder)
+        eng.console_queue.high_water = self.console_high_water
         
         self.periodic_backup_var.set(data["periodic_backup_enabled"])
+        self.backup_mode_var.set(mc_backup.BACKUP_MODES.get(data["backup_mode"],
+                                                            mc_backup.BACKUP_MODES[mc_backup.DEFAULT_BACKUP_MODE]))
+        self.backup_idle_var.set(data["backup_idle_priority"])
+        self.backup_pause_on_lag_var.set(data["backup_pause_on_lag"])
+        try:
+            self.backup_limit_entry.delete(0, 'end')
+            self.backup_limit_entry.insert(0, str(data["backup_limit_mbps"]))
+        except: pass
+        eng.reload_config()
+        self.snapshot_backend_var.set(mc_backup.SNAPSHOT_BACKENDS.get(
+            data["snapshot_backend"], mc_backup.SNAPSHOT_BACKENDS[mc_backup.DEFAULT_SNAPSHOT_BACKEND]))
+        codec = data["archive_codec"]
+        self.archive_codec_var.set(codec if codec in mc_backup.available_codecs() else mc_backup.DEFAULT_ARCHIVE_CODEC)
+        try:
+            self.archive_level_entry.delete(0, 'end')
+            self.archive_level_entry.insert(0, str(data["archive_level"]))
+        except: pass
         
         try:
             self.periodic_interval_entry.delete(0, 'end')
@@ -890,6 +988,9 @@ class PageManager(ctk.CTk):
             self.backup_keep_entry.delete(0, 'end')
             self.backup_keep_entry.insert(0, str(data["periodic_keep"]))
         except: pass
+        for tier, entry in self.retention_entries.items():
+            entry.delete(0, 'end')
+            entry.insert(0, str(data[f"retention_{tier}"]))
         
         self.app_log_insert(f"🔧 已加载管理器配置: {os.path.basename(folder)}")
 
@@ -897,19 +998,31 @@ class PageManager(ctk.CTk):
     def _save_manager_config(self):
         if not self.current_server_path: return
         
-        config_path = os.path.join(self.current_server_path, "manager_config.json")
+        config_path = os.path.join(self.current_server_path, mc_core.SERVER_CONFIG_NAME)
         
         data = {
             "memory": self.memory_var.get(),
             "startup_backup": self.startup_backup_var.get(),
             "periodic_backup_enabled": self.periodic_backup_var.get(),
             "periodic_interval": self.periodic_interval_entry.get(),
-            "periodic_keep": self.backup_keep_entry.get()
+            "periodic_keep": self.backup_keep_entry.get(),
+            "backup_mode": self._get_backup_mode(),
+            "archive_codec": self.archive_codec_var.get(),
+            "archive_level": self.archive_level_entry.get(),
+            "snapshot_backend": self._get_snapshot_backend(),
+            "backup_limit_mbps": self.backup_limit_entry.get(),
+            "backup_idle_priority": self.backup_idle_var.get(),
+            "backup_pause_on_lag": self.backup_pause_on_lag_var.get(),
+            **{f"retention_{tier}": entry.get() for tier, entry in self.retention_entries.items()},
+            "console_scrollback": self.server_scrollback.capacity,
+            "console_queue_high_water": self.console_high_water,
+            **self.log_rotation.to_config()
         }
         
         try:
             with open(config_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, indent=4)
+            self._engine_for(self.current_server_path).reload_config()
             self.app_log_insert("💾 管理器配置已保存 (内存/备份设置)")
         except Exception as e:
             self.app_log_insert(f"❌ 保存管理器配置失败: {e}")
@@ -943,20 +1056,7 @@ class PageManager(ctk.CTk):
             self.after(0, self._refresh_backup_list)
 
     def find_server_jar(self, folder):
-        if not folder: return None
-        try:
-            cands = [f for f in os.listdir(folder) if f.lower().endswith('.jar')]
-        except: return None
-        if not cands: return None
-        
-        for c in cands:
-            if c.lower() == DEFAULT_SERVER_JAR: return os.path.join(folder, c)
-        
-        for c in cands:
-            if 'server' in c.lower() or 'minecraft' in c.lower() or 'paper' in c.lower(): 
-                return os.path.join(folder, c)
-                
-        return os.path.join(folder, cands[0])
+        return mc_core.find_server_jar(folder)
 
     def load_server_properties_gui(self, folder):
         p_path = os.path.join(folder, "server.properties")
@@ -1054,54 +1154,132 @@ class PageManager(ctk.CTk):
     # ---------------- 逻辑: 启动 / 停止 / 线程 ----------------
     
     def update_player_list_ui(self):
-        """刷新界面上的玩家列表"""
-        self.player_list_box.configure(state="normal")
-        self.player_list_box.delete("0.0", "end")
-        
-        if not self.online_players:
-            self.player_list_box.insert("0.0", "当前无玩家在线")
+        """请求刷新界面上的玩家列表；同一刷新周期内的多次变化合并为一次重绘"""
+        if self._player_redraw_pending: return
+        self._player_redraw_pending = True
+        self.after_idle(self._redraw_player_list)
+
+    def _redraw_player_list(self):
+        self._player_redraw_pending = False
+        roster = self.player_roster
+        ops = roster.take_ops()
+        if ops is not None and not ops: return
+
+        box = self.player_list_box
+        box.configure(state="normal")
+        if ops is None or not roster.names:
+            box.delete("1.0", "end")
+            if not roster.names:
+                box.insert("1.0", "当前无玩家在线")
+                # 占位文字下次必须整表替换
+                roster.full_redraw = True
+            else:
+                box.insert("1.0", "".join(roster.display_line(n) + "\n" for n in roster.names))
         else:
-            # 排序并逐行显示
-            content = "\n".join(sorted(self.online_players))
-            self.player_list_box.insert("0.0", content)
-            
-        self.player_list_box.configure(state="disabled")
-
-    def _parse_log_line_for_players(self, line):
-        """核心逻辑：分析日志行，提取玩家动态 (加强版)"""
-        
-        # 0. 预处理：去除 ANSI 颜色代码
-        clean_line = re.sub(r'\x1b\[[0-9;]*m', '', line)
-        
-        # 1. 玩家加入
-        join_match = re.search(r"\b(\w+)\s+joined the game", clean_line)
-        if join_match:
-            player_name = join_match.group(1)
-            if player_name.lower() not in ['server', 'player']: 
-                self.online_players.add(player_name)
+            # 每个玩家占一行 (以换行结尾)，第 i 个玩家在第 i+1 行
+            for op in ops:
+                if op[0] == 'ins':
+                    box.insert(f"{op[1] + 1}.0", roster.display_line(op[2]) + "\n")
+                else:
+                    box.delete(f"{op[1] + 1}.0", f"{op[1] + 2}.0")
+        box.configure(state="disabled")
+        self.player_list_title.configure(text=f"在线玩家列表 ({len(roster)})")
+        # 在线时长按分钟更新；无人在线时不再定时刷新
+        if roster.names and not self._player_duration_pending:
+            self._player_duration_pending = True
+            self.after(PLAYER_DURATION_REFRESH_MS, self._refresh_player_durations)
+
+    def _refresh_player_durations(self):
+        self._player_duration_pending = False
+        if not self.player_roster.names: return
+        self.player_roster.full_redraw = True
+        self.update_player_list_ui()
+
+    def _clear_player_roster(self):
+        self.player_roster.clear()
+        self.update_player_list_ui()
+
+    # --- 引擎状态 / 日志事件订阅 (由引擎的 LineClassifier 分发) ---
+    def _on_server_running(self):
+        if self.server_running: return
+        self.server_running = True
+        self.start_in_progress = False
+        self.start_button.configure(state="normal")
+        self.status_label.configure(text="服务器状态: 运行中 ✅", text_color="lightgreen")
+        self.update_controls_state()
+
+        # 服务器启动完成后，清空列表 (上次异常退出残留的会话一并结束)
+        self._clear_player_roster()
+        if self.player_store and self.running_server_name:
+            self.player_store.close_open_sessions(self.running_server_name)
+
+    def _on_player_join(self, event):
+        player_name = event.data["player"]
+        if player_name.lower() not in ['server', 'player']: 
+            if self.player_roster.join(player_name):
+                self._record_player_event(True, player_name)
                 self.update_player_list_ui()
-            return
 
-        # 2. 玩家退出
-        leave_match = re.search(r"\b(\w+)\s+left the game", clean_line)
-        if leave_match:
-            player_name = leave_match.group(1)
-            if player_name in self.online_players:
-                self.online_players.discard(player_name)
-                self.update_player_list_ui()
-            return
+    def _on_player_leave(self, event):
+        player_name = event.data["player"]
+        if self.player_roster.leave(player_name) is not None:
+            self._record_player_event(False, player_name)
+            self.update_player_list_ui()
+
+    def _on_player_list(self, event):
+        # 捕捉 /list 命令的回显
+        joined, left = self.player_roster.replace(event.data["players"])
+        for n in joined: self._record_player_event(True, n)
+        for n in left: self._record_player_event(False, n)
+        self.update_player_list_ui()
+
+    def _record_player_event(self, joined, player_name):
+        if not self.player_store or not self.running_server_name: return
+        if joined: self.player_store.record_join(self.running_server_name, player_name)
+        else: self.player_store.record_leave(self.running_server_name, player_name)
+
+    def _engine_for(self, server_dir):
+        """取得 (首次时创建) 服务器目录对应的引擎；控制台经该引擎自己的批量队列按帧取用"""
+        server_dir = os.path.abspath(server_dir)
+        eng = self.engines.get(server_dir)
+        if eng is None:
+            q = LineBatchQueue(self.console_high_water, keep=is_state_line)
+            q.notify = lambda: self._wake_console(q)
+            eng = self.engines[server_dir] = ServerEngine(server_dir, self.backup_dir_var.get(), console_queue=q)
+            # 玩家追踪通过订阅引擎的日志行分类器实现 (在界面线程中 publish 时分发，只处理当前服务器)
+            eng.classifier.subscribe(EVENT_JOIN, lambda ev: eng is self.engine and self._on_player_join(ev))
+            eng.classifier.subscribe(EVENT_LEAVE, lambda ev: eng is self.engine and self._on_player_leave(ev))
+            eng.classifier.subscribe(EVENT_LIST, lambda ev: eng is self.engine and self._on_player_list(ev))
+            eng.subscribe(lambda kind, data, eng=eng: self._on_engine_event(eng, kind, data))
+        eng.backup_root = self.backup_dir_var.get()
+        return eng
+
+    def _on_engine_event(self, eng, kind, data):
+        """引擎事件 (可能来自工作线程)：转到界面线程处理"""
+        if kind == "log":
+            self.after(0, lambda: self.app_log_insert(data, stamp=False))
+        elif kind == "state":
+            self.after(0, lambda: self._on_engine_state(eng, data))
+        elif kind == "backup":
+            self.after(0, self._refresh_backup_list)
 
-        # 3. 捕捉 /list 命令的回显
-        if "players online:" in clean_line:
-            list_match = re.search(r"players online:\s+(.*)", clean_line)
-            if list_match:
-                names_str = list_match.group(1).strip()
-                if names_str:
-                    current_names = {n.strip() for n in names_str.split(",") if n.strip()}
-                    self.online_players = current_names
-                else:
-                    self.online_players = set()
-                self.update_player_list_ui()
+    def _on_engine_state(self, eng, state):
+        if eng is not self.engine: return
+        if state == ServerEngine.STARTING:
+            self.start_in_progress = True
+            self.start_button.configure(state="disabled")
+        elif state == ServerEngine.RUNNING:
+            self._on_server_running()
+        elif state == ServerEngine.STOPPED:
+            self.server_running = False
+            self.start_in_progress = False
+            if eng.console_queue.dropped_total:
+                self.app_log_insert(f"⚠️ 本次运行控制台共省略 {eng.console_queue.dropped_total} 行输出 (已完整写入日志文件)")
+            self.update_controls_state()
+            self._clear_player_roster()
+            if self.player_store and self.running_server_name:
+                self.player_store.close_open_sessions(self.running_server_name)
+        self._update_restore_button_state()
 
     def start_server(self):
         if self.start_in_progress or self.server_running:
@@ -1121,134 +1299,93 @@ class PageManager(ctk.CTk):
 
         server_dir = os.path.dirname(jar_path)
         self.current_server_path = server_dir
+        self.running_server_name = os.path.basename(server_dir)
         
-        # [新增] 启动前保存当前配置，确保下次启动时一致
+        # [新增] 启动前保存当前配置，引擎启动时按 manager_config.json 运行 (内存/启动前备份/周期备份/限速)
         self._save_manager_config()
 
-        self.start_in_progress = True
-        self.start_button.configure(state="disabled")
-        
         selected_mem = self.memory_var.get()
-        xms = DEFAULT_XMS
-        xmx = DEFAULT_XMX
-        
-        try:
-            xms_match = re.search(r"Xms(\d+[GM])", selected_mem)
-            xmx_match = re.search(r"Xmx(\d+[GM])", selected_mem)
-            if xms_match and xmx_match:
-                xms = xms_match.group(1)
-                xmx = xmx_match.group(1)
-            else:
-                self.app_log_insert(f"⚠️ 内存选择格式解析不完全 ({selected_mem})，使用默认值 {DEFAULT_XMS}/{DEFAULT_XMX}")
-        except Exception as e:
-            self.app_log_insert(f"⚠️ 内存解析错误: {e}，使用默认值 {DEFAULT_XMS}/{DEFAULT_XMX}")
+        if not parse_memory_option(selected_mem):
+            self.app_log_insert(f"⚠️ 内存选择格式解析不完全 ({selected_mem})，使用默认值 {DEFAULT_XMS}/{DEFAULT_XMX}")
 
-
-        if self.startup_backup_var.get():
-            self.startup_backup_done_event.clear()
-            threading.Thread(target=self._startup_backup_thread, args=(jar_path,), daemon=True).start()
-
-        ensure_dirs()
-        # 修改：Server Log 保存到 logs/server/ 目录
-        log_f = os.path.join(LOG_SERVER_DIR, f"console-{_timestamp_str()}.log")
-        try:
-            # Server Log 文件
-            self.server_log_file_handle = open(log_f, 'a', encoding='utf-8')
-        except: pass
-
-        cmd = ['java', f'-Xmx{xmx}', f'-Xms{xms}', '-jar', jar_path, 'nogui']
-        
+        eng = self._engine_for(server_dir)
+        self.engine = eng
+        eng.console_queue.reset_counters()
         try:
-            self.server_process = subprocess.Popen(cmd, cwd=server_dir, stdin=subprocess.PIPE, 
-                                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
-                                                   text=True, bufsize=1)
-            self.app_log_insert(f"🚀 启动命令: {' '.join(cmd)}")
-            self.app_log_insert(f"📂 工作目录: {server_dir}")
-            
-            self.reader_thread_stop_event.clear()
-            self.reader_thread = threading.Thread(target=self.enqueue_stdout, args=(self.server_process.stdout,), daemon=True)
-            self.reader_thread.start()
-            
-            threading.Thread(target=self._monitor_process, daemon=True).start()
-            
-            if self.periodic_backup_var.get():
-                self.periodic_backup_stop_event.clear()
-                self.periodic_backup_thread = threading.Thread(target=self._periodic_backup_loop, daemon=True)
-                self.periodic_backup_thread.start()
-
-        except Exception as e:
+            eng.start(jar_path)
+        except (RuntimeError, OSError) as e:
             self.app_log_insert(f"❌ 启动异常: {e}")
-            self.start_in_progress = False
-            self.start_button.configure(state="normal")
-        
-        self.after(0, self._update_restore_button_state) 
-
-    def enqueue_stdout(self, pipe):
-        for line in iter(pipe.readline, ''):
-            if self.reader_thread_stop_event.is_set(): break
-            self.stdout_queue.put(line.rstrip())
-        pipe.close()
+            messagebox.showerror("错误", f"无法启动服务器: {e}")
 
     def poll_stdout_queue(self):
-        while not self.stdout_queue.empty():
-            line = self.stdout_queue.get_nowait()
-            if not self.server_running and re.search(r"\bDone\s*\(", line):
-                self.server_running = True
-                self.start_in_progress = False
-                self.start_button.configure(state="normal")
-                self.status_label.configure(text="服务器状态: 运行中 ✅", text_color="lightgreen")
-                self.update_controls_state()
-                
-                # 服务器启动完成后，清空列表
-                self.online_players.clear()
-                self.update_player_list_ui()
-            
-            self._parse_log_line_for_players(line)
-
-            # 写入下方的 Server Log 区域
-            self.server_log_text.configure(state='normal')
-            self.server_log_text.insert('end', line + '\n')
-            self.server_log_text.see('end')
-            self.server_log_text.configure(state='disabled')
-            
-            # 写入 Server Log 文件
-            if self.server_log_file_handle: self.server_log_file_handle.write(line+'\n')
-        
-        self.after(READ_QUEUE_POLL_MS, self.poll_stdout_queue)
+        """批量取出各引擎队列中的日志行交给对应的引擎解码、分类；当前服务器的行合并为一次插入。
+        单次耗时受 CONSOLE_FRAME_BUDGET_MS 限制"""
+        tick_start = time.perf_counter()
+        deadline = tick_start + CONSOLE_FRAME_BUDGET_MS / 1000.0
+        lines = []
+        taken = 0
+
+        # 当前服务器优先；其它引擎 (例如正在退出的上一个服务器) 的行也要 publish，存档确认/状态才不会丢
+        for eng in sorted(self.engines.values(), key=lambda e: e is not self.engine):
+            q = eng.console_queue
+            shown = eng is self.engine
+            dropped = q.take_dropped()
+            if dropped and shown:
+                # 积压时被合并丢弃的行只在界面省略，磁盘日志中完整保留
+                lines.append(f"⚠️ 控制台输出过快，已省略 {dropped} 行 (完整内容见日志文件)")
+
+            # 由引擎解码、分类并分发事件 (启动完成 / 存档确认 / 玩家进出 / list 回显)
+            decoded, n = eng.pump_console(CONSOLE_MAX_LINES_PER_TICK - taken, deadline)
+            taken += n
+            if shown: lines.extend(decoded)
+
+        if lines:
+            # 写入下方的 Server Log 区域 (一次插入 + 一次滚动，超出容量批量裁剪)
+            textbox_append(self.server_log_text, self.server_scrollback, lines)
+
+            tick_ms = (time.perf_counter() - tick_start) * 1000.0
+            stats = self.console_stats
+            stats["ticks"] += 1
+            stats["lines_total"] += len(lines)
+            stats["last_tick_lines"] = len(lines)
+            stats["last_tick_ms"] = tick_ms
+            stats["max_tick_lines"] = max(stats["max_tick_lines"], len(lines))
+            stats["max_tick_ms"] = max(stats["max_tick_ms"], tick_ms)
+            stats["queue_dropped"] = self.engine.console_queue.dropped_total if self.engine else 0
+
+        # 任一队列还有积压时尽快进入下一轮，让出主循环处理其它事件；都已空则等待下一次唤醒
+        pending = [eng.console_queue.rearm() for eng in self.engines.values()]
+        if any(pending):
+            self.after(1, self.poll_stdout_queue)
+
+    def _wake_console(self, queue):
+        """由写入队列的线程调用 (每个队列每批积压只调用一次)：向 Tk 事件队列投递一个虚拟事件"""
+        try:
+            self.event_generate("<<ConsoleData>>", when="tail")
+        except Exception:
+            # 窗口已销毁或投递失败：不会再有事件回调 rearm()，清除标记让下一批重新唤醒
+            queue.reset_wakeup()
 
-    def _monitor_process(self):
-        self.server_process.wait()
-        self.server_running = False
-        self.start_in_progress = False
-        self.after(0, lambda: self.stdout_queue.put("🔴 服务器进程已退出。"))
-        self.reader_thread_stop_event.set()
-        self.periodic_backup_stop_event.set()
-        self.after(0, self.update_controls_state)
-        self.after(0, self._update_restore_button_state)
-        self.online_players.clear()
-        self.after(0, self.update_player_list_ui)
+    def get_console_stats(self):
+        """返回控制台渲染统计的副本 (行数/每次刷新耗时)"""
+        return dict(self.console_stats)
 
     def stop_server(self):
-        if self.server_process and self.server_process.poll() is None:
-            self.safe_write_stdin("stop\n")
-            self.app_log_insert("🛑 发送 stop 指令...")
-        else:
-            messagebox.showinfo("提示", "服务器未运行")
-
-    def safe_write_stdin(self, data):
         try:
-            if self.server_process and self.server_process.stdin:
-                self.server_process.stdin.write(data)
-                self.server_process.stdin.flush()
-        except Exception as e:
-            self.app_log_insert(f"❌ 写入失败: {e}")
+            if not self.engine: raise RuntimeError("服务器未运行")
+            self.engine.stop()
+        except RuntimeError:
+            messagebox.showinfo("提示", "服务器未运行")
 
     def send_command(self, event=None):
         cmd = self.input_entry.get().strip()
         if cmd:
-            self.safe_write_stdin(cmd + "\n")
-            # 命令回显到 Server Log
-            self.stdout_queue.put(f"> {cmd}")
+            # 引擎负责写入 stdin，并把命令回显到 Server Log 与控制台日志
+            try:
+                if not self.engine: raise RuntimeError("服务器未运行")
+                self.engine.command(cmd)
+            except (RuntimeError, OSError) as e:
+                self.app_log_insert(f"❌ 写入失败: {e}")
             self.input_entry.delete(0, 'end')
 
     def update_controls_state(self):
@@ -1263,176 +1400,41 @@ class PageManager(ctk.CTk):
         except: pass
 
     # ---------------- 备份逻辑 (核心修复) ----------------
-    def _startup_backup_thread(self, jar_path):
-        folder = os.path.dirname(jar_path)
-        self._prune_startup_backups(folder) 
-        self.after(0, lambda: self.app_log_insert(f"🔄 [启动备份] 正在备份 {folder}..."))
-        self.backup_world(folder, "startup")
-        self.startup_backup_done_event.set()
-
-    def _periodic_backup_loop(self):
-        try:
-            iv = int(self.periodic_interval_entry.get())
-        except: iv = 10
-        
-        self.after(0, lambda: self.app_log_insert(f"⏱️ 周期备份启动，间隔 {iv} 分钟"))
-        
-        while not self.periodic_backup_stop_event.is_set():
-            for _ in range(iv * 60):
-                if self.periodic_backup_stop_event.is_set(): return
-                time.sleep(1)
-            
-            if self.server_running and self.current_server_path:
-                self.app_log_insert("⏳ [周期备份] 正在准备世界保存...")
-                self.safe_write_stdin("save-all\n")
-                time.sleep(2)
-                self.safe_write_stdin("save-off\n")
-                time.sleep(1)
-                self.backup_world(self.current_server_path, "periodic")
-                self.safe_write_stdin("save-on\n")
-                self.after(0, lambda folder=self.current_server_path: self.prune_backups(folder))
-                
-    def _prune_startup_backups(self, src_dir):
-        if not src_dir: return
-        s_name = os.path.basename(src_dir)
-        dest_dir = os.path.join(self.backup_dir_var.get(), s_name)
-        if not os.path.isdir(dest_dir): return
-
-        startup_backups = []
-        for item in os.listdir(dest_dir):
-            if re.match(r"backup-(\d{8})-(\d{6})_startup", item):
-                startup_backups.append(item)
-        
-        startup_backups.sort(reverse=True)
-        
-        for i in startup_backups[1:]:
-            full_path = os.path.join(dest_dir, i)
-            try:
-                shutil.rmtree(full_path)
-                self.after(0, lambda name=i: self.app_log_insert(f"🗑️ [启动前备份] 清理旧启动备份: {name}"))
-            except Exception as e:
-                 self.after(0, lambda name=i, err=e: self.app_log_insert(f"❌ [启动前备份] 清理失败 {name}: {err}"))
-
-    # === 修复重点：多世界备份逻辑 (Fix Multi-World Backup) ===
-    def backup_world(self, src_dir, note):
-        if not src_dir: return
-        try:
-            s_name = os.path.basename(src_dir)
-            dest_dir = os.path.join(self.backup_dir_var.get(), s_name)
-            os.makedirs(dest_dir, exist_ok=True)
-            
-            name = f"backup-{_timestamp_str()}_{note}"
-            final_dest = os.path.join(dest_dir, name)
-            
-            # 1. 获取世界名 (level-name)
-            level_name = "world" # 默认值
-            p_path = os.path.join(src_dir, "server.properties")
-            if os.path.exists(p_path):
-                try:
-                    with open(p_path, 'r', encoding='utf-8', errors='ignore') as f:
-                        for line in f:
-                            if line.strip().startswith("level-name="):
-                                val = line.strip().split("=", 1)[1].strip()
-                                if val: level_name = val
-                                break
-                except: pass
-
-            # 2. 定义候选目标
-            candidates = set()
-            candidates.add(level_name)
-            candidates.add(f"{level_name}_nether")
-            candidates.add(f"{level_name}_the_end")
-            candidates.add("world_nether")
-            candidates.add("world_the_end")
-
-            backed_up_count = 0
-            
-            # 3. 遍历并备份存在的文件夹
-            for target in candidates:
-                target_path = os.path.join(src_dir, target)
-                if os.path.exists(target_path) and os.path.isdir(target_path):
-                    shutil.copytree(target_path, os.path.join(final_dest, target), 
-                                    dirs_exist_ok=True, 
-                                    ignore=shutil.ignore_patterns("session.lock"))
-                    self.after(0, lambda t=target: self.app_log_insert(f"   - 已备份世界目录: {t}"))
-                    backed_up_count += 1
-            
-            # 4. 如果没找到任何 Paper 样式的文件夹
-            if backed_up_count == 0:
-                target_path = os.path.join(src_dir, level_name)
-                if os.path.exists(target_path) and os.path.isdir(target_path):
-                    shutil.copytree(target_path, os.path.join(final_dest, level_name),
-                                    dirs_exist_ok=True,
-                                    ignore=shutil.ignore_patterns("session.lock"))
-                    self.after(0, lambda: self.app_log_insert(f"✅ 备份完成: {name} (单世界/Vanilla结构)"))
-                else:
-                    self.after(0, lambda: self.app_log_insert("⚠️ 未检测到标准世界结构，执行全量文件备份..."))
-                    shutil.copytree(src_dir, final_dest, 
-                                    ignore=shutil.ignore_patterns("*.jar", "backups", "logs", "servers", "session.lock"), 
-                                    dirs_exist_ok=True) 
-                    self.after(0, lambda: self.app_log_insert(f"✅ 全量备份完成: {name}"))
-            else:
-                 self.after(0, lambda: self.app_log_insert(f"✅ 备份完成: {name} (共 {backed_up_count} 个世界文件夹)"))
-
-            self.after(0, self._refresh_backup_list)
-
-        except Exception as e:
-            error_message = str(e)
-            self.after(0, lambda msg=error_message: self.app_log_insert(f"❌ 备份失败: {msg}"))
-
-    def prune_backups(self, src_dir):
-        if not src_dir: return
-        try:
-            kp = int(self.backup_keep_entry.get())
-        except: kp = 10
-        
-        s_name = os.path.basename(src_dir)
-        folder = os.path.join(self.backup_dir_var.get(), s_name)
-        if not os.path.isdir(folder): return
-
-        items_to_prune = []
-        for d in os.listdir(folder):
-            if not os.path.isdir(os.path.join(folder, d)): continue
-            if not re.match(r"backup-(\d{8})-(\d{6})_startup", d):
-                items_to_prune.append(os.path.join(folder, d))
-        
-        items_to_prune.sort(key=os.path.getmtime, reverse=True)
-        
-        for i in items_to_prune[kp:]:
-            try: 
-                shutil.rmtree(i)
-                self.after(0, lambda name=os.path.basename(i): self.app_log_insert(f"🗑️ [周期备份清理] 清理旧备份: {name}"))
-            except Exception as e:
-                 error_message = str(e)
-                 self.after(0, lambda name=os.path.basename(i), msg=error_message: self.app_log_insert(f"❌ [周期备份清理] 清理失败 {name}: {msg}"))
-        
-        self.after(0, self._refresh_backup_list)
-
+    def _backup_settings(self):
+        """界面上当前的备份设置"""
+        return BackupSettings(self.backup_dir_var.get(), self._get_backup_mode(), self.archive_codec_var.get(),
+                              self.archive_level_entry.get(), self._get_snapshot_backend(),
+                              self._get_retention_policy())
+
+    def _get_snapshot_backend(self):
+        shown = self.snapshot_backend_var.get()
+        for key, name in mc_backup.SNAPSHOT_BACKENDS.items():
+            if name == shown: return key
+        return mc_backup.DEFAULT_SNAPSHOT_BACKEND
+
+    def _get_backup_mode(self):
+        """把界面上选择的备份模式显示名转换为 mc_backup 中的模式键"""
+        shown = self.backup_mode_var.get()
+        for key, name in mc_backup.BACKUP_MODES.items():
+            if name == shown: return key
+        return mc_backup.DEFAULT_BACKUP_MODE
+
+    def _get_retention_policy(self):
+        return mc_backup.RetentionPolicy.from_config({
+            "periodic_keep": self.backup_keep_entry.get(),
+            **{f"retention_{tier}": entry.get() for tier, entry in self.retention_entries.items()}})
 
     def _manual_backup(self):
         if not self.current_server_path:
             messagebox.showwarning("提示", "未选择服务器，无法手动备份")
             return
-
-        def manual_backup_worker():
-            self.app_log_insert("⏳ [手动备份] 正在开始...")
-
-            if self.server_running:
-                self.app_log_insert("⏳ [手动备份] 正在准备世界保存(save-all/off)...")
-                self.safe_write_stdin("save-all\n")
-                time.sleep(2)
-                self.safe_write_stdin("save-off\n")
-                time.sleep(1)
-            
-            self.backup_world(self.current_server_path, "manual")
-
-            if self.server_running:
-                self.safe_write_stdin("save-on\n")
-                self.app_log_insert("✅ [手动备份] 服务器自动保存已恢复(save-on)")
-
-            self.prune_backups(self.current_server_path)
-
-        threading.Thread(target=manual_backup_worker, daemon=True).start()
+        # 运行中时由引擎先 save-off/save-all flush，完成后自动清理旧备份并刷新列表
+        try:
+            self._engine_for(self.current_server_path).backup("manual", self._backup_settings())
+        except (RuntimeError, ValueError) as e:
+            messagebox.showwarning("提示", f"无法开始备份: {e}")
+            return
+        self.app_log_insert("⏳ [手动备份] 正在开始...")
     
     def _open_backup_folder(self):
         p = self.backup_dir_var.get()
@@ -1466,37 +1468,21 @@ class PageManager(ctk.CTk):
                 
     # ---------------- 还原逻辑 (同步修复) ----------------
     def _get_backup_list(self, server_name):
+        """快照名来自缓存的目录索引，大小/文件数/校验状态来自备份目录 (catalog)，不遍历快照内容"""
         if not server_name or server_name == "未检测到服务器":
             return []
             
-        server_backup_path = os.path.join(self.backup_dir_var.get(), server_name)
-        if not os.path.isdir(server_backup_path):
-            return []
-            
+        type_map = {'startup': '启动前备份', 'manual': '手动备份', 'periodic': '周期备份'}
+        kind_map = {mc_backup.KIND_DEDUP: " (去重)", mc_backup.KIND_ARCHIVE: " (归档)"}
         backups = []
-        for item in os.listdir(server_backup_path):
-            full_path = os.path.join(server_backup_path, item)
-            if os.path.isdir(full_path):
-                match = re.match(r"backup-(\d{8})-(\d{6})_(\w+)", item)
-                
-                if match:
-                    date_str = match.group(1)
-                    time_str = match.group(2)
-                    type_en = match.group(3)
-                    
-                    type_map = {'startup': '启动前备份', 'manual': '手动备份', 'periodic': '周期备份'}
-                    type_cn = type_map.get(type_en, '未知类型')
-                    
-                    try:
-                        dt_obj = datetime.datetime.strptime(date_str + time_str, "%Y%m%d%H%M%S")
-                        time_display = dt_obj.strftime("%Y年%m月%d日 %H:%M:%S")
-                    except:
-                        time_display = "时间格式错误"
-
-                    display_name = f"[{type_cn}] {time_display}"
-                    backups.append((item, display_name, full_path))
-                    
-        backups.sort(key=lambda x: x[0], reverse=True)
+        for b in list_backups(self.backup_dir_var.get(), server_name):
+            type_cn = type_map.get(b["note"], '未知类型')
+            display_name = f"[{type_cn}] {datetime.datetime.fromisoformat(b['time']):%Y年%m月%d日 %H:%M:%S}{kind_map.get(b['kind'], '')}"
+            if b["bytes"] is not None:
+                display_name += f"  {b['bytes'] / 1024 / 1024:,.1f} MB / {b['files']} 个文件"
+                if b["verified"] == "ok": display_name += "  ✅"
+                elif b["verified"] == "failed": display_name += "  ❌损坏"
+            backups.append((b["name"], display_name, b["path"]))
         return backups
 
     def _refresh_backup_list(self):
@@ -1508,13 +1494,15 @@ class PageManager(ctk.CTk):
             self._update_restore_button_state()
             return
             
+        selected = self.backup_map.get(self.restore_backup_var.get())
         backup_list = self._get_backup_list(server_name)
         
         if backup_list:
             display_names = [item[1] for item in backup_list]
             self.restore_combo.configure(values=display_names)
             self.backup_map = {item[1]: item[2] for item in backup_list}
-            self.restore_backup_var.set(display_names[0])
+            # 校验状态等显示内容变化后仍选中原来的备份
+            self.restore_backup_var.set(next((item[1] for item in backup_list if item[2] == selected), display_names[0]))
         else:
             self.restore_combo.configure(values=["该服务器无备份"])
             self.restore_backup_var.set("该服务器无备份")
@@ -1523,18 +1511,15 @@ class PageManager(ctk.CTk):
         self._update_restore_button_state()
 
     def _update_restore_button_state(self):
-        if self.server_running:
-            self.restore_btn.configure(state="disabled", text="服务器运行中，无法还原")
+        if self.restore_in_progress:
+            self.restore_btn.configure(state="disabled", text="还原中...")
         elif not self.backup_map:
             self.restore_btn.configure(state="disabled", text="无可用备份")
         else:
-            self.restore_btn.configure(state="normal", text="还原选中备份")
+            self.restore_btn.configure(state="normal", text="还原选中备份 (将短暂停服)" if self.server_running else "还原选中备份")
 
     def _restore_backup_world(self):
-        if self.server_running:
-            messagebox.showwarning("警告", "服务器正在运行中，请先停止服务器再进行还原操作！")
-            return
-            
+        if self.restore_in_progress: return
         selected_display_name = self.restore_backup_var.get()
         if selected_display_name not in self.backup_map:
             messagebox.showwarning("提示", "请选择一个有效的备份！")
@@ -1547,65 +1532,152 @@ class PageManager(ctk.CTk):
             messagebox.showerror("错误", "当前未选择有效的服务器文件夹。")
             return
 
-        if not messagebox.askyesno("确认还原", f"警告: 您确定要将服务器 '{os.path.basename(server_path)}' 还原到备份点:\n{selected_display_name}\n此操作将覆盖当前服务器世界数据！"):
+        restart = self.server_running
+        note = "\n服务器正在运行：备份暂存完成后将停止服务器、切换世界并自动重启。" if restart else ""
+        if not messagebox.askyesno("确认还原", f"警告: 您确定要将服务器 '{os.path.basename(server_path)}' 还原到备份点:\n{selected_display_name}\n当前世界将被换下，保留为可撤销的还原点。{note}"):
             return
             
-        self.restore_btn.configure(state="disabled", text="还原中...")
+        self.restore_in_progress = True
+        self._update_restore_button_state()
         
         threading.Thread(target=self._restore_worker, args=(server_path, backup_path, selected_display_name), daemon=True).start()
 
-    def _restore_worker(self, server_path, backup_path, display_name):
-        self.app_log_insert(f"🔁 [还原] 开始将服务器 {os.path.basename(server_path)} 还原到 {display_name}...")
-        
-        try:
-            # 1. 获取所有备份中的子文件夹
-            backup_subdirs = [d for d in os.listdir(backup_path) if os.path.isdir(os.path.join(backup_path, d))]
-            
-            restored_any = False
-            
-            for subdir in backup_subdirs:
-                src_p = os.path.join(backup_path, subdir)
-                dest_p = os.path.join(server_path, subdir)
-                
-                if os.path.exists(dest_p):
-                     self.app_log_insert(f"🗑️ [还原] 清理旧数据: {subdir}")
-                     shutil.rmtree(dest_p)
-                
-                self.app_log_insert(f"📥 [还原] 恢复数据: {subdir}")
-                shutil.copytree(src_p, dest_p)
-                restored_any = True
+    def _undo_last_restore(self):
+        server_path = self.current_server_path
+        if not server_path: return
+        if self.server_running or self.start_in_progress or self.restore_in_progress:
+            messagebox.showwarning("警告", "请先停止服务器 (并等待还原完成) 再撤销还原！")
+            return
+        eng = self._engine_for(server_path)
+        meta = eng.undo_point()
+        if meta is None:
+            messagebox.showinfo("提示", "没有可撤销的还原")
+            return
+        if not messagebox.askyesno("撤销还原", f"换回 {meta['time']} 还原 ({meta['label']}) 之前的世界？\n还原进来的世界将被删除。"):
+            return
+        self.undo_restore_btn.configure(state="disabled")
 
-            if restored_any:
-                self.app_log_insert("✅ [还原] 世界还原成功！请重新启动服务器。")
-                self.after(0, lambda: messagebox.showinfo("成功", "世界还原成功！请重新启动服务器。"))
-            else:
-                self.app_log_insert("⚠️ [还原] 未找到子文件夹，尝试全量覆盖还原...")
-                exclude_list = ["logs", "backups", "servers", os.path.basename(server_path)]
-                for item in os.listdir(server_path):
-                     if item not in exclude_list:
-                         path_to_delete = os.path.join(server_path, item)
-                         if os.path.isdir(path_to_delete): shutil.rmtree(path_to_delete)
-                         elif os.path.isfile(path_to_delete): os.remove(path_to_delete)
-                         
-                for item in os.listdir(backup_path):
-                    src_item = os.path.join(backup_path, item)
-                    dst_item = os.path.join(server_path, item)
-                    if item in exclude_list: continue 
-                    
-                    if os.path.isdir(src_item):
-                         shutil.copytree(src_item, dst_item)
-                    elif os.path.isfile(src_item):
-                         shutil.copy2(src_item, dst_item)
-                
-                self.app_log_insert("✅ [还原] 全量还原成功！请重新启动服务器。")
-                self.after(0, lambda: messagebox.showinfo("成功", "全量还原成功！请重新启动服务器。"))
+        def worker():
+            # 由引擎认领任务并持有跨进程锁，备份进行中或被守护进程占用时拒绝执行；结果由引擎写入应用日志
+            try:
+                eng.undo_restore()
+            except Exception as e:
+                self.after(0, lambda err=e: messagebox.showerror("错误", f"撤销失败: {err}"))
+            finally:
+                self.after(0, lambda: self.undo_restore_btn.configure(state="normal"))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _build_restore_selection(self, server_path):
+        """根据选择性还原的输入构造 mc_backup.RestoreSelection；输入有误时弹窗并返回 None"""
+        level = read_level_name(server_path)
+        scope = self.restore_scope_var.get()
+        text = self.restore_target_entry.get().strip()
+        if scope == RESTORE_SCOPE_PLAYERS:
+            tokens = [t.strip() for t in re.split(r"[,，\s]+", text) if t.strip()]
+            if not tokens:
+                messagebox.showwarning("提示", "请输入要还原的玩家名或 UUID (逗号分隔)")
+                return None
+            uuids, unknown = mc_backup.resolve_player_uuids(server_path, tokens)
+            if unknown:
+                messagebox.showwarning("提示", f"在 usercache.json 中找不到这些玩家，请改用 UUID:\n{', '.join(unknown)}")
+                return None
+            return mc_backup.player_selection(level, uuids)
+
+        dim = next((k for k, v in mc_backup.DIMENSIONS.items() if v == scope), None)
+        if dim is None:
+            messagebox.showwarning("提示", "请选择要还原的维度或玩家数据")
+            return None
+        box = None
+        if text:
+            try:
+                box = [int(float(v)) for v in re.split(r"[,，\s]+", text) if v]
+                if len(box) != 4: raise ValueError
+            except ValueError:
+                messagebox.showwarning("提示", "区域请填写两个角的方块坐标: x1,z1,x2,z2")
+                return None
+        return mc_backup.dimension_selection(level, dim, box)
+
+    def _selective_restore(self):
+        if self.server_running or self.start_in_progress or self.restore_in_progress:
+            messagebox.showwarning("警告", "服务器正在运行或启动中 (或还原尚未完成)，请先停止服务器再进行还原操作！")
+            return
+        selected_display_name = self.restore_backup_var.get()
+        if selected_display_name not in self.backup_map:
+            messagebox.showwarning("提示", "请选择一个有效的备份！")
+            return
+        server_path = self.current_server_path
+        if not server_path or not os.path.isdir(server_path):
+            messagebox.showerror("错误", "当前未选择有效的服务器文件夹。")
+            return
+        selection = self._build_restore_selection(server_path)
+        if selection is None: return
+        if not messagebox.askyesno("确认选择性还原", f"将从备份点:\n{selected_display_name}\n还原 {selection.label}，覆盖当前对应的文件。是否继续？"):
+            return
+        backup_path = self.backup_map[selected_display_name]
+        eng = self._engine_for(server_path)
+        self.selective_restore_btn.configure(state="disabled", text="还原中...")
+
+        def worker():
+            # 由引擎认领任务并持有跨进程锁：服务器启动中、备份/还原进行中或被守护进程占用时拒绝执行
+            try:
+                restored, removed = eng.restore_selected_path(backup_path, selected_display_name, selection)
+                if restored or removed:
+                    msg = f"完成: 还原 {len(restored)} 个文件，删除 {len(removed)} 个文件"
+                else:
+                    msg = "备份中没有匹配的文件，未做任何修改"
+                self.after(0, lambda: messagebox.showinfo("选择性还原", msg))
+            except Exception as e:
+                self.after(0, lambda err=e: messagebox.showerror("错误", f"还原失败: {err}"))
+            finally:
+                self.after(0, lambda: self.selective_restore_btn.configure(state="normal", text="选择性还原"))
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _verify_selected_backup(self):
+        selected_display_name = self.restore_backup_var.get()
+        if selected_display_name not in self.backup_map:
+            messagebox.showwarning("提示", "请选择一个有效的备份！")
+            return
+        backup_path = self.backup_map[selected_display_name]
+        self.verify_btn.configure(state="disabled", text="校验中...")
+
+        def verify_worker():
+            self.after(0, lambda: self.app_log_insert(f"🔍 [校验] 开始校验 {selected_display_name}..."))
+            t0 = time.monotonic()
+            checked, errors = mc_backup.verify_snapshot(backup_path)
+            elapsed = time.monotonic() - t0
+            mc_backup.record_verify(backup_path, errors)
+            def done():
+                self._refresh_backup_list()
+                self.verify_btn.configure(state="normal", text="校验选中备份")
+                if errors:
+                    for err in errors[:20]:
+                        self.app_log_insert(f"   - {err}")
+                    if len(errors) > 20: self.app_log_insert(f"   - ... 共 {len(errors)} 处问题")
+                    self.app_log_insert(f"❌ [校验] 备份损坏或不完整: {selected_display_name}")
+                    messagebox.showerror("校验失败", f"发现 {len(errors)} 处问题，详见应用日志。")
+                else:
+                    self.app_log_insert(f"✅ [校验] 备份完好: {checked} 个文件 ({elapsed:.1f} 秒)")
+                    messagebox.showinfo("校验通过", f"备份完好，共校验 {checked} 个文件。")
+            self.after(0, done)
+
+        threading.Thread(target=verify_worker, daemon=True).start()
 
+    def _restore_worker(self, server_path, backup_path, display_name):
+        """由引擎先把备份暂存到服务器目录下 (服务器可继续运行)，再停服、重命名换入；为此停过服时无论成败都重启"""
+        try:
+            restarted = self._engine_for(server_path).restore_path(backup_path, display_name)
+            if not restarted:
+                self.after(0, lambda: messagebox.showinfo("成功", "世界还原成功！请重新启动服务器。\n如需撤销，点击 \"撤销上次还原\"。"))
         except Exception as e:
             error_message = str(e)
-            self.app_log_insert(f"❌ [还原] 还原失败: {error_message}")
             self.after(0, lambda msg=error_message: messagebox.showerror("错误", f"还原失败: {msg}"))
         finally:
-            self.after(0, self._update_restore_button_state)
+            def done():
+                self.restore_in_progress = False
+                self._update_restore_button_state()
+            self.after(0, done)
 
     # ---------------- 杂项 ----------------
 
@@ -1613,40 +1685,89 @@ class PageManager(ctk.CTk):
         self._save_manager_config() # [修改] 保存设置
         messagebox.showinfo("OK", "周期备份设置已更新并保存")
 
-    def app_log_insert(self, text):
-        self.app_log_text.configure(state='normal')
-        self.app_log_text.insert('end', text + '\n')
-        self.app_log_text.see('end')
-        self.app_log_text.configure(state='disabled')
+    def app_log_insert(self, text, stamp=True):
+        """stamp=False: text 已带时间戳 (引擎日志)，写文件时不再加"""
+        textbox_append(self.app_log_text, self.app_scrollback, text.split('\n'))
         if self.app_log_file_handle:
             try:
-                ts = datetime.datetime.now().strftime("[%H:%M:%S] ")
+                ts = datetime.datetime.now().strftime("[%H:%M:%S] ") if stamp else ""
                 self.app_log_file_handle.write(ts + text + '\n')
-                self.app_log_file_handle.flush()
             except: pass
 
     log_insert = app_log_insert 
 
     def on_closing(self):
-        if self.server_process and self.server_process.poll() is None:
+        running = [e for e in self.engines.values() if e.state != ServerEngine.STOPPED]
+        if running:
             if messagebox.askyesno("退出", "服务器仍在运行，确定强制退出吗？"):
-                self.safe_write_stdin("stop\n")
-                time.sleep(1)
-                try:
-                    self.server_process.terminate()
-                    time.sleep(1)
-                    if self.server_process.poll() is None:
-                         self.server_process.kill() 
-                except:
-                    pass
+                for eng in running:
+                    try:
+                        eng.stop()
+                    except RuntimeError:
+                        pass
+                    if not eng.wait_stopped(1):
+                        proc = eng.process
+                        try:
+                            proc.terminate()
+                            if not eng.wait_stopped(1): proc.kill()
+                        except Exception:
+                            pass
             else: return
         
+        self.log_index_stop_event.set()
+        if self.player_store: self.player_store.flush()
         if self.app_log_file_handle: self.app_log_file_handle.close()
-        if self.server_log_file_handle: self.server_log_file_handle.close()
         
         self.destroy()
 
+def run_search_cli(argv):
+    """命令行搜索控制台历史: python mc_server_manager_v_2.py search <关键字> [-n 条数] [--session 会话]"""
+    parser = argparse.ArgumentParser(prog="mc_server_manager_v_2.py search", description="搜索控制台历史日志")
+    parser.add_argument("query")
+    parser.add_argument("-n", "--limit", type=int, default=100)
+    parser.add_argument("--session", default=None, help="只搜索指定会话，例如 console-survival-20240101-120000")
+    args = parser.parse_args(argv)
+
+    ensure_dirs()
+    index = ConsoleLogIndex()
+    added = index.update()
+    if added: print(f"已索引 {added} 行新日志", file=sys.stderr)
+    t0 = time.perf_counter()
+    rows = index.search(args.query, limit=args.limit, session=args.session)
+    for ts, session, lineno, text in rows:
+        print(f"{ts}  [{session}#{lineno}]  {text}")
+    print(f"共 {len(rows)} 条结果，用时 {(time.perf_counter() - t0) * 1000:.1f} ms", file=sys.stderr)
+
+def run_verify_cli(argv):
+    """命令行校验备份: python mc_server_manager_v_2.py verify <服务器名> [备份名 ...] [--backup-dir 目录]"""
+    parser = argparse.ArgumentParser(prog="mc_server_manager_v_2.py verify", description="校验服务器备份的完整性")
+    parser.add_argument("server")
+    parser.add_argument("backups", nargs="*", help="要校验的备份名，省略时校验该服务器的全部备份")
+    parser.add_argument("--backup-dir", default=os.path.abspath(BACKUP_DIR))
+    parser.add_argument("-j", "--jobs", type=int, default=mc_backup.VERIFY_SNAPSHOT_WORKERS, help="同时校验的备份数")
+    args = parser.parse_args(argv)
+
+    folder = os.path.join(args.backup_dir, args.server)
+    names = args.backups or sorted(i.name for i in mc_backup.backup_index(folder).snapshots())
+    bad = 0
+    # 多个备份并行校验，结果仍按名称顺序输出
+    for path, checked, errors, elapsed in mc_backup.verify_snapshots([os.path.join(folder, n) for n in names], args.jobs):
+        name = os.path.basename(path)
+        mc_backup.record_verify(path, errors)
+        status = "OK" if not errors else "FAILED"
+        print(f"{status:6}  {name}  ({checked} 个文件，{elapsed:.1f} 秒)")
+        for err in errors:
+            print(f"        {err}")
+        bad += bool(errors)
+    print(f"共校验 {len(names)} 个备份，{bad} 个有问题", file=sys.stderr)
+    return 1 if bad else 0
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "search":
+        run_search_cli(sys.argv[2:])
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "verify":
+        sys.exit(run_verify_cli(sys.argv[2:]))
     ensure_dirs()
     app = PageManager()
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,7 @@
+# conftest.py
+"""测试直接导入 test/ 下的模块 (与 python mc_daemon.py 等脚本的运行方式一致)"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
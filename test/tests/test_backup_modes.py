@@ -0,0 +1,95 @@
+# test_backup_modes.py
+"""每种备份模式的往返：连续两次 run_backup，再用 restore_backup 分别还原回两个时间点"""
+
+import itertools
+import os
+import struct
+
+import pytest
+
+import mc_core
+from mc_backup import (DELTA_SUFFIX, MANIFEST_SUFFIX, MODE_ARCHIVE, MODE_DEDUP, MODE_DELTA, MODE_FULL,
+                       MODE_INCREMENTAL, REGION_HEADER, REGION_SECTOR, SNAPSHOT_OFF, verify_snapshot)
+from mc_core import BackupSettings, list_backups, restore_backup, run_backup
+
+MODES = [MODE_FULL, MODE_INCREMENTAL, MODE_DEDUP, MODE_ARCHIVE, MODE_DELTA]
+CHUNK_TIME = 1700000000  # 早于测试快照名中的时间
+
+
+def region(chunks, saved=CHUNK_TIME):
+    """chunks: {区块序号: 数据} -> 每个区块占一个扇区的区域文件；saved 为区块的保存时间"""
+    data = bytearray(REGION_HEADER + len(chunks) * REGION_SECTOR)
+    for n, (i, payload) in enumerate(sorted(chunks.items())):
+        off = REGION_HEADER // REGION_SECTOR + n
+        data[i * 4:i * 4 + 4] = off.to_bytes(3, "big") + b"\x01"
+        data[REGION_SECTOR + i * 4:REGION_SECTOR + i * 4 + 4] = struct.pack(">I", saved)
+        data[off * REGION_SECTOR:off * REGION_SECTOR + len(payload)] = payload
+    return bytes(data)
+
+
+def apply(root, files):
+    for rel, data in files.items():
+        p = root / rel
+        if data is None:
+            p.unlink()
+            continue
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(data)
+
+
+def tree(root):
+    out = {}
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for n in files:
+            p = os.path.join(dirpath, n)
+            with open(p, 'rb') as f:
+                out[os.path.relpath(p, root).replace(os.sep, "/")] = f.read()
+    return out
+
+
+@pytest.fixture
+def stamps(monkeypatch):
+    """快照名精确到秒：测试中按顺序给出不同的时间"""
+    seq = (f"20240301-10{m:02d}00" for m in itertools.count())
+    monkeypatch.setattr(mc_core, "timestamp_str", lambda: next(seq))
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_backup_restore_round_trip(tmp_path, stamps, mode):
+    server = tmp_path / "servers" / "alpha"
+    apply(server, {"server.properties": b"level-name=world\n", "world/level.dat": b"level-1",
+                   "world/region/r.0.0.mca": region({0: b"a" * 100, 1: b"b" * 100}),
+                   "world/playerdata/p1.dat": b"p1", "world_nether/DIM-1/region/r.0.0.mca": region({0: b"n"})})
+    settings = BackupSettings(str(tmp_path / "backups"), mode, snapshot_backend=SNAPSHOT_OFF)
+    log = []
+    first = run_backup(str(server), "manual", settings, log.append)
+    state1 = tree(server)
+
+    apply(server, {"world/level.dat": b"level-2", "world/region/r.0.0.mca": region({0: b"a" * 100, 1: b"B" * 100}, CHUNK_TIME + 60),
+                   "world/playerdata/p1.dat": None, "world/playerdata/p2.dat": b"p2"})
+    second = run_backup(str(server), "manual", settings, log.append)
+    state2 = tree(server)
+    assert first and second and first != second, log
+    assert not [m for m in log if "❌" in m]
+
+    dest = settings.dest_dir(str(server))
+    assert [b["name"] for b in list_backups(settings.backup_root, "alpha")] == [second, first]
+    for name in (first, second):
+        _, errors = verify_snapshot(os.path.join(dest, name))
+        assert errors == []
+    if mode == MODE_DEDUP:
+        assert second.endswith(MANIFEST_SUFFIX)
+    if mode in (MODE_INCREMENTAL, MODE_DELTA):
+        # 未变化的文件硬链接到上一个快照
+        a = os.stat(os.path.join(dest, first, "world_nether", "DIM-1", "region", "r.0.0.mca"))
+        b = os.stat(os.path.join(dest, second, "world_nether", "DIM-1", "region", "r.0.0.mca"))
+        assert a.st_ino == b.st_ino
+    if mode == MODE_DELTA:
+        assert os.path.exists(os.path.join(dest, second, "world", "region", "r.0.0.mca" + DELTA_SUFFIX))
+
+    apply(server, {"world/level.dat": b"level-3", "world/playerdata/p3.dat": b"p3"})
+    for name, expected in ((second, state2), (first, state1)):
+        stopped = restore_backup(str(server), os.path.join(dest, name), name, log.append)
+        assert stopped is False
+        assert tree(server) == expected, mode
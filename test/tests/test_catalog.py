@@ -0,0 +1,73 @@
+# test_catalog.py
+"""备份目录 (catalog)：记录/合并/删除、跨实例读取、半行与压缩重写，以及列表页的合并结果"""
+
+import json
+
+import mc_backup
+from mc_backup import CATALOG_NAME, BackupCatalog, CopyStats, record_snapshot, record_verify
+from mc_core import list_backups
+
+NAME = "backup-20240301-101500_manual"
+
+
+def test_record_merges_fields_and_forget_removes(tmp_path):
+    cat = BackupCatalog(str(tmp_path))
+    cat.record(NAME, files=3, bytes=100)
+    cat.record(NAME, verified="ok")
+    cat.record("backup-20240301-111500_manual", files=1)
+    assert cat.get(NAME) == {"name": NAME, "files": 3, "bytes": 100, "verified": "ok"}
+    cat.forget([NAME])
+    assert cat.get(NAME) is None
+    assert list(cat.entries()) == ["backup-20240301-111500_manual"]
+
+
+def test_other_instance_sees_appended_records(tmp_path):
+    a, b = BackupCatalog(str(tmp_path)), BackupCatalog(str(tmp_path))
+    a.record(NAME, files=3)
+    assert b.get(NAME)["files"] == 3
+    b.record(NAME, verified="failed")
+    assert a.get(NAME)["verified"] == "failed"
+    b.forget([NAME])
+    assert a.entries() == {}
+
+
+def test_partial_line_is_read_later(tmp_path):
+    cat = BackupCatalog(str(tmp_path))
+    line = json.dumps({"name": NAME, "files": 7})
+    path = tmp_path / CATALOG_NAME
+    path.write_text(line[:10])
+    assert cat.entries() == {}
+    path.write_text(line + "\nnot json\n")
+    assert cat.get(NAME) == {"name": NAME, "files": 7}
+
+
+def test_compaction_rewrites_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(mc_backup, "CATALOG_COMPACT_MIN", 4)
+    cat = BackupCatalog(str(tmp_path))
+    names = [f"backup-20240301-1000{i:02d}_manual" for i in range(10)]
+    for n in names:
+        cat.record(n, files=1)
+    cat.forget(names[:8])
+    lines = (tmp_path / CATALOG_NAME).read_text().splitlines()
+    assert sorted(json.loads(l)["name"] for l in lines) == names[8:]
+    # 另一个实例在文件变短后重新读取
+    assert sorted(BackupCatalog(str(tmp_path)).entries()) == names[8:]
+    cat.record(names[0], files=2)
+    assert sorted(cat.entries()) == sorted([names[0]] + names[8:])
+
+
+def test_list_backups_reads_catalog(tmp_path):
+    folder = tmp_path / "alpha"
+    (folder / NAME).mkdir(parents=True)
+    (folder / "backup-20240301-091500_startup.tar.gz").write_bytes(b"")
+    stats = CopyStats()
+    stats.add_copied(40, files=2)
+    stats.add_linked(60)
+    record_snapshot(str(folder), NAME, ["world"], stats)
+    record_verify(str(folder / NAME), [])
+    rows = list_backups(str(tmp_path), "alpha")
+    assert [r["name"] for r in rows] == [NAME, "backup-20240301-091500_startup.tar.gz"]
+    assert rows[0]["files"] == 3 and rows[0]["bytes"] == 100 and rows[0]["worlds"] == ["world"]
+    assert rows[0]["verified"] == "ok" and rows[0]["kind"] == "dir"
+    assert rows[1]["kind"] == "archive" and rows[1]["bytes"] is None
+    assert mc_backup.backup_catalog(str(folder)).get(NAME)["new_bytes"] == 40
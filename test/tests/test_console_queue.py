@@ -0,0 +1,99 @@
+# test_console_queue.py
+"""LineBatchQueue：高水位丢弃、重要行保留、丢弃计数与唤醒/rearm"""
+
+import pytest
+
+from mc_core import LineBatchQueue, decode_console_batch, is_state_line
+
+
+def noise(n, prefix=b"noise"):
+    return [b"%s %d" % (prefix, i) for i in range(n)]
+
+
+def test_sheds_oldest_lines_down_to_half_high_water():
+    q = LineBatchQueue(1000)
+    q.put_lines(noise(1001))
+    assert q.qsize() == 500
+    assert q.dropped_total == 501
+    lines = q.drain(10_000)
+    assert lines[0] == b"noise 501" and lines[-1] == b"noise 1000"
+
+
+def test_take_dropped_reports_once():
+    q = LineBatchQueue(1000)
+    q.put_lines(noise(1500))
+    assert q.take_dropped() == 1000
+    assert q.take_dropped() == 0
+    assert q.dropped_total == 1000
+
+
+@pytest.mark.parametrize("line", [
+    b'[12:00:00 INFO]: Done (3.2s)! For help, type "help"',
+    b"[12:00:00 INFO]: Steve joined the game",
+    b"[12:00:00 INFO]: Steve left the game",
+    b"[12:00:00 INFO]: There are 1 of a max of 20 players online: Steve",
+    b"[12:00:00 INFO]: Saved the game",
+    b"[12:00:00 WARN]: Can't keep up! Is the server overloaded? Running 2500ms or 50 ticks behind",
+])
+def test_state_lines_survive_shedding(line):
+    assert is_state_line(line) and is_state_line(line.decode())
+    q = LineBatchQueue(1000, keep=is_state_line)
+    q.put_lines(noise(300) + [line] + noise(3000, b"later"))
+    lines = q.drain(100_000)
+    assert line in lines
+    # 保留的行仍在原来的相对位置：在所有幸存的后续行之前
+    assert lines.index(line) < lines.index(b"later 2999")
+
+
+@pytest.mark.parametrize("line", [
+    b"[12:00:00 INFO]: Preparing spawn area: 42%",
+    "[12:00:00 INFO]: <Steve> hi",
+    b"[12:00:00 INFO]: [SomePlugin] Done loading 42 regions",
+    "[12:00:00 INFO]: <Steve> Done (finally)",
+    b"[12:00:00 INFO]: For help with claims, type /claim help",
+])
+def test_ordinary_lines_are_not_state_lines(line):
+    assert not is_state_line(line)
+
+
+def test_kept_lines_are_capped():
+    # 刷屏的行全部命中关键字时，队列长度仍受高水位限制，只保留最新的重要行
+    q = LineBatchQueue(1000, keep=is_state_line)
+    flood = [b"[12:00:00 INFO]: Bot%d joined the game" % i for i in range(5000)]
+    for i in range(0, len(flood), 100):
+        q.put_lines(flood[i:i + 100])
+        assert q.qsize() <= q.high_water
+    lines = q.drain(100_000)
+    assert lines[-1] == flood[-1]
+    assert lines == flood[-len(lines):]
+    assert q.dropped_total == len(flood) - len(lines)
+
+
+def test_notify_once_until_rearm():
+    calls = []
+    q = LineBatchQueue(1000, notify=lambda: calls.append(1))
+    q.put(b"a")
+    q.put(b"b")
+    assert len(calls) == 1
+    q.drain(1)
+    assert q.rearm() is True  # 还有积压：界面继续取，不需要新的唤醒
+    q.put(b"c")
+    assert len(calls) == 1
+    q.drain(10)
+    assert q.rearm() is False
+    q.put(b"d")
+    assert len(calls) == 2
+
+
+def test_reset_wakeup_allows_renotify():
+    calls = []
+    q = LineBatchQueue(1000, notify=lambda: calls.append(1))
+    q.put(b"a")
+    q.reset_wakeup()  # 投递唤醒失败
+    q.put(b"b")
+    assert len(calls) == 2
+
+
+def test_decode_console_batch_mixes_bytes_and_text():
+    batch = ["中文".encode("utf-8"), b"plain", "> say hi", b"\xff broken"]
+    assert decode_console_batch(batch) == ["中文", "plain", "> say hi", "� broken"]
@@ -0,0 +1,78 @@
+# test_console_reader.py
+"""按块读取服务器输出：行跨块拼接、CRLF 归一、超长行与末尾残行，原始字节原样写盘、解码推迟到界面"""
+
+import os
+
+import pytest
+
+import mc_core
+from mc_core import LineBatchQueue, ServerEngine, decode_console_batch
+
+
+class FakeProc:
+    def __init__(self, data):
+        r, w = os.pipe()
+        os.write(w, data)
+        os.close(w)
+        self.stdout = os.fdopen(r, "rb")
+
+
+class FakeWriter:
+    def __init__(self):
+        self.raw = b""
+
+    def write_bytes(self, data):
+        self.raw += data
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """每次 os.read 最多 64 字节，行与多字节字符都会落在块边界上"""
+    monkeypatch.setattr(mc_core, "READ_CHUNK_BYTES", 64)
+
+
+def read_all(tmp_path, data):
+    eng = ServerEngine(str(tmp_path), console_queue=LineBatchQueue(10 ** 6))
+    writer = FakeWriter()
+    eng._read_console(FakeProc(data), writer)
+    items = eng.console_queue.drain(10 ** 6)
+    return items, writer.raw
+
+
+def test_lines_split_across_chunks_are_joined(tmp_path, small_chunks):
+    data = "".join(f"[12:00:{i:02d} INFO]: 玩家 Steve 说 第{i}行\n" for i in range(20)).encode()
+    items, raw = read_all(tmp_path, data)
+    assert all(isinstance(x, bytes) for x in items)  # 读取线程不解码
+    assert decode_console_batch(items) == data.decode().splitlines()
+    assert raw == data
+
+
+def test_crlf_is_normalised_but_logged_verbatim(tmp_path, small_chunks):
+    data = b"first line\r\nsecond\r\n\r\nfourth\n"
+    items, raw = read_all(tmp_path, data)
+    assert items == [b"first line", b"second", b"", b"fourth"]
+    assert raw == data
+
+
+def test_line_longer_than_a_chunk_is_not_stuck(tmp_path, small_chunks):
+    long_line = b"x" * 150  # 攒满一块仍没有换行时按块输出，读取线程不会无限积攒
+    items, raw = read_all(tmp_path, long_line + b"\nafter\n")
+    assert b"".join(items[:-1]) == long_line and items[-1] == b"after"
+    assert raw == long_line + b"\nafter\n"
+
+
+def test_trailing_partial_line_is_flushed_at_eof(tmp_path, small_chunks):
+    items, raw = read_all(tmp_path, b"complete\nno newline  ")
+    assert items == [b"complete", b"no newline"]
+    assert raw == b"complete\nno newline  \n"
+
+
+def test_default_chunk_size_reads_large_output(tmp_path):
+    data = b"".join(b"[12:00:00 INFO]: chunk %d loaded\n" % i for i in range(1000))
+    items, raw = read_all(tmp_path, data)
+    assert len(items) == 1000 and raw == data
+
+
+def test_decode_replaces_invalid_bytes():
+    assert decode_console_batch([b"ok \xff\xfe", "管理器插入的行", "玩家".encode()]) == ["ok ��",
+                                                                                     "管理器插入的行", "玩家"]
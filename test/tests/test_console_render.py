@@ -0,0 +1,61 @@
+# test_console_render.py
+"""按帧取用控制台：ServerEngine.pump_console 按行数上限与时间预算分批取出队列并 publish"""
+
+import itertools
+
+from mc_core import LineBatchQueue, ServerEngine, is_state_line
+
+
+def engine(tmp_path, high_water=100000):
+    return ServerEngine(str(tmp_path), console_queue=LineBatchQueue(high_water, keep=is_state_line))
+
+
+def flood(eng, n):
+    eng.console_queue.put_lines([f"[12:00:00 INFO]: chunk {i}".encode() for i in range(n)])
+
+
+def test_pump_drains_everything_within_budget(tmp_path):
+    eng = engine(tmp_path)
+    flood(eng, 1200)
+    seen = []
+    eng.subscribe(lambda kind, data: kind == "console" and seen.append(len(data)))
+    lines, taken = eng.pump_console(5000, float("inf"))
+    assert taken == len(lines) == 1200
+    assert lines[0] == "[12:00:00 INFO]: chunk 0" and lines[-1].endswith("chunk 1199")
+    assert seen == [512, 512, 176]  # 按批 publish，而不是逐行
+    assert eng.console_queue.empty()
+
+
+def test_pump_stops_at_line_cap_and_keeps_the_rest_queued(tmp_path):
+    eng = engine(tmp_path)
+    flood(eng, 20000)
+    lines, taken = eng.pump_console(5000, float("inf"))
+    assert taken == len(lines) == 5000
+    assert eng.console_queue.qsize() == 15000
+    assert eng.console_queue.rearm()  # 仍有积压：界面应立即安排下一轮
+    lines, _ = eng.pump_console(5000, float("inf"))
+    assert lines[0].endswith("chunk 5000")
+
+
+def test_pump_stops_when_frame_budget_is_spent(tmp_path):
+    eng = engine(tmp_path)
+    flood(eng, 5000)
+    ticks = itertools.count()
+    # 假时钟：每批之前检查一次，第三次检查时已超出预算
+    lines, taken = eng.pump_console(5000, 2, clock=lambda: next(ticks))
+    assert taken == len(lines) == 1024
+    assert eng.console_queue.qsize() == 5000 - 1024
+
+
+def test_pump_publishes_state_lines_even_under_flood(tmp_path):
+    eng = engine(tmp_path, high_water=1000)
+    flood(eng, 3000)
+    eng.console_queue.put_lines([b"[12:00:00 INFO]: Steve joined the game"])
+    flood(eng, 3000)
+    total = 0
+    while True:
+        lines, taken = eng.pump_console(5000, float("inf"))
+        if not taken: break
+        total += taken
+    assert total < 6001 and eng.console_queue.take_dropped() == 6001 - total
+    assert eng.status()["players"] == ["Steve"]
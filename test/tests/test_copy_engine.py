@@ -0,0 +1,88 @@
+# test_copy_engine.py
+"""并行零拷贝复制：内容与元数据、零拷贝失败时的回退、忽略规则，以及增量硬链接不改写旧快照"""
+
+import errno
+import os
+
+import pytest
+
+import mc_backup
+from mc_backup import CopyStats, copy_file, copy_tree
+
+
+def fail_after(n_ok, err):
+    """第一次调用正常复制 n_ok 字节后抛出 err，模拟零拷贝写到一半才发现不支持"""
+    calls = []
+
+    def fake(*args):
+        calls.append(args)
+        if len(calls) == 1 and n_ok:
+            return n_ok
+        raise OSError(err, os.strerror(err))
+    return fake, calls
+
+
+def test_copy_file_keeps_content_and_mtime(tmp_path):
+    src, dst = tmp_path / "a.bin", tmp_path / "b.bin"
+    data = os.urandom(300_000)
+    src.write_bytes(data)
+    os.utime(src, (1_600_000_000, 1_600_000_000))
+    copy_file(str(src), str(dst))
+    assert dst.read_bytes() == data
+    assert os.stat(dst).st_mtime == 1_600_000_000
+    empty = tmp_path / "empty"
+    empty.write_bytes(b"")
+    copy_file(str(empty), str(tmp_path / "empty2"))
+    assert (tmp_path / "empty2").read_bytes() == b""
+
+
+@pytest.mark.parametrize("err", [errno.EXDEV, errno.ENOSYS, errno.ENOTSOCK])
+def test_zero_copy_falls_back_to_read_write(tmp_path, monkeypatch, err):
+    src, dst = tmp_path / "a.bin", tmp_path / "b.bin"
+    data = os.urandom(200_000)
+    src.write_bytes(data)
+    dst.write_bytes(b"stale" * 100_000)  # 比源文件长：回退前必须截断
+    for name in ("copy_file_range", "sendfile"):
+        fake, _ = fail_after(4096, err)
+        monkeypatch.setattr(os, name, fake, raising=False)
+    with open(src, 'rb') as fsrc, open(dst, 'r+b') as fdst:
+        assert mc_backup._zero_copy(fsrc.fileno(), fdst.fileno(), len(data)) is False
+        assert os.fstat(fdst.fileno()).st_size == 0
+        assert os.lseek(fsrc.fileno(), 0, os.SEEK_CUR) == 0
+    copy_file(str(src), str(dst))
+    assert dst.read_bytes() == data
+
+
+def test_zero_copy_propagates_real_errors(tmp_path, monkeypatch):
+    src = tmp_path / "a.bin"
+    src.write_bytes(b"x" * 10)
+    fake, _ = fail_after(0, errno.EIO)
+    monkeypatch.setattr(os, "copy_file_range", fake, raising=False)
+    monkeypatch.setattr(mc_backup, "_ZERO_COPY_FUNCS", ("copy_file_range",))
+    with pytest.raises(OSError):
+        copy_file(str(src), str(tmp_path / "b.bin"))
+
+
+def test_copy_tree_ignores_and_links_unchanged(tmp_path):
+    src = tmp_path / "src"
+    (src / "region").mkdir(parents=True)
+    (src / "region" / "r.0.0.mca").write_bytes(b"r" * 5000)
+    (src / "level.dat").write_bytes(b"level")
+    (src / "session.lock").write_bytes(b"lock")
+    first = tmp_path / "snap1"
+    stats = copy_tree(str(src), str(first), ignore_patterns=("session.lock",))
+    assert stats.copied_files == 2 and not (first / "session.lock").exists()
+
+    (src / "level.dat").write_bytes(b"level-2")
+    second = tmp_path / "snap2"
+    stats = copy_tree(str(src), str(second), ignore_patterns=("session.lock",), prev=str(first), stats=CopyStats())
+    assert stats.linked_files == 1 and stats.copied_files == 1
+    assert os.stat(second / "region" / "r.0.0.mca").st_ino == os.stat(first / "region" / "r.0.0.mca").st_ino
+    assert (second / "level.dat").read_bytes() == b"level-2"
+    assert (first / "level.dat").read_bytes() == b"level"
+
+    # 目标已经是指向旧快照的硬链接时，重新复制不能原地截断旧快照的文件
+    (src / "region" / "r.0.0.mca").write_bytes(b"R" * 6000)
+    copy_tree(str(src), str(second))
+    assert (second / "region" / "r.0.0.mca").read_bytes() == b"R" * 6000
+    assert (first / "region" / "r.0.0.mca").read_bytes() == b"r" * 5000
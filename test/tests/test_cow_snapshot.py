@@ -0,0 +1,149 @@
+# test_cow_snapshot.py
+"""写时复制快照：reflink / btrfs 子卷两种后端、不支持时的清理与退回，以及快照后立即 save-on 的备份"""
+
+import errno
+import os
+import shutil
+import subprocess
+import types
+
+import pytest
+
+import mc_backup
+from mc_backup import SNAPSHOT_AUTO, SNAPSHOT_DIR_NAME, take_cow_snapshot
+from mc_core import BackupSettings, list_backups, run_backup
+
+
+def fake_fcntl(calls):
+    """代替 fcntl：FICLONE 时把源文件内容复制到目标 (效果等同克隆)"""
+    def ioctl(fd, request, src_fd):
+        assert request == mc_backup.FICLONE
+        calls.append(request)
+        os.lseek(src_fd, 0, os.SEEK_SET)
+        while True:
+            block = os.read(src_fd, 65536)
+            if not block: break
+            os.write(fd, block)
+    return types.SimpleNamespace(ioctl=ioctl)
+
+
+def no_reflink():
+    def ioctl(fd, request, src_fd):
+        raise OSError(errno.EOPNOTSUPP, "Operation not supported")
+    return types.SimpleNamespace(ioctl=ioctl)
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / "servers" / "alpha"
+    for rel, data in {"world/level.dat": b"level", "world/region/r.0.0.mca": b"region-v1",
+                      "world_nether/DIM-1/region/r.0.0.mca": b"nether", "world/session.lock": b"lock",
+                      "server.properties": b"level-name=world\n"}.items():
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(data)
+    return root
+
+
+def read_tree(root):
+    out = {}
+    for dirpath, dirs, files in os.walk(root):
+        for n in files:
+            p = os.path.join(dirpath, n)
+            with open(p, 'rb') as f:
+                out[os.path.relpath(p, root).replace(os.sep, "/")] = f.read()
+    return out
+
+
+def test_reflink_snapshot_of_targets(server, monkeypatch):
+    calls = []
+    monkeypatch.setattr(mc_backup, "fcntl", fake_fcntl(calls))
+    snap = take_cow_snapshot(str(server), ["world", "world_nether"], "backup-1", ("session.lock",))
+    assert snap and snap.describe() == "reflink"
+    assert snap.root == os.path.join(str(server), SNAPSHOT_DIR_NAME, "backup-1")
+    assert read_tree(snap.root) == {"world/level.dat": b"level", "world/region/r.0.0.mca": b"region-v1",
+                                    "world_nether/DIM-1/region/r.0.0.mca": b"nether"}
+    assert len(calls) == 3
+    assert snap.discard()
+    assert not (server / SNAPSHOT_DIR_NAME).exists()
+
+
+def test_whole_directory_snapshot_skips_itself(server, monkeypatch):
+    monkeypatch.setattr(mc_backup, "fcntl", fake_fcntl([]))
+    (server / SNAPSHOT_DIR_NAME / "stale").mkdir(parents=True)
+    snap = take_cow_snapshot(str(server), None, "backup-2")
+    assert SNAPSHOT_DIR_NAME not in os.listdir(snap.root)
+    assert read_tree(snap.root)["server.properties"] == b"level-name=world\n"
+    snap.discard()
+
+
+@pytest.mark.parametrize("fcntl", [None, no_reflink()])
+def test_unsupported_filesystem_returns_none_and_cleans_up(server, monkeypatch, fcntl):
+    monkeypatch.setattr(mc_backup, "fcntl", fcntl)
+    assert take_cow_snapshot(str(server), ["world"], "backup-3") is None
+    assert not (server / SNAPSHOT_DIR_NAME).exists()
+
+
+def fake_btrfs(monkeypatch, subvolumes, snapshot_ok=True):
+    """把 subvolumes 中的目录当作 btrfs 子卷；btrfs 命令用复制/删除目录模拟"""
+    commands = []
+    monkeypatch.setattr(mc_backup, "_is_btrfs_subvolume", lambda p: os.path.basename(p) in subvolumes)
+
+    def run(cmd, **kwargs):
+        commands.append(cmd[:3])
+        if cmd[:3] == ["btrfs", "subvolume", "snapshot"]:
+            if not snapshot_ok:
+                return subprocess.CompletedProcess(cmd, 1)
+            shutil.copytree(cmd[-2], cmd[-1])
+        elif cmd[:3] == ["btrfs", "subvolume", "delete"]:
+            shutil.rmtree(cmd[-1])
+        return subprocess.CompletedProcess(cmd, 0)
+    monkeypatch.setattr(mc_backup.subprocess, "run", run)
+    return commands
+
+
+def test_btrfs_subvolume_and_reflink_mixed(server, monkeypatch):
+    monkeypatch.setattr(mc_backup, "fcntl", fake_fcntl([]))
+    commands = fake_btrfs(monkeypatch, {"world"})
+    snap = take_cow_snapshot(str(server), ["world", "world_nether"], "backup-4")
+    assert snap.describe() == "btrfs + reflink"
+    assert snap.subvolumes == [os.path.join(snap.root, "world")]
+    assert read_tree(os.path.join(snap.root, "world_nether")) == {"DIM-1/region/r.0.0.mca": b"nether"}
+    assert snap.discard()
+    assert commands == [["btrfs", "subvolume", "snapshot"], ["btrfs", "subvolume", "delete"]]
+
+
+def test_failed_btrfs_snapshot_falls_back_to_reflink(server, monkeypatch):
+    monkeypatch.setattr(mc_backup, "fcntl", fake_fcntl([]))
+    fake_btrfs(monkeypatch, {"world"}, snapshot_ok=False)
+    snap = take_cow_snapshot(str(server), ["world"], "backup-5")
+    assert snap.describe() == "reflink" and snap.subvolumes == []
+    snap.discard()
+
+
+@pytest.mark.parametrize("fcntl", [fake_fcntl([]), None])
+def test_backup_releases_after_snapshot_and_ignores_later_writes(tmp_path, server, monkeypatch, fcntl):
+    monkeypatch.setattr(mc_backup, "fcntl", fcntl)
+    backups = tmp_path / "backups"
+    settings = BackupSettings(str(backups), mode=mc_backup.MODE_FULL, snapshot_backend=SNAPSHOT_AUTO)
+    region = server / "world" / "region" / "r.0.0.mca"
+    released = []
+
+    def release():
+        # save-on 之后服务器立即改写区域文件
+        released.append(list_backups(str(backups), "alpha"))
+        region.write_bytes(b"region-v2")
+    logs = []
+    name = run_backup(str(server), "manual", settings, logs.append, release=release)
+    assert name and len(released) == 1
+    snapshot = backups / "alpha" / name
+    if fcntl:
+        # 快照完成即恢复写入 (此时备份尚未写完)，备份内容仍是快照时的状态
+        assert released == [[]]
+        assert (snapshot / "world" / "region" / "r.0.0.mca").read_bytes() == b"region-v1"
+        assert any("写时复制快照完成" in line for line in logs)
+    else:
+        # 不支持快照：整个备份期间保持 save-off，备份结束后才恢复
+        assert len(released[0]) == 1
+        assert any("不支持写时复制快照" in line for line in logs)
+    assert not (server / SNAPSHOT_DIR_NAME).exists()
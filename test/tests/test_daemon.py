@@ -0,0 +1,126 @@
+# test_daemon.py
+"""守护进程的请求检查：口令、跨站 Origin、无口令时的 Host (DNS 重绑定) 与 POST 的 Content-Type"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from mc_backup import stage_restore, swap_in_restore
+from mc_daemon import Daemon
+
+ORIGIN = "http://localhost:3000"
+
+
+def request(daemon, method, path, headers=(), body=b""):
+    """向临时端口上的守护进程发送一个原始 HTTP 请求，返回 (状态码, JSON)"""
+    async def run():
+        server = await asyncio.start_server(daemon.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            head = [f"{method} {path} HTTP/1.1", f"Content-Length: {len(body)}", *headers]
+            if not any(h.lower().startswith("host:") for h in headers):
+                head.append(f"Host: 127.0.0.1:{port}")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+        status = int(data.split(b" ", 2)[1])
+        payload = data.split(b"\r\n\r\n", 1)[1]
+        return status, json.loads(payload) if payload else None
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    (tmp_path / "servers" / "alpha").mkdir(parents=True)
+    return Daemon(str(tmp_path / "servers"), str(tmp_path / "backups"), token="s3cret", cors_origin=ORIGIN)
+
+
+AUTH = "Authorization: Bearer s3cret"
+
+
+def test_token_required(daemon):
+    assert request(daemon, "GET", "/api/servers")[0] == 401
+    assert request(daemon, "GET", "/api/servers", ["Authorization: Bearer wrong"])[0] == 401
+    status, payload = request(daemon, "GET", "/api/servers", [AUTH])
+    assert status == 200 and [s["name"] for s in payload["servers"]] == ["alpha"]
+    assert request(daemon, "GET", "/api/servers?token=s3cret")[0] == 200
+
+
+def test_foreign_origin_rejected(daemon):
+    assert request(daemon, "GET", "/api/servers", [AUTH, "Origin: https://evil.example"])[0] == 403
+    assert request(daemon, "OPTIONS", "/api/servers", ["Origin: https://evil.example"])[0] == 403
+    assert request(daemon, "GET", "/api/servers", [AUTH, f"Origin: {ORIGIN}"])[0] == 200
+    assert request(daemon, "OPTIONS", "/api/servers", [f"Origin: {ORIGIN}"])[0] == 204
+    ws = ["Upgrade: websocket", "Connection: Upgrade", "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==",
+          "Sec-WebSocket-Version: 13", "Origin: https://evil.example"]
+    assert request(daemon, "GET", "/api/servers/alpha/console?token=s3cret", ws)[0] == 403
+
+
+def test_post_requires_json_content_type(daemon):
+    body = json.dumps({"command": "say hi"}).encode()
+    status, payload = request(daemon, "POST", "/api/servers/alpha/command", [AUTH, "Content-Type: text/plain"], body)
+    assert status == 415
+    status, _ = request(daemon, "POST", "/api/servers/alpha/command",
+                        [AUTH, "Content-Type: application/json; charset=utf-8"], body)
+    assert status == 409  # 通过检查后才轮到引擎：服务器未运行
+
+
+def test_without_token_only_local_hosts(tmp_path):
+    d = Daemon(str(tmp_path), str(tmp_path / "backups"), token="", cors_origin=ORIGIN)
+    assert request(d, "GET", "/api/servers")[0] == 200
+    assert request(d, "GET", "/api/servers", ["Host: localhost:8765"])[0] == 200
+    assert request(d, "GET", "/api/servers", ["Host: [::1]:8765"])[0] == 200
+    assert request(d, "GET", "/api/servers", ["Host: attacker.example:8765"])[0] == 403
+    # 有口令时 Host 不受限制 (可以监听在局域网地址上)
+    t = Daemon(str(tmp_path), str(tmp_path / "backups"), token="s3cret", cors_origin=ORIGIN)
+    assert request(t, "GET", "/api/servers", [AUTH, "Host: 192.168.1.5:8765"])[0] == 200
+
+
+def test_selective_restore_request(daemon, tmp_path):
+    headers = [AUTH, "Content-Type: application/json"]
+    post = lambda body: request(daemon, "POST", "/api/servers/alpha/restore", headers, json.dumps(body).encode())
+    name = "backup-20240301-101500_manual"
+    snap = tmp_path / "backups" / "alpha" / name / "world" / "DIM-1" / "region"
+    snap.mkdir(parents=True)
+    (snap / "r.0.0.mca").write_text("old")
+    live = tmp_path / "servers" / "alpha" / "world" / "DIM-1" / "region"
+    live.mkdir(parents=True)
+    (live / "r.5.5.mca").write_text("new")
+
+    assert post({"backup": name, "dimension": "moon"})[0] == 400
+    assert post({"backup": name, "dimension": "nether", "box": [0, 0, 1]})[0] == 400
+    assert post({"backup": name, "players": ["Nobody"]})[0] == 400
+    daemon.engine("alpha").state = "running"
+    assert post({"backup": name, "dimension": "nether"})[0] == 409
+    daemon.engine("alpha").state = "stopped"
+    assert post({"backup": name, "dimension": "nether"})[0] == 202
+    eng = daemon.engine("alpha")
+    for _ in range(200):
+        if eng.job is None: break
+        time.sleep(0.01)
+    assert (live / "r.0.0.mca").read_text() == "old" and not (live / "r.5.5.mca").exists()
+
+
+def test_undo_request(daemon, tmp_path):
+    headers = [AUTH, "Content-Type: application/json"]
+    live = tmp_path / "servers" / "alpha"
+    assert request(daemon, "GET", "/api/servers/alpha/undo", [AUTH]) == (200, {"undo": None})
+    assert request(daemon, "POST", "/api/servers/alpha/undo", headers)[0] == 409
+
+    snap = tmp_path / "backups" / "alpha" / "backup-20240301-101500_manual"
+    (snap / "world").mkdir(parents=True)
+    (snap / "world" / "level.dat").write_text("old")
+    (live / "world").mkdir()
+    (live / "world" / "level.dat").write_text("new")
+    swap_in_restore(str(live), stage_restore(str(snap), str(live)), "测试")
+    assert request(daemon, "GET", "/api/servers/alpha/undo", [AUTH])[1]["undo"]["label"] == "测试"
+    status, payload = request(daemon, "POST", "/api/servers/alpha/undo", headers)
+    assert status == 200 and payload["undo"]["label"] == "测试" and payload["state"] == "stopped"
+    assert (live / "world" / "level.dat").read_text() == "new"
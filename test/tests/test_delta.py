@@ -0,0 +1,144 @@
+# test_delta.py
+"""区域差量：编码 / 沿基准链重建的往返，以及同一秒内原地重写的区块"""
+
+import os
+import struct
+
+from mc_backup import (DELTA_SUFFIX, REGION_HEADER, REGION_SECTOR, CopyStats, RegionDelta, _changed_ranges,
+                       _snapshot_epoch, copy_file, reconstruct_region, restore_tree)
+
+REL = "world/region/r.0.0.mca"
+SNAP_A = "backup-20240101-120000_manual"
+SNAP_B = "backup-20240101-120100_manual"
+SNAP_C = "backup-20240101-120200_manual"
+
+
+def write_region(path, chunks):
+    """chunks: {区块序号: (起始扇区, 数据, 时间戳)}，数据按扇区补齐"""
+    header = bytearray(REGION_HEADER)
+    end = REGION_HEADER // REGION_SECTOR
+    for i, (off, data, ts) in chunks.items():
+        count = -(-len(data) // REGION_SECTOR)
+        header[i * 4:i * 4 + 4] = off.to_bytes(3, "big") + bytes([count])
+        header[REGION_SECTOR + i * 4:REGION_SECTOR + i * 4 + 4] = struct.pack(">I", ts)
+        end = max(end, off + count)
+    body = bytearray(end * REGION_SECTOR)
+    body[:REGION_HEADER] = header
+    for off, data, _ in chunks.values():
+        body[off * REGION_SECTOR:off * REGION_SECTOR + len(data)] = data
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(body)
+
+
+def snap_path(dest, snapshot):
+    return os.path.join(dest, snapshot, REL.replace("/", os.sep))
+
+
+def take_delta(dest, src, base, snapshot):
+    dst = snap_path(dest, snapshot)
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    stats = CopyStats()
+    delta = RegionDelta(base)
+    assert delta.encode(src, dst, snap_path(dest, base), os.stat(src), stats)
+    delta.write_meta(os.path.join(dest, snapshot))
+    return dst, stats, delta
+
+
+def live_view(data):
+    """文件头 + 各区块占用的扇区；已释放扇区里的旧数据不参与比较 (游戏本身也不会清零)"""
+    view = [len(data), data[:REGION_HEADER]]
+    for i in range(0, REGION_SECTOR, 4):
+        off, cnt = int.from_bytes(data[i:i + 3], "big"), data[i + 3]
+        if cnt: view.append(data[off * REGION_SECTOR:(off + cnt) * REGION_SECTOR])
+    return view
+
+
+def rebuild(dest, snapshot, tmp_path):
+    out = str(tmp_path / f"out-{snapshot}.mca")
+    reconstruct_region(dest, snapshot, REL, out)
+    with open(out, 'rb') as f:
+        return live_view(f.read())
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def live(path):
+    return live_view(read(path))
+
+
+def setup_base(tmp_path, chunks):
+    dest = str(tmp_path / "backups")
+    src = str(tmp_path / "server" / "r.0.0.mca")
+    write_region(src, chunks)
+    base = snap_path(dest, SNAP_A)
+    os.makedirs(os.path.dirname(base))
+    copy_file(src, base)
+    return dest, src
+
+
+def test_changed_ranges_merges_adjacent_sectors():
+    old = bytearray(REGION_HEADER)
+    new = bytearray(REGION_HEADER)
+    for i, (off, cnt) in enumerate([(2, 1), (3, 2), (9, 1)]):
+        new[i * 4:i * 4 + 4] = off.to_bytes(3, "big") + bytes([cnt])
+    assert _changed_ranges(bytes(old), bytes(new)) == [(2, 3), (9, 1)]
+    assert _changed_ranges(bytes(new), bytes(new)) == []
+
+
+def test_delta_round_trip_through_chain(tmp_path):
+    t = _snapshot_epoch(SNAP_A) - 600
+    dest, src = setup_base(tmp_path, {0: (2, b"a" * 5000, t), 1: (4, b"b" * 100, t), 7: (5, b"c" * 100, t)})
+
+    # 第二个快照：区块 1 被改写，区块 7 搬到文件末尾并变长
+    write_region(src, {0: (2, b"a" * 5000, t), 1: (4, b"B" * 100, t + 60), 7: (6, b"C" * 9000, t + 60)})
+    dst, stats, delta = take_delta(dest, src, SNAP_A, SNAP_B)
+    assert not os.path.exists(dst) and os.path.exists(dst + DELTA_SUFFIX)
+    assert delta.bases == {SNAP_A}
+    assert os.path.getsize(dst + DELTA_SUFFIX) < os.path.getsize(src)
+    assert rebuild(dest, SNAP_B, tmp_path) == live(src)
+
+    # 第三个快照基于差量快照：重建沿 C -> B -> A 的链进行，文件变短时截断
+    write_region(src, {0: (2, b"z" * 10, t + 120)})
+    take_delta(dest, src, SNAP_B, SNAP_C)
+    assert rebuild(dest, SNAP_C, tmp_path) == live(src)
+    assert rebuild(dest, SNAP_B, tmp_path) != live(src)
+
+
+def test_unchanged_region_is_linked(tmp_path):
+    t = _snapshot_epoch(SNAP_A) - 600
+    dest, src = setup_base(tmp_path, {0: (2, b"a" * 100, t)})
+    dst, stats, delta = take_delta(dest, src, SNAP_A, SNAP_B)
+    assert os.path.exists(dst) and not os.path.exists(dst + DELTA_SUFFIX)
+    assert stats.linked_files == 1 and stats.copied_files == 0
+    assert read(dst) == read(src)
+
+
+def test_same_second_rewrite_is_not_lost(tmp_path):
+    # 区块时间戳只精确到秒：基准快照读取后的同一秒内原地重写，文件头完全不变
+    t = _snapshot_epoch(SNAP_A)
+    dest, src = setup_base(tmp_path, {0: (2, b"a" * 100, t - 600), 1: (3, b"old!" * 10, t)})
+    write_region(src, {0: (2, b"a" * 100, t - 600), 1: (3, b"new!" * 10, t)})
+    with open(src, 'rb') as f, open(snap_path(dest, SNAP_A), 'rb') as g:
+        assert f.read(REGION_HEADER) == g.read(REGION_HEADER)
+    dst, _, _ = take_delta(dest, src, SNAP_A, SNAP_B)
+    assert os.path.exists(dst + DELTA_SUFFIX)
+    assert rebuild(dest, SNAP_B, tmp_path) == live(src)
+
+
+def test_restore_tree_rebuilds_deltas(tmp_path):
+    t = _snapshot_epoch(SNAP_A) - 600
+    dest, src = setup_base(tmp_path, {0: (2, b"a" * 100, t)})
+    write_region(src, {0: (2, b"b" * 100, t + 60)})
+    take_delta(dest, src, SNAP_A, SNAP_B)
+    level = os.path.join(dest, SNAP_B, "world", "level.dat")
+    with open(level, 'wb') as f:
+        f.write(b"level")
+    out = tmp_path / "restored"
+    restore_tree(os.path.join(dest, SNAP_B), "world", str(out), CopyStats())
+    assert read(out / "region" / "r.0.0.mca") == read(src)
+    assert read(out / "level.dat") == b"level"
+    assert not list(out.rglob("*" + DELTA_SUFFIX))
@@ -0,0 +1,65 @@
+# test_engine_console.py
+"""ServerEngine 的控制台发布：多个线程同时 publish 时分类、名册与最近输出保持一致"""
+
+import sys
+import threading
+
+import pytest
+
+from mc_core import ServerEngine
+
+THREADS = 8
+ROUNDS = 200
+
+
+@pytest.fixture(autouse=True)
+def busy_switching():
+    """频繁切换线程，让未加锁的交错更容易出现"""
+    old = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(old)
+
+
+def test_concurrent_publish_keeps_roster_and_console_consistent(tmp_path):
+    eng = ServerEngine(str(tmp_path))
+    eng.console = eng.console.__class__(maxlen=THREADS * ROUNDS * 3)
+    seen = []
+    eng.subscribe(lambda kind, data: kind == "console" and seen.extend(data))
+    start = threading.Barrier(THREADS)
+
+    def producer(i):
+        start.wait()
+        for r in range(ROUNDS):
+            eng.publish([f"[12:00:00 INFO]: P{i} joined the game".encode(), f"> say {i}-{r}"])
+            if r % 2: eng.publish([f"[12:00:00 INFO]: P{i} left the game"])
+
+    workers = [threading.Thread(target=producer, args=(i,)) for i in range(THREADS)]
+    for t in workers: t.start()
+    for t in workers: t.join()
+    assert eng.status()["players"] == sorted(eng.roster.names) == []
+    assert len(eng.console) == len(seen) == THREADS * ROUNDS * 2 + THREADS * ROUNDS // 2
+    assert list(eng.console) == seen  # 事件顺序与控制台缓冲一致
+
+
+def test_subscribe_with_backlog_has_no_gap_or_overlap(tmp_path):
+    eng = ServerEngine(str(tmp_path))
+    eng.console = eng.console.__class__(maxlen=100000)
+    stop = threading.Event()
+
+    def producer():
+        n = 0
+        while not stop.is_set():
+            eng.publish([f"line {n}"])
+            n += 1
+    t = threading.Thread(target=producer)
+    t.start()
+    try:
+        later = []
+        backlog = eng.subscribe_with_backlog(lambda kind, data: kind == "console" and later.extend(data))
+        while len(later) < 50: pass
+    finally:
+        stop.set()
+        t.join()
+    got = [int(line.split()[1]) for line in backlog + later]
+    assert got == list(range(len(got)))
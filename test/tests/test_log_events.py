@@ -0,0 +1,78 @@
+# test_log_events.py
+"""LineClassifier：规则优先级、事件数据解析与订阅分发"""
+
+import pytest
+
+from mc_log_events import (LineClassifier, LineRule, strip_ansi, EVENT_CHAT, EVENT_JOIN, EVENT_LEAVE, EVENT_LIST,
+                           EVENT_STARTUP_DONE, EVENT_SAVED, EVENT_TPS, EVENT_LAG, EVENT_WARN, EVENT_ERROR)
+
+
+@pytest.fixture
+def classifier():
+    return LineClassifier()
+
+
+@pytest.mark.parametrize("line, kind, data", [
+    ("[12:00:00 INFO]: Steve joined the game", EVENT_JOIN, {"player": "Steve"}),
+    ("[12:00:00 INFO]: Steve left the game", EVENT_LEAVE, {"player": "Steve"}),
+    ("[12:00:00 INFO]: There are 2 of a max of 20 players online: Steve, Alex", EVENT_LIST,
+     {"players": ["Steve", "Alex"]}),
+    ("[12:00:00 INFO]: There are 0 of a max of 20 players online: ", EVENT_LIST, {"players": []}),
+    ('[12:00:00 INFO]: Done (3.21s)! For help, type "help"', EVENT_STARTUP_DONE, {"seconds": 3.21}),
+    ('[12:00:00 INFO]: Done (3,5s)! For help, type "help"', EVENT_STARTUP_DONE, {"seconds": 3.5}),
+    ("[12:00:00 INFO]: Saved the game", EVENT_SAVED, {}),
+    ("[12:00:00 INFO]: TPS from last 1m, 5m, 15m: *19.5, 20.0, 20.0", EVENT_TPS, {"tps": [19.5, 20.0, 20.0]}),
+    ("[12:00:00 WARN]: Can't keep up! Is the server overloaded? Running 5012ms or 100 ticks behind", EVENT_LAG,
+     {"ms": 5012, "ticks": 100}),
+    ("[12:00:00 INFO]: <Steve> hello there", EVENT_CHAT, {"player": "Steve", "message": "hello there"}),
+])
+def test_classify_events(classifier, line, kind, data):
+    ev = classifier.classify(line)
+    assert ev is not None and ev.kind == kind
+    assert ev.data == data
+
+
+@pytest.mark.parametrize("line, kind", [
+    ("[12:00:00 WARN]: Something odd", EVENT_WARN),
+    ("[12:00:00] [Server thread/WARN]: Something odd", EVENT_WARN),
+    ("[12:00:00 ERROR]: Broken", EVENT_ERROR),
+    ("[12:00:00] [Server thread/ERROR]: Broken", EVENT_ERROR),
+    ("[12:00:00] [Server thread/SEVERE]: Broken", EVENT_ERROR),
+])
+def test_level_in_any_leading_bracket(classifier, line, kind):
+    assert classifier.classify(line).kind == kind
+
+
+def test_level_word_in_message_is_not_a_level(classifier):
+    assert classifier.classify("[12:00:00 INFO]: WARNING: the ERROR word in a message") is None
+
+
+def test_chat_takes_precedence(classifier):
+    ev = classifier.classify("[12:00:00 INFO]: <Steve> Alex joined the game")
+    assert ev.kind == EVENT_CHAT
+
+
+def test_ansi_is_stripped_before_matching(classifier):
+    line = "\x1b[33m[12:00:00 INFO]: Steve joined the game\x1b[0m"
+    assert strip_ansi(line) == "[12:00:00 INFO]: Steve joined the game"
+    ev = classifier.classify(line)
+    assert ev.kind == EVENT_JOIN and ev.line == strip_ansi(line)
+
+
+def test_unmatched_line(classifier):
+    assert classifier.classify("[12:00:00 INFO]: Preparing spawn area: 42%") is None
+
+
+def test_feed_dispatches_to_subscribers(classifier):
+    seen = []
+    classifier.subscribe(EVENT_JOIN, lambda ev: seen.append(("join", ev.data["player"])))
+    classifier.subscribe(EVENT_LEAVE, lambda ev: seen.append(("leave", ev.data["player"])))
+    n = classifier.feed(["[INFO]: Steve joined the game", "noise", "[INFO]: Steve left the game"])
+    assert n == 2
+    assert seen == [("join", "Steve"), ("leave", "Steve")]
+    assert classifier.counts == {EVENT_JOIN: 1, EVENT_LEAVE: 1}
+
+
+def test_register_custom_rule_first(classifier):
+    classifier.register(LineRule("custom", ("joined",), r"(?P<who>\w+) joined"), first=True)
+    assert classifier.classify("[INFO]: Steve joined the game").kind == "custom"
@@ -0,0 +1,108 @@
+# test_log_index.py
+"""控制台历史索引：增量索引、压缩分段、跨午夜时间戳，以及 trigram / 默认分词 / LIKE 三种检索路径"""
+
+import os
+import sqlite3
+
+import pytest
+
+from mc_core import ConsoleLogIndex, gzip_log_file
+
+SESSION = "console-survival-20240101-230000"
+
+
+@pytest.fixture
+def log_dir(tmp_path):
+    d = tmp_path / "server"
+    d.mkdir()
+    return d
+
+
+def write_log(log_dir, lines, name=SESSION, mode="w"):
+    path = log_dir / f"{name}.log"
+    with open(path, mode, encoding="utf-8", newline="") as f:
+        f.write(lines)
+    return path
+
+
+def make_index(tmp_path, log_dir):
+    return ConsoleLogIndex(str(tmp_path / "index.sqlite3"), str(log_dir))
+
+
+def test_search_returns_newest_first_with_day_rollover(tmp_path, log_dir):
+    write_log(log_dir, "[23:59:58 INFO]: Steve issued server command: /op Alex\n"
+                       "[00:00:01 INFO]: Alex issued server command: /op Steve\n"
+                       "\x1b[33m[00:00:02 WARN]: \x1b[0mAlex moved too quickly!\n")
+    idx = make_index(tmp_path, log_dir)
+    assert idx.trigram
+    assert idx.update() == 3
+    hits = idx.search("issued server command: /op")
+    assert [(ts, lineno) for ts, _, lineno, _ in hits] == [("2024-01-02 00:00:01", 2), ("2024-01-01 23:59:58", 1)]
+    assert hits[0][1] == SESSION
+    # 写入索引前去掉 ANSI 颜色代码
+    assert idx.search("moved too")[0][3] == "[00:00:02 WARN]: Alex moved too quickly!"
+    assert idx.stats() == {"files": 1, "lines": 3}
+
+
+def test_incremental_update_waits_for_complete_lines(tmp_path, log_dir):
+    write_log(log_dir, "[10:00:00 INFO]: first line\n[10:00:01 INFO]: half")
+    idx = make_index(tmp_path, log_dir)
+    assert idx.update() == 1
+    assert idx.search("half") == []
+    write_log(log_dir, " done\n[10:00:02 INFO]: third line\n", mode="a")
+    assert idx.update() == 2
+    assert idx.search("half done")[0][2:] == (2, "[10:00:01 INFO]: half done")
+    assert idx.update() == 0
+
+
+def test_compressed_segment_is_not_reindexed_and_deleted_segment_is_dropped(tmp_path, log_dir):
+    path = write_log(log_dir, "[10:00:00 INFO]: one\n[10:00:01 INFO]: two\n[10:00:02 INFO]: tail")
+    idx = make_index(tmp_path, log_dir)
+    assert idx.update() == 2
+    gz = gzip_log_file(str(path))
+    # 压缩后的分段不会再增长：只补上没有换行的最后一行
+    assert idx.update() == 1
+    assert len(idx.search("INFO")) == 3
+    assert idx.update() == 0
+    os.remove(gz)
+    assert idx.update() == 0
+    assert idx.search("INFO") == [] and idx.stats()["files"] == 0
+
+
+def test_short_queries_fall_back_to_escaped_like(tmp_path, log_dir):
+    write_log(log_dir, "[10:00:00 INFO]: tps 100%\n"
+                       "[10:00:01 INFO]: tps 1000\n"
+                       "[10:00:02 INFO]: a_b\n"
+                       "[10:00:03 INFO]: axb\n")
+    idx = make_index(tmp_path, log_dir)
+    idx.update()
+    assert [h[3] for h in idx.search("%")] == ["[10:00:00 INFO]: tps 100%"]
+    assert [h[3] for h in idx.search("_")] == ["[10:00:02 INFO]: a_b"]
+    assert [h[2] for h in idx.search("ax")] == [4]
+    assert idx.search("   ") == []
+
+
+def test_session_filter_and_limit(tmp_path, log_dir):
+    write_log(log_dir, "".join(f"[10:00:{i:02d} INFO]: tick {i}\n" for i in range(10)))
+    other = "console-creative-20240102-080000"
+    write_log(log_dir, "[08:00:00 INFO]: tick creative\n", name=other)
+    idx = make_index(tmp_path, log_dir)
+    idx.update()
+    assert len(idx.search("tick")) == 11
+    assert [h[1] for h in idx.search("tick", session=other)] == [other]
+    assert [h[2] for h in idx.search("tick", limit=3, session=SESSION)] == [10, 9, 8]
+
+
+def test_without_trigram_uses_word_match_or_like(tmp_path, log_dir):
+    db_path = tmp_path / "index.sqlite3"
+    # 旧版 SQLite 没有 trigram 分词：预先建一个默认分词的表，索引会识别并换用对应的检索方式
+    with sqlite3.connect(db_path) as db:
+        db.execute("CREATE VIRTUAL TABLE lines USING fts5(text, ts UNINDEXED, session UNINDEXED, lineno UNINDEXED)")
+    write_log(log_dir, "[10:00:00 INFO]: Steve joined the game\n"
+                       "[10:00:01 INFO]: Steve issued server command: /op Alex\n")
+    idx = ConsoleLogIndex(str(db_path), str(log_dir))
+    assert not idx.trigram
+    idx.update()
+    assert [h[2] for h in idx.search("joined the")] == [1]  # 整词短语走 MATCH
+    assert [h[2] for h in idx.search("/op Al")] == [2]      # 含符号的子串走 LIKE
+    assert idx.search("oine") == []                          # 默认分词不支持词内子串
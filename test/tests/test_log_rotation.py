@@ -0,0 +1,77 @@
+# test_log_rotation.py
+"""日志轮转设置、按大小切分 + gzip 压缩，以及按前缀的保留清理"""
+
+import gzip
+import os
+import time
+
+from mc_core import BufferedLogWriter, LogRotation, console_log_path, prune_log_dir
+
+
+def make_logs(folder, prefix, stamps):
+    paths = []
+    for stamp in stamps:
+        p = folder / f"{prefix}-{stamp}.log"
+        p.write_text(stamp)
+        paths.append(p)
+    return paths
+
+
+def wait_for(cond, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if cond(): return True
+        time.sleep(0.02)
+    return cond()
+
+
+def test_rotation_config_round_trip():
+    r = LogRotation.from_config({"log_rotate_mb": 8, "log_rotate_hours": 0, "log_keep_days": 7,
+                                 "log_keep_files": 5, "log_compress": False})
+    assert r.max_bytes == 8 * 1024 * 1024 and r.max_age_s == 0
+    assert LogRotation.from_config(r.to_config()).to_config() == r.to_config()
+    assert LogRotation.from_config({"log_rotate_mb": "bad"}).to_config() == LogRotation().to_config()
+
+
+def test_prune_keeps_newest_files_per_prefix(tmp_path):
+    alpha = make_logs(tmp_path, "console-alpha", [f"20240101-00000{i}" for i in range(5)])
+    beta = make_logs(tmp_path, "console-beta", [f"20240101-00000{i}" for i in range(5)])
+    prune_log_dir(str(tmp_path), "console-alpha", LogRotation(keep_days=0, keep_files=2))
+    assert [p.exists() for p in alpha] == [False, False, False, True, True]
+    assert all(p.exists() for p in beta)  # 其它服务器的日志不受影响
+
+
+def test_prune_by_age_skips_active_file(tmp_path):
+    old, active, fresh = make_logs(tmp_path, "app", ["20240101-000000", "20240102-000000", "20240103-000000"])
+    stale = time.time() - 10 * 86400
+    for p in (old, active):
+        os.utime(p, (stale, stale))
+    prune_log_dir(str(tmp_path), "app", LogRotation(keep_days=3, keep_files=0), active_path=str(active))
+    assert not old.exists()
+    assert active.exists() and fresh.exists()
+
+
+def test_console_log_path_is_per_server():
+    a, b = console_log_path("My Server/1"), console_log_path("other")
+    assert os.path.basename(a).startswith("console-My_Server_1-")
+    assert os.path.basename(b).startswith("console-other-")
+
+
+def test_size_rotation_compresses_old_segment(tmp_path):
+    path = tmp_path / "console-alpha-20240101-000000.log"
+    rotation = LogRotation(max_mb=0.001, max_hours=0, keep_days=0, keep_files=0)  # 约 1 KB 一段
+    w = BufferedLogWriter(str(path), rotation=rotation)
+    payload = b"x" * 600 + b"\n"
+    w.write_bytes(payload)
+    w.write_bytes(payload)
+    w.flush()
+    assert wait_for(lambda: w.path != str(path))
+    w.write_bytes(b"after rotation\n")
+    w.close()
+    gz = str(path) + ".gz"
+    assert wait_for(lambda: os.path.exists(gz) and not path.exists())
+    with gzip.open(gz) as f:
+        assert f.read() == payload * 2
+    assert wait_for(lambda: os.path.exists(w.path + ".gz"))
+    with gzip.open(w.path + ".gz") as f:
+        assert f.read() == b"after rotation\n"
@@ -0,0 +1,38 @@
+# test_log_writer.py
+"""BufferedLogWriter：写入线程落盘、flush 与关闭后的写入"""
+
+import pytest
+
+from mc_core import BufferedLogWriter
+
+
+def test_text_and_bytes_reach_disk_in_order(tmp_path):
+    path = tmp_path / "console.log"
+    w = BufferedLogWriter(str(path))
+    w.write("第一行\n")
+    w.write_bytes(b"raw line\n")
+    w.write_lines(["a", "b"])
+    w.flush()
+    assert path.read_bytes() == "第一行\nraw line\na\nb\n".encode("utf-8")
+    w.close()
+    assert w.bytes_written == len(path.read_bytes())
+
+
+def test_write_after_close_raises(tmp_path):
+    w = BufferedLogWriter(str(tmp_path / "console.log"))
+    w.close()
+    w.close()  # 重复关闭无副作用
+    assert w.closed
+    with pytest.raises(ValueError):
+        w.write("> say hi\n")
+    with pytest.raises(ValueError):
+        w.write_bytes(b"late\n")
+
+
+def test_appends_to_existing_file(tmp_path):
+    path = tmp_path / "console.log"
+    path.write_bytes(b"old\n")
+    w = BufferedLogWriter(str(path))
+    w.write("new\n")
+    w.close()
+    assert path.read_bytes() == b"old\nnew\n"
@@ -0,0 +1,87 @@
+# test_player_sessions.py
+"""玩家在线记录：批量写入后的最高在线、在线时长排行与每小时热力图，按服务器隔离"""
+
+import datetime
+
+import pytest
+
+from mc_core import PlayerSessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PlayerSessionStore(str(tmp_path / "sessions.sqlite3"))
+
+
+def test_join_leave_and_playtime(store):
+    store.record_join("alpha", "Steve", ts=100)
+    store.record_join("alpha", "Alex", ts=150)
+    store.record_leave("alpha", "Steve", ts=400)
+    store.record_join("alpha", "Steve", ts=500)
+    store.record_leave("alpha", "Steve", ts=600)
+    store.record_leave("alpha", "Alex", ts=250)
+    store.record_join("beta", "Steve", ts=100)
+    store.flush()
+    assert store.playtime("alpha") == [("Steve", 400.0, 2), ("Alex", 100.0, 1)]
+    # 统计窗口只计算窗口内的部分
+    assert store.playtime("alpha", since=350) == [("Steve", 150.0, 2)]
+    assert store.playtime("gamma") == []
+
+
+def test_recent_sessions_include_open_ones(store):
+    store.record_join("alpha", "Steve", ts=100)
+    store.record_leave("alpha", "Steve", ts=400)
+    store.record_join("alpha", "Alex", ts=300)
+    store.record_join("beta", "Notch", ts=500)
+    store.flush()
+    assert store.recent_sessions("alpha") == [("Alex", 300.0, None), ("Steve", 100.0, 400.0)]
+    assert store.recent_sessions("alpha", limit=1) == [("Alex", 300.0, None)]
+    assert store.recent_sessions("alpha", since=450) == [("Alex", 300.0, None)]
+
+
+def test_peak_concurrency_counts_leave_before_join_at_same_time(store):
+    store.record_join("alpha", "A", ts=100)
+    store.record_leave("alpha", "A", ts=200)
+    store.record_join("alpha", "B", ts=200)
+    store.record_leave("alpha", "B", ts=300)
+    store.flush()
+    assert store.peak_concurrency("alpha") == (1, 200)
+    store.record_join("alpha", "C", ts=250)
+    store.record_leave("alpha", "C", ts=260)
+    store.flush()
+    assert store.peak_concurrency("alpha") == (2, 250)
+    assert store.peak_concurrency("beta") == (0, None)
+
+
+def test_close_open_sessions_after_crash(store):
+    store.record_join("alpha", "Steve", ts=100)
+    store.record_join("alpha", "Alex", ts=300)
+    store.record_join("beta", "Notch", ts=100)
+    store.close_open_sessions("alpha", ts=200)
+    store.flush()
+    # 结束时间不会早于加入时间；其它服务器的会话不受影响
+    assert dict((p, s) for p, s, _ in store.playtime("alpha")) == {"Steve": 100.0, "Alex": 0.0}
+    store.record_leave("beta", "Notch", ts=160)
+    store.flush()
+    assert store.playtime("beta") == [("Notch", 60.0, 1)]
+
+
+def test_hourly_heatmap_splits_sessions_at_hour_boundaries(store):
+    monday = datetime.datetime(2024, 1, 1, 10, 30)
+    store.record_join("alpha", "Steve", ts=monday.timestamp())
+    store.record_leave("alpha", "Steve", ts=(monday + datetime.timedelta(hours=1, minutes=45)).timestamp())
+    store.flush()
+    grid = store.hourly_heatmap("alpha")
+    assert grid[0][10] == pytest.approx(0.5)
+    assert grid[0][11] == pytest.approx(1.0)
+    assert grid[0][12] == pytest.approx(0.25)
+    assert sum(map(sum, grid)) == pytest.approx(1.75)
+
+
+def test_store_is_shared_across_instances(tmp_path):
+    path = str(tmp_path / "sessions.sqlite3")
+    first = PlayerSessionStore(path)
+    first.record_join("alpha", "Steve", ts=100)
+    first.record_leave("alpha", "Steve", ts=160)
+    first.flush()
+    assert PlayerSessionStore(path).playtime("alpha") == [("Steve", 60.0, 1)]
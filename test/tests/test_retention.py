@@ -0,0 +1,97 @@
+# test_retention.py
+"""GFS 保留策略：最近 N 个、最新的启动前备份，以及按小时/天/周/月各保留最新一个"""
+
+import datetime
+import threading
+
+from mc_backup import RetentionPolicy, backup_index, delete_snapshots_async, parse_snapshot_name
+
+
+def snapshots(times, note="periodic"):
+    names = [f"backup-{t:%Y%m%d-%H%M%S}_{note}" for t in times]
+    return sorted((parse_snapshot_name(n) for n in names), key=lambda s: s.time, reverse=True)
+
+
+def only(policy_kw):
+    kw = {"keep_last": 1, "hourly": 0, "daily": 0, "weekly": 0, "monthly": 0}
+    kw.update(policy_kw)
+    return RetentionPolicy(**kw)
+
+
+def test_parse_snapshot_name_kinds():
+    assert parse_snapshot_name("backup-20240301-101500_manual").kind == "dir"
+    assert parse_snapshot_name("backup-20240301-101500_manual.manifest.json.gz").kind == "dedup"
+    assert parse_snapshot_name("backup-20240301-101500_manual.tar.zst").kind == "archive"
+    info = parse_snapshot_name("backup-20240301-101500_startup.tar.gz")
+    assert info.note == "startup" and info.time == datetime.datetime(2024, 3, 1, 10, 15)
+    assert parse_snapshot_name("backup-20241399-000000_manual") is None
+    assert parse_snapshot_name(".deleting-backup-20240301-101500_manual") is None
+
+
+def test_keep_last_and_latest_startup():
+    base = datetime.datetime(2024, 3, 1, 12)
+    regular = snapshots([base - datetime.timedelta(minutes=5 * i) for i in range(6)])
+    startup = snapshots([base - datetime.timedelta(minutes=1), base - datetime.timedelta(minutes=2)], "startup")
+    snaps = sorted(regular + startup, key=lambda s: s.time, reverse=True)
+    keep = only({"keep_last": 3}).select(snaps)
+    assert set(keep) == {s.name for s in regular[:3]} | {startup[0].name}
+    assert keep[startup[0].name] == "最新启动前备份"
+    assert keep[regular[0].name] == "最近"
+
+
+def test_hourly_tier_keeps_newest_per_hour():
+    base = datetime.datetime(2024, 3, 1, 12, 50)
+    snaps = snapshots([base - datetime.timedelta(minutes=20 * i) for i in range(12)])
+    keep = only({"hourly": 3}).select(snaps)
+    # 12:50 (最近) / 11:50 / 10:50 各是所在小时中最新的一个
+    assert sorted(keep) == sorted(f"backup-20240301-{h}5000_periodic" for h in (10, 11, 12))
+    assert keep["backup-20240301-115000_periodic"] == "每小时"
+
+
+def test_daily_weekly_monthly_tiers():
+    base = datetime.datetime(2024, 3, 31, 23)
+    snaps = snapshots([base - datetime.timedelta(days=i) for i in range(70)])
+    names = lambda keep: sorted(n[7:15] for n in keep)
+    assert names(only({"daily": 3}).select(snaps)) == ["20240329", "20240330", "20240331"]
+    # ISO 周从周一开始：2024-03-31 是周日
+    assert names(only({"weekly": 3}).select(snaps)) == ["20240317", "20240324", "20240331"]
+    assert names(only({"monthly": 3}).select(snaps)) == ["20240131", "20240229", "20240331"]
+
+
+def test_tiers_union_and_nothing_extra():
+    base = datetime.datetime(2024, 3, 31, 23)
+    snaps = snapshots([base - datetime.timedelta(hours=6 * i) for i in range(200)])
+    keep = RetentionPolicy().select(snaps)
+    assert snaps[0].name in keep
+    assert len(keep) < len(snaps)
+    assert set(keep) <= {s.name for s in snaps}
+    assert RetentionPolicy(keep_last=0, hourly=0, daily=0, weekly=0, monthly=0).select(snaps) == {snaps[0].name: "最近"}
+
+
+def test_policy_from_config():
+    p = RetentionPolicy.from_config({"periodic_keep": 5, "retention_daily": "3", "retention_weekly": "bad"})
+    assert p.keep_last == 5
+    assert p.counts == {"hourly": 24, "daily": 3, "weekly": 4, "monthly": 6}
+    assert RetentionPolicy.from_config(p.to_config()).counts == p.counts
+
+
+def test_delete_snapshots_async_hides_then_removes(tmp_path):
+    dest = tmp_path / "backups"
+    names = ["backup-20240301-100000_periodic", "backup-20240301-110000_periodic"]
+    for n in names:
+        (dest / n / "world").mkdir(parents=True)
+        (dest / n / "world" / "level.dat").write_bytes(b"x")
+    assert [s.name for s in backup_index(str(dest)).snapshots()] == names[::-1]
+    done = []
+    finished = threading.Event()
+
+    def on_done(name, err):
+        done.append((name, err))
+        if len(done) == len(names) + 1: finished.set()
+    delete_snapshots_async(str(dest), names + ["backup-20240301-120000_missing"], on_done=on_done)
+    # 重命名是同步完成的：列表里立刻消失
+    assert backup_index(str(dest)).snapshots() == []
+    assert finished.wait(5)
+    assert sorted(n for n, e in done if e is None) == names
+    assert [n for n, e in done if e is not None] == ["backup-20240301-120000_missing"]
+    assert [p.name for p in dest.iterdir()] == [".catalog.jsonl"]
@@ -0,0 +1,99 @@
+# test_roster.py
+"""在线玩家名册：增量增删的操作日志能还原出排序后的列表，/list 同步只改差异并保留加入时间"""
+
+import datetime
+import random
+
+from mc_core import PlayerRoster, format_duration
+
+
+def apply(rows, ops):
+    """按操作日志修改界面上的行 (与 _redraw_player_list 的增量分支一致)"""
+    for op in ops:
+        if op[0] == 'ins':
+            rows.insert(op[1], op[2])
+        else:
+            del rows[op[1]]
+
+
+def test_first_take_is_a_full_redraw():
+    r = PlayerRoster()
+    r.join("Steve", ts=100)
+    assert r.take_ops() is None
+    r.join("Alex", ts=101)
+    assert r.take_ops() == [('ins', 0, "Alex")]
+    assert r.take_ops() == []
+
+
+def test_join_and_leave_keep_sorted_order_and_report_session_length():
+    r = PlayerRoster()
+    assert r.join("Steve", ts=100)
+    assert not r.join("Steve", ts=200)  # 重复加入不覆盖加入时间
+    r.join("Alex", ts=150)
+    assert r.names == ["Alex", "Steve"] and len(r) == 2 and "Alex" in r
+    assert r.session_seconds("Steve", now=160) == 60
+    assert r.leave("Steve", ts=400) == 300
+    assert r.leave("Steve", ts=500) is None
+    assert r.session_seconds("Steve") is None
+    assert r.leave("Alex", ts=100) == 0.0  # 时钟回拨不出现负数
+
+
+def test_incremental_ops_reproduce_roster_under_churn():
+    rng = random.Random(7)
+    r = PlayerRoster()
+    rows = []
+    r.take_ops()
+    for step in range(2000):
+        name = f"player{rng.randrange(300):03d}"
+        if name in r: r.leave(name)
+        else: r.join(name)
+        if step % 7 == 0:
+            ops = r.take_ops()
+            if ops is None: rows = list(r.names)  # 操作过多：整表重绘
+            else: apply(rows, ops)
+            assert rows == r.names
+    assert r.names == sorted(r.names) and len(r.names) == len(set(r.names))
+
+
+def test_many_ops_fall_back_to_full_redraw():
+    r = PlayerRoster()
+    r.replace([f"p{i}" for i in range(100)])
+    r.take_ops()
+    r.replace([f"q{i}" for i in range(100)])
+    assert r.take_ops() is None
+
+
+def test_replace_only_changes_the_difference():
+    r = PlayerRoster()
+    r.replace(["Steve", "Alex"], ts=100)
+    r.take_ops()
+    joined, left = r.replace(["Steve", "Notch"], ts=200)
+    assert (joined, left) == (["Notch"], ["Alex"])
+    assert r.join_times == {"Steve": 100, "Notch": 200}
+    rows = ["Alex", "Steve"]
+    apply(rows, r.take_ops())
+    assert rows == r.names == ["Notch", "Steve"]
+
+
+def test_clear_forces_full_redraw():
+    r = PlayerRoster()
+    r.join("Steve")
+    r.take_ops()
+    r.clear()
+    assert len(r) == 0 and r.take_ops() is None
+
+
+def test_display_line_shows_join_time_and_session_length():
+    joined = datetime.datetime(2024, 1, 1, 9, 5).timestamp()
+    r = PlayerRoster()
+    r.join("Steve", ts=joined)
+    assert r.display_line("Steve", now=joined + 30) == "Steve  (09:05 加入，已在线 0 分钟)"
+    assert r.display_line("Steve", now=joined + 2 * 3600 + 5 * 60) == "Steve  (09:05 加入，已在线 2 小时 05 分)"
+    assert r.display_line("Alex") == "Alex  (--:-- 加入)"
+
+
+def test_format_duration():
+    assert format_duration(-5) == "0 分钟"
+    assert format_duration(59 * 60 + 59) == "59 分钟"
+    assert format_duration(3600) == "1 小时 00 分"
+    assert format_duration(26 * 3600 + 61) == "26 小时 01 分"
@@ -0,0 +1,137 @@
+# test_save_barrier.py
+"""备份前的存档确认：save-off → save-all flush → 等待 "Saved the game" → 复制 → finally 中 save-on"""
+
+import os
+import threading
+import time
+
+import pytest
+
+import mc_backup
+import mc_core
+from mc_backup import PARTIAL_PREFIX, SNAPSHOT_OFF, SaveBarrier
+from mc_core import BackupSettings, ServerEngine, flush_world
+
+SAVED = "[12:00:00 INFO]: Saved the game"
+
+
+class FakeServer:
+    """假的命令接收端：记录收到的命令，收到 save-all flush 后 (可选延迟) 在控制台回应 "Saved the game" """
+
+    def __init__(self, on_saved, delay=None, answer=True):
+        self.commands = []
+        self.on_saved = on_saved
+        self.delay = delay
+        self.answer = answer
+
+    def write(self, cmd):
+        self.commands.append(cmd)
+        if cmd == "save-all flush" and self.answer:
+            if self.delay is None:
+                self.on_saved()
+            else:
+                threading.Timer(self.delay, self.on_saved).start()
+
+
+@pytest.fixture
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(mc_core, "SAVE_CONFIRM_TIMEOUT_S", 0.3)
+
+
+def test_barrier_only_counts_confirmations_after_arm():
+    barrier = SaveBarrier()
+    barrier.notify()  # arm 之前的旧确认不算
+    token = barrier.arm()
+    assert not barrier.wait(token, 0.05)
+    barrier.notify()
+    assert barrier.wait(token, 0.05)
+
+
+def test_barrier_stops_waiting_when_server_dies():
+    barrier = SaveBarrier()
+    t0 = time.monotonic()
+    assert not barrier.wait(barrier.arm(), 30, alive=lambda: False)
+    assert time.monotonic() - t0 < 1
+
+
+def test_flush_world_sends_save_off_before_flush_and_waits_for_confirmation():
+    barrier = SaveBarrier()
+    server = FakeServer(barrier.notify, delay=0.1)
+    logs = []
+    t0 = time.monotonic()
+    assert flush_world(server.write, barrier, lambda: True, logs.append, "测试")
+    assert time.monotonic() - t0 >= 0.1
+    assert server.commands == ["save-off", "save-all flush"]
+    assert any("已确认存档" in line for line in logs)
+
+
+def test_flush_world_times_out_with_warning(short_timeout):
+    barrier = SaveBarrier()
+    server = FakeServer(barrier.notify, answer=False)
+    logs = []
+    assert not flush_world(server.write, barrier, lambda: True, logs.append, "测试")
+    assert server.commands == ["save-off", "save-all flush"]
+    assert any("未收到存档确认" in line for line in logs)
+
+
+def test_flush_world_is_quiet_when_server_stopped(short_timeout):
+    barrier = SaveBarrier()
+    logs = []
+    assert not flush_world(lambda cmd: None, barrier, lambda: False, logs.append, "测试")
+    assert logs == []
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """运行中的引擎：命令发往假的服务器，"Saved the game" 经 publish 走分类器到达存档屏障"""
+    server_dir = tmp_path / "servers" / "alpha"
+    (server_dir / "world").mkdir(parents=True)
+    (server_dir / "world" / "level.dat").write_bytes(b"level")
+    eng = ServerEngine(str(server_dir), backup_root=str(tmp_path / "backups"))
+    eng.state = ServerEngine.RUNNING
+    eng.settings = BackupSettings(str(tmp_path / "backups"), mode=mc_backup.MODE_FULL, snapshot_backend=SNAPSHOT_OFF)
+    return eng
+
+
+def attach(eng, server):
+    """save-on 到达时记录当时备份是否已经写完"""
+    backups = []
+
+    def command(cmd):
+        if cmd == "save-on":
+            backups.append(list(eng.list_backups()))
+        server.write(cmd)
+    eng.command = command
+    return backups
+
+
+def test_engine_backup_copies_between_flush_and_save_on(engine):
+    server = FakeServer(lambda: engine.publish([SAVED]), delay=0.05)
+    at_save_on = attach(engine, server)
+    engine._backup("manual", engine.settings)
+    assert server.commands == ["save-off", "save-all flush", "save-on"]
+    assert len(at_save_on) == 1 and len(at_save_on[0]) == 1  # save-on 发出时快照已提交
+    assert any("已确认存档" in line for line in engine.recent_logs())
+
+
+def test_engine_backup_reenables_autosave_after_timeout(engine, short_timeout):
+    server = FakeServer(lambda: engine.publish([SAVED]), answer=False)
+    attach(engine, server)
+    engine._backup("manual", engine.settings)
+    assert server.commands == ["save-off", "save-all flush", "save-on"]
+    assert len(engine.list_backups()) == 1
+    assert any("未收到存档确认" in line for line in engine.recent_logs())
+
+
+def test_engine_backup_reenables_autosave_when_copy_fails(engine, monkeypatch):
+    def broken(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(mc_backup, "copy_tree", broken)
+    server = FakeServer(lambda: engine.publish([SAVED]))
+    attach(engine, server)
+    engine._backup("manual", engine.settings)
+    assert server.commands == ["save-off", "save-all flush", "save-on"]
+    assert engine.list_backups() == []
+    assert any("备份失败" in line for line in engine.recent_logs())
+    dest = os.path.join(engine.backup_root, engine.name)
+    assert not [n for n in os.listdir(dest) if n.startswith(PARTIAL_PREFIX)]  # 临时目录已清理
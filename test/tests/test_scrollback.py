@@ -0,0 +1,82 @@
+# test_scrollback.py
+"""控制台滚动缓冲：固定容量、超出 10% 后批量裁剪，文本框始终一次插入 + 一次滚动"""
+
+import pytest
+
+from mc_core import ConsoleScrollback, textbox_append
+
+
+class FakeText:
+    """模拟 Tk Text 的只读文本框：按行存储，记录每种操作的调用次数"""
+
+    def __init__(self):
+        self.text = ""
+        self.calls = {"insert": 0, "delete": 0, "see": 0}
+        self.state = "disabled"
+
+    def configure(self, state):
+        self.state = state
+
+    def insert(self, index, text):
+        assert index == "end" and self.state == "normal"
+        self.calls["insert"] += 1
+        self.text += text
+
+    def delete(self, start, end):
+        assert start == "1.0" and end.endswith(".0") and self.state == "normal"
+        self.calls["delete"] += 1
+        n = int(end.split(".")[0]) - 1
+        self.text = "".join(self.text.splitlines(keepends=True)[n:])
+
+    def see(self, index):
+        self.calls["see"] += 1
+
+    @property
+    def lines(self):
+        return self.text.splitlines()
+
+
+def test_capacity_has_a_floor():
+    assert ConsoleScrollback(5).capacity == 100
+    sb = ConsoleScrollback(500)
+    sb.set_capacity(10)
+    assert sb.capacity == 100
+
+
+def test_trims_in_bulk_after_ten_percent_slack():
+    sb = ConsoleScrollback(1000)
+    assert sb.append([f"l{i}" for i in range(1100)]) == 0  # 未超出 10%：不裁剪
+    assert sb.append(["x"]) == 101  # 超出后一次裁回容量
+    assert sb.widget_lines == 1000
+    assert len(sb.lines) == 1000 and sb.lines[-1] == "x"
+    assert all(sb.append(["y"]) == 0 for _ in range(100))
+
+
+def test_set_capacity_keeps_newest_lines():
+    sb = ConsoleScrollback(1000)
+    sb.append([f"l{i}" for i in range(800)])
+    sb.set_capacity(200)
+    assert list(sb.lines) == [f"l{i}" for i in range(600, 800)]
+    sb.clear()
+    assert not sb.lines and sb.widget_lines == 0
+
+
+@pytest.mark.parametrize("batch", [1, 37, 5000])
+def test_textbox_never_exceeds_capacity_plus_slack(batch):
+    sb = ConsoleScrollback(1000)
+    box = FakeText()
+    n = 0
+    for _ in range(40):
+        textbox_append(box, sb, [f"line {n + i}" for i in range(batch)])
+        n += batch
+        assert len(box.lines) == sb.widget_lines <= 1100
+        assert box.state == "disabled"
+    assert box.lines[-1] == f"line {n - 1}"
+    assert box.calls["insert"] == box.calls["see"] == 40  # 每批一次插入、一次滚动
+    assert box.calls["delete"] < 40 or batch >= 1000
+
+
+def test_empty_batch_does_not_touch_widget():
+    box = FakeText()
+    textbox_append(box, ConsoleScrollback(100), [])
+    assert box.calls == {"insert": 0, "delete": 0, "see": 0}
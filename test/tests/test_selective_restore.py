@@ -0,0 +1,179 @@
+# test_selective_restore.py
+"""选择性还原：维度 / 区域范围 / 玩家数据的选择规则，以及从目录、去重、归档快照中只写回选中的文件"""
+
+import json
+import os
+
+import pytest
+
+import mc_backup
+from mc_backup import (MANIFEST_SUFFIX, copy_tree, dimension_selection, player_selection, region_box,
+                       resolve_player_uuids, restore_selected, write_archive_snapshot, write_dedup_snapshot)
+from mc_core import ServerEngine, ServerLock
+
+UUID = "0f1e2d3c-4b5a-6978-8796-a5b4c3d2e1f0"
+OTHER = "11111111-2222-3333-4444-555555555555"
+
+
+def make_world(root, tag):
+    files = {
+        "world/level.dat": "level",
+        "world/region/r.0.0.mca": "ow00",
+        "world/region/r.-1.0.mca": "ow-10",
+        "world/region/r.3.3.mca": "ow33",
+        "world/entities/r.0.0.mca": "ent00",
+        "world/DIM-1/region/r.0.0.mca": "nether-vanilla",
+        "world_nether/DIM-1/region/r.0.0.mca": "nether-paper",
+        "world_the_end/DIM1/region/r.0.0.mca": "end",
+        f"world/playerdata/{UUID}.dat": "steve",
+        f"world/playerdata/{OTHER}.dat": "alex",
+    }
+    for rel, text in files.items():
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(f"{tag}:{text}")
+    return files
+
+
+def snapshot(kind, src, dest):
+    name = "backup-20240301-101500_manual"
+    dest.mkdir(exist_ok=True)
+    if kind == "dir":
+        copy_tree(str(src), str(dest / name))
+        return str(dest / name)
+    if kind == "dedup":
+        write_dedup_snapshot(str(src), None, str(dest), name)
+        return str(dest / (name + MANIFEST_SUFFIX))
+    path, _, _ = write_archive_snapshot(str(src), None, str(dest), name)
+    return path
+
+
+def test_region_box_floors_negative_coordinates():
+    assert region_box(0, 0, 511, 511) == (0, 0, 0, 0)
+    assert region_box(600, -1, -1, 600) == (-1, -1, 1, 1)
+
+
+def test_dimension_selection_rules():
+    ow = dimension_selection("world", "overworld")
+    assert ow.match("world/region/r.5.5.mca") and ow.match("world/poi/r.0.0.mca")
+    assert not ow.match("world/level.dat") and not ow.match("world/DIM-1/region/r.0.0.mca")
+    assert ow.prune
+    nether = dimension_selection("world", "nether")
+    assert nether.match("world/DIM-1/region/r.0.0.mca") and nether.match("world_nether/DIM-1/entities/r.0.0.mca")
+    boxed = dimension_selection("world", "overworld", (-10, 0, 100, 100))
+    assert boxed.match("world/region/r.-1.0.mca") and boxed.match("world/entities/r.0.0.mca")
+    assert not boxed.match("world/region/r.1.0.mca") and not boxed.match("world/region/level.dat")
+    assert "r.-1.0 ~ r.0.0" in boxed.label
+
+
+def test_resolve_player_uuids(tmp_path):
+    (tmp_path / "usercache.json").write_text(json.dumps([{"name": "Steve", "uuid": UUID}]))
+    uuids, unknown = resolve_player_uuids(str(tmp_path), ["steve", OTHER.replace("-", "").upper(), "Nobody"])
+    assert uuids == [UUID, OTHER] and unknown == ["Nobody"]
+    sel = player_selection("world", uuids[:1])
+    assert sel.match(f"world/playerdata/{UUID}.dat") and not sel.match(f"world/playerdata/{OTHER}.dat")
+
+
+@pytest.mark.parametrize("kind", ["dir", "dedup", "archive"])
+def test_restore_box_only_touches_selected_regions(tmp_path, kind):
+    src, live = tmp_path / "src", tmp_path / "live"
+    make_world(src, "old")
+    path = snapshot(kind, src, tmp_path / "backups")
+    files = make_world(live, "new")
+    (live / "world/region/r.0.1.mca").write_text("new:generated")   # 备份之后新生成、在范围内
+    (live / "world/region/r.9.9.mca").write_text("new:far")         # 范围外
+
+    sel = dimension_selection("world", "overworld", (-512, 0, 511, 1023))
+    restored, removed = restore_selected(path, str(live), sel)
+    assert sorted(restored) == ["world/entities/r.0.0.mca", "world/region/r.-1.0.mca", "world/region/r.0.0.mca"]
+    assert removed == ["world/region/r.0.1.mca"]
+    for rel in files:
+        expect = "old" if rel in restored else "new"
+        assert (live / rel).read_text().startswith(expect + ":"), rel
+    assert (live / "world/region/r.9.9.mca").exists()
+    assert not [p for p in live.rglob("*") if p.name.endswith(".restore-tmp")]
+
+
+@pytest.mark.parametrize("kind", ["dir", "dedup", "archive"])
+def test_restore_player_data(tmp_path, kind):
+    src, live = tmp_path / "src", tmp_path / "live"
+    make_world(src, "old")
+    path = snapshot(kind, src, tmp_path / "backups")
+    make_world(live, "new")
+    restored, removed = restore_selected(path, str(live), player_selection("world", [UUID]))
+    assert restored == [f"world/playerdata/{UUID}.dat"] and removed == []
+    assert (live / f"world/playerdata/{UUID}.dat").read_text() == "old:steve"
+    assert (live / f"world/playerdata/{OTHER}.dat").read_text() == "new:alex"
+
+
+def test_prune_skips_dimension_missing_from_backup(tmp_path):
+    src, live = tmp_path / "src", tmp_path / "live"
+    (src / "world" / "region").mkdir(parents=True)
+    (src / "world" / "region" / "r.0.0.mca").write_text("old")
+    path = snapshot("dir", src, tmp_path / "backups")
+    make_world(live, "new")
+    restored, removed = restore_selected(path, str(live), dimension_selection("world", "nether"))
+    assert restored == [] and removed == []
+    assert (live / "world_nether/DIM-1/region/r.0.0.mca").exists()
+    assert os.path.exists(live / "world/DIM-1/region/r.0.0.mca")
+
+
+def engine_with_backup(tmp_path):
+    """服务器 alpha 与一个目录备份；返回 (引擎, 备份名, 服务器目录)"""
+    server = tmp_path / "servers" / "alpha"
+    make_world(server, "new")
+    name = "backup-20240301-101500_manual"
+    make_world(tmp_path / "src", "old")
+    copy_tree(str(tmp_path / "src"), str(tmp_path / "backups" / "alpha" / name))
+    return ServerEngine(str(server), str(tmp_path / "backups")), name, server
+
+
+def test_engine_restore_selected_holds_job_and_lock(tmp_path, monkeypatch):
+    eng, name, server = engine_with_backup(tmp_path)
+    path = str(tmp_path / "backups" / "alpha" / name)
+    real = mc_backup.restore_selected
+    seen = []
+
+    def spy(*args):
+        # 还原进行中：不能启动，也不能开始另一个任务；其它进程拿不到服务器锁
+        with pytest.raises(RuntimeError):
+            eng.start(str(server / "server.jar"))
+        with pytest.raises(RuntimeError):
+            eng.backup()
+        with pytest.raises(RuntimeError):
+            ServerLock(str(server)).acquire()
+        seen.append(eng.job)
+        return real(*args)
+    monkeypatch.setattr(mc_backup, "restore_selected", spy)
+    logs = []
+    eng.subscribe(lambda kind, data: kind == "log" and logs.append(data))
+    restored, removed = eng.restore_selected_path(path, name, player_selection("world", [UUID]))
+    assert restored == [f"world/playerdata/{UUID}.dat"] and seen == [f"restore-selected:{name}"]
+    assert (server / f"world/playerdata/{UUID}.dat").read_text() == "old:steve"
+    assert eng.job is None and any("✅ [选择性还原]" in line for line in logs)
+    lock = ServerLock(str(server))
+    lock.acquire()
+    lock.release()
+
+
+def test_engine_restore_selected_refuses_unless_stopped(tmp_path):
+    eng, name, server = engine_with_backup(tmp_path)
+    sel = player_selection("world", [UUID])
+    for state in (ServerEngine.STARTING, ServerEngine.RUNNING, ServerEngine.STOPPING):
+        eng.state = state
+        with pytest.raises(RuntimeError):
+            eng.restore_selected(name, sel)
+        assert eng.job is None
+    eng.state = ServerEngine.STOPPED
+    with pytest.raises(ValueError):
+        eng.restore_selected("backup-20990101-000000_manual", sel)
+
+    # 另一个进程 (例如守护进程) 占用该服务器时同样拒绝
+    other = ServerLock(str(server))
+    other.acquire()
+    try:
+        with pytest.raises(RuntimeError):
+            eng.restore_selected(name, sel)
+    finally:
+        other.release()
+    assert (server / f"world/playerdata/{UUID}.dat").read_text() == "new:steve"
@@ -0,0 +1,57 @@
+# test_server_lock.py
+"""跨进程占用锁：进程内可重入，另一个持有者 (含另一个进程) 在释放前无法获得"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import mc_core
+from mc_core import SERVER_LOCK_NAME, ServerLock, resolve_backup_targets
+
+PROBE = """
+import sys
+from mc_core import ServerLock
+try:
+    ServerLock(sys.argv[1]).acquire()
+except RuntimeError:
+    sys.exit(3)
+"""
+
+
+def probe(server_dir):
+    """在另一个进程中尝试加锁：3 表示被占用"""
+    return subprocess.run([sys.executable, "-c", PROBE, str(server_dir)], cwd=os.path.dirname(os.path.abspath(mc_core.__file__))).returncode
+
+
+def test_lock_is_reentrant_and_exclusive(tmp_path):
+    a, b = ServerLock(str(tmp_path)), ServerLock(str(tmp_path))
+    a.acquire()
+    a.acquire()
+    assert (tmp_path / SERVER_LOCK_NAME).exists()
+    with pytest.raises(RuntimeError):
+        b.acquire()
+    a.release()
+    with pytest.raises(RuntimeError):  # 还有一个使用者
+        b.acquire()
+    a.release()
+    b.acquire()
+    b.release()
+    a.release()  # 多余的释放被忽略
+
+
+def test_lock_excludes_other_process(tmp_path):
+    lock = ServerLock(str(tmp_path))
+    lock.acquire()
+    try:
+        assert probe(tmp_path) == 3
+    finally:
+        lock.release()
+    assert probe(tmp_path) == 0
+
+
+def test_lock_file_is_not_backed_up(tmp_path):
+    ServerLock(str(tmp_path)).acquire()
+    targets, ignore = resolve_backup_targets(str(tmp_path))
+    assert targets is None and SERVER_LOCK_NAME in ignore
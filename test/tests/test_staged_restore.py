@@ -0,0 +1,138 @@
+# test_staged_restore.py
+"""暂存 + 重命名换入的整体还原：换入、撤销点、撤销，以及换入中途崩溃后的恢复"""
+
+import json
+import os
+
+import pytest
+
+import mc_backup
+from mc_backup import (DELETING_PREFIX, RESTORE_STAGE_DIR, RESTORE_UNDO_DIR, RESTORE_UNDO_META, copy_tree,
+                       read_undo_point, recover_interrupted_restore, stage_restore, swap_in_restore, undo_restore)
+from mc_core import SERVER_LOCK_NAME, ServerEngine, ServerLock
+
+
+def write(root, files):
+    for rel, text in files.items():
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(text)
+
+
+def tree(root):
+    """root 下的文件内容 (忽略还原用的内部目录、后台删除中的项目和占用锁文件)"""
+    out = {}
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if d not in (RESTORE_STAGE_DIR, RESTORE_UNDO_DIR) and not d.startswith(DELETING_PREFIX)]
+        for n in files:
+            if n == SERVER_LOCK_NAME: continue
+            p = os.path.join(dirpath, n)
+            out[os.path.relpath(p, root).replace(os.sep, "/")] = open(p).read()
+    return out
+
+
+@pytest.fixture
+def server(tmp_path):
+    snap = tmp_path / "backups" / "backup-20240301-101500_manual"
+    write(tmp_path / "src", {"world/level.dat": "old-level", "world/region/r.0.0.mca": "old-region",
+                             "world_nether/level.dat": "old-nether", "logs/latest.log": "old-log"})
+    copy_tree(str(tmp_path / "src"), str(snap))
+    live = tmp_path / "server"
+    write(live, {"world/level.dat": "new-level", "world/region/r.5.5.mca": "new-region",
+                 "server.properties": "props", "logs/latest.log": "new-log"})
+    return str(snap), live
+
+
+def test_stage_then_swap_and_undo(server):
+    snap, live = server
+    before = tree(live)
+    items = stage_restore(snap, str(live), exclude=("logs",))
+    assert items == ["world", "world_nether"]
+    assert tree(live) == before  # 暂存期间现有世界不变
+    meta = swap_in_restore(str(live), items, "测试")
+    assert meta["state"] == "done"
+    assert tree(live) == {"world/level.dat": "old-level", "world/region/r.0.0.mca": "old-region",
+                          "world_nether/level.dat": "old-nether", "server.properties": "props",
+                          "logs/latest.log": "new-log"}
+    point = read_undo_point(str(live))
+    assert point["label"] == "测试"
+    assert point["items"] == [{"name": "world", "existed": True}, {"name": "world_nether", "existed": False}]
+
+    undo_restore(str(live))
+    assert tree(live) == before
+    assert read_undo_point(str(live)) is None
+    with pytest.raises(RuntimeError):
+        undo_restore(str(live))
+
+
+def test_second_restore_keeps_only_latest_undo_point(server):
+    snap, live = server
+    before = tree(live)
+    swap_in_restore(str(live), stage_restore(snap, str(live), exclude=("logs",)), "第一次")
+    restored = tree(live)
+    write(live, {"world/level.dat": "played-after-restore"})
+    swap_in_restore(str(live), stage_restore(snap, str(live), exclude=("logs",)), "第二次")
+    assert tree(live) == restored
+    assert read_undo_point(str(live))["label"] == "第二次"
+    undo_restore(str(live))
+    assert tree(live)["world/level.dat"] == "played-after-restore"
+    assert tree(live) != before
+
+
+@pytest.mark.parametrize("swapped", [0, 1, 2])
+def test_recover_interrupted_swap(server, swapped):
+    """按 swap_in_restore 的顺序手工做到一半 (模拟崩溃)，恢复后回到还原前"""
+    snap, live = server
+    before = tree(live)
+    items = stage_restore(snap, str(live), exclude=("logs",))
+    stage, undo = live / RESTORE_STAGE_DIR, live / RESTORE_UNDO_DIR
+    undo.mkdir()
+    meta = {"state": "swapping", "label": "", "items": [{"name": n, "existed": (live / n).exists()} for n in items]}
+    (undo / RESTORE_UNDO_META).write_text(json.dumps(meta))
+    for item in meta["items"][:swapped]:
+        if item["existed"]:
+            os.rename(live / item["name"], undo / item["name"])
+        os.rename(stage / item["name"], live / item["name"])
+    if swapped == 0:  # 第一项只挪走了现有数据、暂存的还没换入
+        os.rename(live / "world", undo / "world")
+
+    assert read_undo_point(str(live)) is None
+    assert recover_interrupted_restore(str(live))
+    assert tree(live) == before
+    assert not recover_interrupted_restore(str(live))
+    # 下一次还原可以正常进行
+    swap_in_restore(str(live), stage_restore(snap, str(live), exclude=("logs",)))
+    assert tree(live)["world/level.dat"] == "old-level"
+
+
+def test_engine_undo_holds_job_and_lock(server, monkeypatch):
+    snap, live = server
+    before = tree(live)
+    swap_in_restore(str(live), stage_restore(snap, str(live), exclude=("logs",)), "测试")
+    eng = ServerEngine(str(live))
+    assert eng.undo_point()["label"] == "测试"
+
+    eng.state = ServerEngine.RUNNING
+    with pytest.raises(RuntimeError):
+        eng.undo_restore()
+    eng.state = ServerEngine.STOPPED
+    other = ServerLock(str(live))
+    other.acquire()
+    with pytest.raises(RuntimeError):  # 守护进程等其它管理器进程占用中
+        eng.undo_restore()
+    other.release()
+    assert eng.job is None and eng.undo_point() is not None
+
+    real = mc_backup.undo_restore
+
+    def spy(server_dir):
+        with pytest.raises(RuntimeError):
+            eng.start(str(live / "server.jar"))
+        with pytest.raises(RuntimeError):
+            ServerLock(str(live)).acquire()
+        return real(server_dir)
+    monkeypatch.setattr(mc_backup, "undo_restore", spy)
+    assert eng.undo_restore()["label"] == "测试"
+    assert tree(live) == before and eng.undo_point() is None and eng.job is None
+    with pytest.raises(RuntimeError):
+        eng.undo_restore()
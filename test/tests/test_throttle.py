@@ -0,0 +1,141 @@
+# test_throttle.py
+"""备份节流：令牌桶限速与卡顿暂停 (假时钟)，以及无法设置 idle I/O 优先级时的降级"""
+
+import os
+import threading
+
+import pytest
+
+import mc_backup
+from mc_backup import CopyStats, Throttle, copy_tree, lower_thread_priority
+
+MB = 1024 * 1024
+
+
+class FakeClock:
+    """代替 mc_backup.time：sleep 只推进时钟并记录睡眠时长"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = FakeClock()
+    monkeypatch.setattr(mc_backup, "time", c)
+    return c
+
+
+def test_unlimited_never_sleeps(clock):
+    t = Throttle(0)
+    for _ in range(100):
+        t.consume(64 * MB)
+    assert clock.slept == []
+
+
+def test_burst_then_rate_limited(clock):
+    t = Throttle(2)
+    t.consume(1 * MB)  # 突发额度 0.5 秒 = 1 MB
+    assert clock.slept == []
+    for _ in range(10):
+        t.consume(1 * MB)
+    assert clock.now - 1000.0 == pytest.approx(5.0)  # 10 MB / 2 MB/s
+
+
+def test_idle_time_refills_only_up_to_burst(clock):
+    t = Throttle(1)
+    clock.now += 60  # 空闲很久也不会攒出超过 0.5 秒的额度
+    t.consume(MB // 2)
+    assert clock.slept == []
+    t.consume(MB)
+    assert sum(clock.slept) == pytest.approx(1.0)
+
+
+def test_configure_changes_rate(clock):
+    t = Throttle(1)
+    t.configure(0, idle=False)
+    t.consume(100 * MB)
+    assert clock.slept == [] and not t.idle
+    t.configure(4, idle=True)
+    t.consume(2 * MB + 4 * MB)
+    assert sum(clock.slept) == pytest.approx(1.0)
+
+
+def test_hold_pauses_consumers_and_counts_overlap_once(clock):
+    t = Throttle(0)
+    t.hold(2)
+    t.hold(1)  # 被已有窗口覆盖，不延长
+    assert t.holding and t.paused_total == pytest.approx(2)
+    clock.now += 1
+    t.hold(3)  # 延长到 4 秒处
+    assert t.paused_total == pytest.approx(4)
+    t.consume(1)
+    assert clock.now - 1000.0 == pytest.approx(4)
+    assert not t.holding
+
+
+def run_in_thread(fn):
+    """在单独的线程里执行，降下来的优先级不影响测试线程"""
+    errors = []
+
+    def target():
+        try:
+            fn()
+        except BaseException as e:
+            errors.append(e)
+    th = threading.Thread(target=target)
+    th.start()
+    th.join()
+    return errors
+
+
+@pytest.mark.parametrize("machine", ["sparc64", "x86_64"])
+def test_lower_priority_without_ioprio_still_renices(monkeypatch, machine):
+    calls = []
+    monkeypatch.setattr(mc_backup.sys, "platform", "linux")
+    monkeypatch.setattr(mc_backup.platform, "machine", lambda: machine)
+
+    def no_libc(*args, **kwargs):
+        raise OSError("no libc")
+    monkeypatch.setattr(mc_backup.ctypes, "CDLL", no_libc)
+    monkeypatch.setattr(mc_backup.os, "setpriority", lambda *args: calls.append(args), raising=False)
+    assert run_in_thread(lower_thread_priority) == []
+    # 未知架构跳过 ioprio_set 直接调整 nice；libc 不可用时整个降级静默放弃
+    assert len(calls) == (1 if machine == "sparc64" else 0)
+
+
+def test_lower_priority_ignores_permission_errors(monkeypatch):
+    def denied(*args):
+        raise PermissionError("not allowed")
+    monkeypatch.setattr(mc_backup.sys, "platform", "linux")
+    monkeypatch.setattr(mc_backup.os, "setpriority", denied, raising=False)
+    assert run_in_thread(lower_thread_priority) == []
+
+
+def test_lower_priority_is_noop_elsewhere(monkeypatch):
+    monkeypatch.setattr(mc_backup.sys, "platform", "darwin")
+    monkeypatch.setattr(mc_backup.os, "name", "posix")
+    monkeypatch.setattr(mc_backup.os, "setpriority", lambda *args: pytest.fail("不应调整优先级"), raising=False)
+    assert run_in_thread(lower_thread_priority) == []
+
+
+def test_throttled_copy_works_when_priority_cannot_be_lowered(tmp_path, monkeypatch):
+    def denied(*args):
+        raise PermissionError("not allowed")
+    monkeypatch.setattr(mc_backup.os, "setpriority", denied, raising=False)
+    src = tmp_path / "world"
+    (src / "region").mkdir(parents=True)
+    for i in range(20):
+        (src / "region" / f"r.{i}.0.mca").write_bytes(os.urandom(4096))
+    stats = CopyStats("硬链接", throttle=Throttle(0, idle=True))
+    copy_tree(str(src), str(tmp_path / "out"), stats=stats)
+    assert stats.copied_files == 20
+    assert sorted(os.listdir(tmp_path / "out" / "region")) == sorted(os.listdir(src / "region"))
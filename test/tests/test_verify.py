@@ -0,0 +1,76 @@
+# test_verify.py
+"""校验清单：复制时同时计算哈希、按清单发现损坏，以及多个快照并行校验"""
+
+import os
+import threading
+
+import pytest
+
+import mc_backup
+from mc_backup import CHECKSUMS_NAME, ChecksumRecorder, copy_tree, file_digest, verify_snapshot, verify_snapshots
+
+
+def make_snapshot(tmp_path, name="backup-20240301-101500_manual"):
+    src = tmp_path / "src"
+    (src / "world" / "region").mkdir(parents=True, exist_ok=True)
+    (src / "world" / "level.dat").write_bytes(b"level")
+    (src / "world" / "region" / "r.0.0.mca").write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    dst = tmp_path / name
+    sums = ChecksumRecorder(str(dst))
+    copy_tree(str(src), str(dst), sums=sums)
+    sums.save()
+    return src, dst, sums
+
+
+def test_digest_is_computed_while_copying(tmp_path, monkeypatch):
+    def no_reread(path):
+        raise AssertionError(f"复制后不应重新读取: {path}")
+    monkeypatch.setattr(mc_backup, "file_digest", no_reread)
+    src, dst, sums = make_snapshot(tmp_path)
+    monkeypatch.undo()
+    assert set(sums.files) == {"world/level.dat", "world/region/r.0.0.mca"}
+    for rel, (size, digest) in sums.files.items():
+        assert size == os.path.getsize(src / rel) and digest == file_digest(str(src / rel))
+    assert (dst / "world" / "region" / "r.0.0.mca").read_bytes() == (src / "world" / "region" / "r.0.0.mca").read_bytes()
+
+
+def test_verify_detects_corruption_and_missing_files(tmp_path):
+    _, dst, _ = make_snapshot(tmp_path)
+    assert verify_snapshot(str(dst)) == (2, [])
+    region = dst / "world" / "region" / "r.0.0.mca"
+    data = bytearray(region.read_bytes())
+    data[100] ^= 0xFF
+    region.write_bytes(bytes(data))
+    (dst / "world" / "level.dat").unlink()
+    checked, errors = verify_snapshot(str(dst))
+    assert checked == 2 and len(errors) == 2
+    assert any("r.0.0.mca: 哈希不符" in e for e in errors)
+    (dst / CHECKSUMS_NAME).unlink()
+    assert "缺少校验清单" in verify_snapshot(str(dst))[1][0]
+
+
+def test_verify_snapshots_runs_in_parallel_and_keeps_order(monkeypatch):
+    paths = [f"snap-{i}" for i in range(4)]
+    barrier = threading.Barrier(len(paths), timeout=5)
+
+    def fake(path, workers=None):
+        barrier.wait()  # 所有快照同时在校验时才能通过
+        return int(path[-1]), [] if path != "snap-2" else ["坏了"]
+    monkeypatch.setattr(mc_backup, "verify_snapshot", fake)
+    results = list(verify_snapshots(paths, workers=len(paths)))
+    assert [r[0] for r in results] == paths
+    assert [r[1] for r in results] == [0, 1, 2, 3]
+    assert [r[2] for r in results] == [[], [], ["坏了"], []]
+
+
+def test_verify_snapshots_empty():
+    assert list(verify_snapshots([])) == []
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_verify_snapshots_real(tmp_path, workers):
+    _, a, _ = make_snapshot(tmp_path, "backup-20240301-101500_manual")
+    _, b, _ = make_snapshot(tmp_path, "backup-20240301-101600_manual")
+    (b / "world" / "level.dat").write_bytes(b"tampered")
+    results = list(verify_snapshots([str(a), str(b)], workers))
+    assert results[0][2] == [] and results[1][2] == ["world/level.dat: 大小不符"]
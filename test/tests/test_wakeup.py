@@ -0,0 +1,110 @@
+# test_wakeup.py
+"""事件驱动的控制台唤醒：模拟界面主循环，多线程写入时不丢行、不重复，空闲时没有任何唤醒"""
+
+import queue
+import threading
+import time
+
+from mc_core import LineBatchQueue, ServerEngine, is_state_line
+
+PRODUCERS = 4
+BATCHES = 300
+
+
+class FakeLoop:
+    """代替 Tk 主循环：notify 投递一个事件，主循环线程按 poll_stdout_queue 的方式处理"""
+
+    def __init__(self, eng, fail_first=0):
+        self.eng = eng
+        self.events = queue.Queue()
+        self.posted = 0
+        self.fail_left = fail_first
+        self.shown = []
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def wake(self):
+        # 与 PageManager._wake_console 相同：投递失败时清除标记，下一批重新唤醒
+        if self.fail_left:
+            self.fail_left -= 1
+            self.eng.console_queue.reset_wakeup()
+            return
+        self.posted += 1
+        self.events.put("data")
+
+    def run(self):
+        while self.events.get() != "quit":
+            lines, _ = self.eng.pump_console(5000, time.perf_counter() + 0.025)
+            self.shown.extend(lines)
+            if self.eng.console_queue.rearm():
+                self.events.put("again")  # 相当于 after(1, ...)
+
+    def settle(self):
+        deadline = time.monotonic() + 10
+        while not (self.eng.console_queue.empty() and self.events.empty()) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.05)
+
+
+def make(tmp_path, fail_first=0):
+    q = LineBatchQueue(10 ** 6, keep=is_state_line)
+    eng = ServerEngine(str(tmp_path), console_queue=q)
+    loop = FakeLoop(eng, fail_first)
+    q.notify = loop.wake
+    loop.thread.start()
+    return eng, loop
+
+
+def produce(eng):
+    def worker(i):
+        for b in range(BATCHES):
+            eng._console_out([f"p{i} b{b} l{k}".encode() for k in range(3)])
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(PRODUCERS)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+
+
+def check_complete(shown):
+    assert len(shown) == len(set(shown)) == PRODUCERS * BATCHES * 3
+    for i in range(PRODUCERS):
+        mine = [s for s in shown if s.startswith(f"p{i} ")]
+        assert mine == [f"p{i} b{b} l{k}" for b in range(BATCHES) for k in range(3)]  # 每个写入者内部保持顺序
+
+
+def test_concurrent_producers_lose_nothing_with_few_wakeups(tmp_path):
+    eng, loop = make(tmp_path)
+    produce(eng)
+    loop.settle()
+    check_complete(loop.shown)
+    assert loop.posted < PRODUCERS * BATCHES  # 积压期间的多批写入合并为一次唤醒
+    loop.events.put("quit")
+
+
+def test_idle_queue_posts_no_events(tmp_path):
+    eng, loop = make(tmp_path)
+    eng._console_out([b"hello"])
+    loop.settle()
+    posted = loop.posted
+    time.sleep(0.3)
+    assert loop.posted == posted == 1
+    assert loop.shown == ["hello"]
+    loop.events.put("quit")
+
+
+def test_failed_wakeups_are_retried_by_the_next_batch(tmp_path):
+    eng, loop = make(tmp_path, fail_first=5)
+    for n in range(5):
+        eng._console_out([f"early {n}".encode()])
+    time.sleep(0.1)
+    assert loop.shown == [] and loop.posted == 0  # 唤醒都失败了，但没有卡在"已唤醒"状态
+    eng._console_out([b"late"])
+    loop.settle()
+    assert loop.shown == [f"early {n}" for n in range(5)] + ["late"]
+    loop.events.put("quit")
+
+
+def test_engine_without_queue_publishes_directly(tmp_path):
+    eng = ServerEngine(str(tmp_path))
+    seen = []
+    eng.subscribe(lambda kind, data: kind == "console" and seen.extend(data))
+    eng._console_out([b"direct"])
+    assert seen == ["direct"]